@@ -0,0 +1,203 @@
+"""
+ebayとyahoo_newsで共通の、処理段階ごとの処理時間のヒストグラムとカウンタ。
+バケットの上限値と、Prometheusのテキスト形式やjsonlineファイルへの書き出し方はここで決める。
+"""
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Optional, Sequence
+
+
+# 秒単位の処理時間用のバケット(上限値)
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# バイト数用のバケット(上限値)
+SIZE_BUCKETS = (1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2)
+
+
+class Histogram:
+    """
+    Prometheusのhistogramと同じく、値を上限値ごとのバケットに数えるヒストグラム。
+    """
+    def __init__(self, buckets: Sequence[float]=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # 最後は+Inf
+        self.count = 0
+        self.sum = 0
+
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+    def cumulative_counts(self) -> list[int]:
+        result = []
+        total = 0
+        for i_count in self.counts:
+            total += i_count
+            result.append(total)
+        return result
+
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        q分位点が含まれるバケットの上限値を返す。+Infのバケットに含まれる場合はinfを返す。
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        for i_bound, i_total in zip(self.buckets + (float('inf'),), self.cumulative_counts()):
+            if i_total >= rank:
+                return i_bound
+        return float('inf')
+
+
+class Metrics:
+    """
+    処理段階ごとの処理時間のヒストグラムと、カウンタを集計する。
+
+    ProcessPoolExecutorのワーカーで記録した値は、そのプロセスの中にしか残らない点に注意。
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+
+
+    def observe(self, name: str, value: float, buckets: Sequence[float]=TIME_BUCKETS):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = Histogram(buckets)
+                self.histograms[name] = histogram
+            histogram.observe(value)
+
+
+    def inc(self, name: str, value: float=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+
+    @contextmanager
+    def time(self, name: str):
+        """
+        withブロックの処理時間をnameのヒストグラムに記録する。
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+
+    def snapshot(self) -> dict:
+        """
+        現在の集計値をjsonに変換できるdictで返す。
+        """
+        with self.lock:
+            histograms = {}
+            for name, i_histogram in self.histograms.items():
+                histograms[name] = {
+                    'count': i_histogram.count,
+                    'sum': i_histogram.sum,
+                    'p50': i_histogram.quantile(0.5),
+                    'p90': i_histogram.quantile(0.9),
+                    'p99': i_histogram.quantile(0.99),
+                    'buckets': dict(zip([str(i) for i in i_histogram.buckets] + ['+Inf'],
+                                        i_histogram.cumulative_counts())),
+                }
+            return {
+                'time': time.time(),
+                'elapsed': time.time() - self.started_at,
+                'counters': dict(self.counters),
+                'histograms': histograms,
+            }
+
+
+    def to_prometheus(self) -> str:
+        """
+        集計値をPrometheusのテキスト形式で返す。
+        """
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                lines.append(f'{name} {value}')
+            for name, i_histogram in sorted(self.histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                bounds = [str(i) for i in i_histogram.buckets] + ['+Inf']
+                for i_bound, i_total in zip(bounds, i_histogram.cumulative_counts()):
+                    lines.append(f'{name}_bucket{{le="{i_bound}"}} {i_total}')
+                lines.append(f'{name}_sum {i_histogram.sum}')
+                lines.append(f'{name}_count {i_histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+    def write_prometheus(self, path: str):
+        """
+        node_exporterのtextfile collectorで読めるよう、Prometheusのテキスト形式のファイルを置き換える。
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+    def dump_json(self, path: str):
+        """
+        集計値をjsonlineファイルに1行追記する。
+        """
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.snapshot(), ensure_ascii=False) + '\n')
+
+
+class MetricsDumper:
+    """
+    interval秒ごとに集計値を書き出すスレッド。終了時にも1回書き出す。
+
+    Args:
+        metrics (Metrics): _description_
+        json_path (Optional[str], optional): 指定した場合、jsonlineファイルに集計値を追記する
+        prometheus_path (Optional[str], optional): 指定した場合、Prometheusのテキスト形式で書き出す
+        interval (float, optional): 書き出す間隔(秒). Defaults to 60.
+    """
+    def __init__(self, metrics: Metrics, json_path: Optional[str]=None, prometheus_path: Optional[str]=None,
+                 interval: float=60):
+        self.metrics = metrics
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        self.dump()
+
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+
+    def dump(self):
+        if self.json_path:
+            self.metrics.dump_json(self.json_path)
+        if self.prometheus_path:
+            self.metrics.write_prometheus(self.prometheus_path)
+
+
+# プロセス全体で共有する集計値
+METRICS = Metrics()
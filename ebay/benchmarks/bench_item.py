@@ -0,0 +1,73 @@
+"""
+Item.add_rowのマイクロベンチマーク。
+
+1行ずつpd.concatしていた従来の実装と、列ごとのバッファに追記する現在の実装を比較する。
+ebayディレクトリで`python benchmarks/bench_item.py`として実行する。
+"""
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from scraper import Item
+
+
+COLUMNS = ['maker', 'model number', 'keyword', 'title', 'condition', 'price', 'postage',
+           'import fees', 'duty', 'url']
+ROW_NUMS = [1_000, 10_000, 100_000]
+# 従来の実装はO(n^2)なので、これより多い行数では計測しない
+CONCAT_MAX_ROW_NUM = 10_000
+
+
+class ConcatItem:
+    """
+    比較用の従来の実装。
+    """
+    def __init__(self, columns):
+        self.df = pd.DataFrame(columns=columns)
+        self.columns = columns
+
+
+    def add_row(self, data):
+        if not set(data.keys()).issubset(set(self.columns)):
+            raise ValueError('Data contains columns not in Item.')
+        new_df = pd.DataFrame(data, index=[0])
+        self.df = pd.concat([self.df, new_df], ignore_index=True)
+
+
+def make_row(i: int) -> dict:
+    return {
+        'title': f'Keyboard {i}',
+        'condition': '中古',
+        'price': 10000 + i,
+        'postage': 2000,
+        'import fees': 500,
+        'url': f'https://www.ebay.com/itm/{i}',
+    }
+
+
+def measure(item_class, row_num: int) -> float:
+    rows = [make_row(i) for i in range(row_num)]
+    start = time.perf_counter()
+    item = item_class(COLUMNS)
+    for i_row in rows:
+        item.add_row(i_row)
+    item.df # DataFrameへの変換も計測に含める
+    return time.perf_counter() - start
+
+
+def main():
+    print(f'{"rows":>8} {"concat [s]":>12} {"buffer [s]":>12} {"speedup":>9}')
+    for i_row_num in ROW_NUMS:
+        buffer_time = measure(Item, i_row_num)
+        if i_row_num <= CONCAT_MAX_ROW_NUM:
+            concat_time = measure(ConcatItem, i_row_num)
+            print(f'{i_row_num:>8} {concat_time:>12.3f} {buffer_time:>12.3f} {concat_time / buffer_time:>8.1f}x')
+        else:
+            print(f'{i_row_num:>8} {"-":>12} {buffer_time:>12.3f} {"-":>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+結果のDataFrameをjsonlineの行にするまでのベンチマーク。
+
+--records件の商品について、次の3つの方法で全行をシリアライザで1行にするまでの時間と、変換中のメモリのピークを比較する。
+- to_dict: DataFrame.to_dict(orient='records')で全行のdictのリストを作ってから書き出す(以前の方法)
+- dicts: itertuplesの行を1件ずつdictにして書き出す
+- iter_records: itertuplesの行を1件ずつItemRecordにして書き出す(overwrite_jlの方法)
+ebayディレクトリで`python benchmarks/bench_records.py`として実行する。
+"""
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from records import iter_records
+from scraping import OUTPUT_COLUMNS
+from serializer import SERIALIZER_NAMES, get_serializer
+
+
+RECORD_NUM = 100_000
+
+
+def make_df(record_num: int) -> pd.DataFrame:
+    # write_item_infosと同じく、欠損をNoneにしたobject型のDataFrameにする
+    return pd.DataFrame({
+        'maker': ['kawai'] * record_num,
+        'model number': ['NV10S'] * record_num,
+        'keyword': ['kawai+NV10S'] * record_num,
+        'title': [f'Keyboard {i}' for i in range(record_num)],
+        'condition': ['中古'] * record_num,
+        'price': [10000 + i for i in range(record_num)],
+        'postage': [None if i % 5 == 0 else 2000 for i in range(record_num)],
+        'import fees': [1100] * record_num,
+        'duty': [None] * record_num,
+        'url': [f'https://www.ebay.com/itm/{i}' for i in range(record_num)],
+    }, columns=OUTPUT_COLUMNS, dtype=object)
+
+
+def to_dict_lines(df: pd.DataFrame, serializer) -> str:
+    digest = hashlib.sha256()
+    for i_record in df.to_dict(orient='records'):
+        digest.update(serializer.dumps(i_record) + b'\n')
+    return digest.hexdigest()
+
+
+def dicts_lines(df: pd.DataFrame, serializer) -> str:
+    digest = hashlib.sha256()
+    keys = tuple(OUTPUT_COLUMNS)
+    for i_row in df[OUTPUT_COLUMNS].itertuples(index=False, name=None):
+        digest.update(serializer.dumps(dict(zip(keys, i_row))) + b'\n')
+    return digest.hexdigest()
+
+
+def iter_records_lines(df: pd.DataFrame, serializer) -> str:
+    digest = hashlib.sha256()
+    for i_record in iter_records(df):
+        digest.update(serializer.dumps(i_record) + b'\n')
+    return digest.hexdigest()
+
+
+METHODS = {'to_dict': to_dict_lines, 'dicts': dicts_lines, 'iter_records': iter_records_lines}
+
+
+def run(name: str, df: pd.DataFrame, serializer) -> dict:
+    method = METHODS[name]
+    start = time.perf_counter()
+    digest = method(df, serializer)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    method(df, serializer)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': seconds, 'peak': peak, 'digest': digest}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=RECORD_NUM)
+    parser.add_argument('--serializer', choices=SERIALIZER_NAMES, default='auto')
+    args = parser.parse_args()
+
+    df = make_df(args.records)
+    serializer = get_serializer(args.serializer)
+    print(f'serializer: {serializer.name}')
+    print(f'{"method":>12} {"seconds":>10} {"peak [MB]":>10}')
+    digests = set()
+    for i_name in METHODS:
+        result = run(i_name, df, serializer)
+        digests.add(result['digest'])
+        print(f'{i_name:>12} {result["seconds"]:>10.3f} {result["peak"] / 1e6:>10.1f}')
+    print('Output is identical for all methods.' if len(digests) == 1 else 'WARNING: Output differs.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+フィクスチャストアを使ったオフラインのベンチマーク。ネットワークには接続しない。
+
+- parse_list: 一覧ページからのリンクの抽出(pages/s)
+- parse_detail: 詳細ページからの情報の抽出(pages/s)
+- normalize: 抽出した情報の型の変換(items/s)
+- list_urls: リプレイサーバーに対するscrape_detail_urls(keywords/s)
+- end_to_end: リプレイサーバーに対するfetch_item_infoでの詳細ページの取得と抽出(items/s)
+
+各ベンチマークは別のプロセスで実行し、そのプロセスのピークRSSも記録する。
+--storeを指定しない場合は合成のページでフィクスチャストアを作る。
+--baselineに以前の--outputの結果を指定すると、スループットかピークRSSが--toleranceを超えて
+悪化したときに終了コード1で終わるので、CIで性能の劣化を検出できる。
+ebayディレクトリで`python benchmarks/bench_replay.py`として実行する。
+"""
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import traceback
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+from fixtures import FixtureStore, ReplayServer, make_sample_store
+from scraper import Scraper
+from throttle import AutoThrottle
+from scraping import (LIST_PAGE_EXTRACTOR, CONCURRENT_REQUESTS, ITEM_NUM_IN_PAGE, parse_item_info,
+                      scrape_detail_urls, fetch_item_info)
+from normalizer import normalize_item_infos
+
+
+REPEAT_NUM = 3
+TOLERANCE = 0.2
+
+
+def create_replay_scraper(server: ReplayServer) -> Scraper:
+    # リクエスト間隔を0に固定して、待ち時間が結果に入らないようにする
+    throttle = AutoThrottle(0, max_delay=0)
+    return Scraper(server.base_url, download_delay=0, max_workers=CONCURRENT_REQUESTS, throttle=throttle)
+
+
+def bench_parse_list(store_dir: str) -> dict:
+    texts = list(FixtureStore(store_dir).texts())
+    texts = [i for i in texts if 'srp-results' in i]
+    start = time.perf_counter()
+    for _ in range(REPEAT_NUM):
+        for i_text in texts:
+            LIST_PAGE_EXTRACTOR.extract(i_text)
+    return {'count': len(texts) * REPEAT_NUM, 'seconds': time.perf_counter() - start, 'unit': 'pages'}
+
+
+def bench_parse_detail(store_dir: str) -> dict:
+    store = FixtureStore(store_dir)
+    texts = list(store.texts(prefix=store.origin + '/itm/'))
+    start = time.perf_counter()
+    for _ in range(REPEAT_NUM):
+        for i_text in texts:
+            parse_item_info(i_text)
+    return {'count': len(texts) * REPEAT_NUM, 'seconds': time.perf_counter() - start, 'unit': 'pages'}
+
+
+def bench_normalize(store_dir: str) -> dict:
+    store = FixtureStore(store_dir)
+    urls = store.urls(prefix=store.origin + '/itm/')
+    raw_infos = [dict(parse_item_info(store.load(i_url)[1]), url=i_url) for i_url in urls]
+    start = time.perf_counter()
+    for _ in range(REPEAT_NUM):
+        normalize_item_infos(raw_infos)
+    return {'count': len(raw_infos) * REPEAT_NUM, 'seconds': time.perf_counter() - start, 'unit': 'items'}
+
+
+def bench_list_urls(store_dir: str) -> dict:
+    store = FixtureStore(store_dir)
+    with ReplayServer(store) as server, create_replay_scraper(server) as scraper:
+        start = time.perf_counter()
+        for i_url in store.keywords.values():
+            scrape_detail_urls(scraper, server.local_url(i_url), ITEM_NUM_IN_PAGE)
+        seconds = time.perf_counter() - start
+    return {'count': len(store.keywords), 'seconds': seconds, 'unit': 'keywords'}
+
+
+def bench_end_to_end(store_dir: str) -> dict:
+    store = FixtureStore(store_dir)
+    with ReplayServer(store) as server, create_replay_scraper(server) as scraper:
+        urls = [server.local_url(i) for i in store.urls(prefix=store.origin + '/itm/')]
+        start = time.perf_counter()
+        item_infos = list(scraper.map(fetch_item_info, urls))
+        seconds = time.perf_counter() - start
+    failed_num = sum(i is None for i in item_infos)
+    return {'count': len(item_infos) - failed_num, 'failed': failed_num, 'seconds': seconds, 'unit': 'items'}
+
+
+BENCHMARKS = {
+    'parse_list': bench_parse_list,
+    'parse_detail': bench_parse_detail,
+    'normalize': bench_normalize,
+    'list_urls': bench_list_urls,
+    'end_to_end': bench_end_to_end,
+}
+
+
+def run_in_process(name: str, store_dir: str, result_queue: multiprocessing.Queue):
+    try:
+        result = BENCHMARKS[name](store_dir)
+    except Exception:
+        # 親プロセスが結果を待ち続けないよう、例外も結果として返す
+        result_queue.put({'error': traceback.format_exc()})
+        return
+    result['rate'] = result['count'] / result['seconds']
+    # Linuxではru_maxrssの単位はKiB
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    result_queue.put(result)
+
+
+def run(name: str, store_dir: str) -> dict:
+    """
+    ベンチマークを新しいプロセスで実行する。親プロセスのメモリがピークRSSに含まれないようspawnを使う。
+    """
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=run_in_process, args=(name, store_dir, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    if 'error' in result:
+        raise RuntimeError(f'Benchmark "{name}" failed.\n{result["error"]}')
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    baselineより悪化したベンチマークの説明のリストを返す。
+    """
+    regressions = []
+    for name, i_result in results.items():
+        if name not in baseline:
+            continue
+        if i_result['rate'] < baseline[name]['rate'] * (1 - tolerance):
+            regressions.append(f'{name}: {i_result["rate"]:.1f} {i_result["unit"]}/s '
+                               f'(baseline {baseline[name]["rate"]:.1f})')
+        if i_result['peak_rss_mb'] > baseline[name]['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f'{name}: peak RSS {i_result["peak_rss_mb"]:.1f} MB '
+                               f'(baseline {baseline[name]["peak_rss_mb"]:.1f})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', default=None, help='フィクスチャストアのディレクトリ。省略すると合成のページを使う。')
+    parser.add_argument('--only', nargs='*', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--output', default=None, help='結果を書き出すjsonファイル')
+    parser.add_argument('--baseline', default=None, help='比較する以前の結果のjsonファイル')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_dir = args.store
+        if store_dir is None:
+            store_dir = os.path.join(tmp_dir, 'store')
+            make_sample_store(store_dir)
+
+        results = {}
+        print(f'{"benchmark":>14} {"rate":>12} {"unit":>10} {"count":>7} {"peak RSS [MB]":>14}')
+        for i_name in args.only:
+            result = run(i_name, store_dir)
+            results[i_name] = result
+            print(f'{i_name:>14} {result["rate"]:>12.1f} {result["unit"] + "/s":>10} {result["count"]:>7} '
+                  f'{result["peak_rss_mb"]:>14.1f}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for i_regression in regressions:
+            print(f'REGRESSION: {i_regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+jsonlineファイルの読み書きに使うシリアライザのベンチマーク。
+
+--lines行(既定は100万行)の結果ファイルについて、インストールされているシリアライザごとに次の時間を計測する。
+- write: JsonLinesWriterでキーワードごとに書き込む(overwrite_jl)
+- index: インデックスを作り直す(--restartでのread_jl)
+- read: すべての行を読み込む(write_excel)
+また、書き出したファイルがシリアライザによらず同じになることを確かめる。
+ebayディレクトリで`python benchmarks/bench_serializer.py`として実行する。
+"""
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from jsonl import JsonLinesWriter, build_index, index_path_of
+from serializer import SERIALIZERS, get_serializer
+
+
+LINE_NUM = 1_000_000
+ITEM_NUM_PER_KEYWORD = 200
+
+
+def make_records(line_num: int) -> list[dict]:
+    records = []
+    for i in range(line_num):
+        keyword_id = i // ITEM_NUM_PER_KEYWORD
+        records.append({
+            'maker': f'メーカー{keyword_id % 20}',
+            'model number': f'MODEL-{keyword_id}',
+            'keyword': f'メーカー{keyword_id % 20}+MODEL-{keyword_id}',
+            'title': f'Keyboard キーボード {i}',
+            'condition': '中古',
+            'price': 10000 + i,
+            'postage': None if i % 5 == 0 else 2000,
+            'import fees': 1100,
+            'duty': None,
+            'url': f'https://www.ebay.com/itm/{100000000000 + i}',
+        })
+    return records
+
+
+def run(name: str, records: list[dict], directory: str) -> dict:
+    serializer = get_serializer(name)
+    jl_path = os.path.join(directory, f'results-{name}.jl')
+
+    start = time.perf_counter()
+    with JsonLinesWriter(jl_path, fsync_batch_size=len(records), serializer=serializer) as writer:
+        for i in range(0, len(records), ITEM_NUM_PER_KEYWORD):
+            writer.write(records[i:i + ITEM_NUM_PER_KEYWORD])
+    write_seconds = time.perf_counter() - start
+
+    os.remove(index_path_of(jl_path))
+    start = time.perf_counter()
+    build_index(jl_path, serializer)
+    index_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(jl_path, 'rb') as f:
+        for line in f:
+            serializer.loads(line)
+    read_seconds = time.perf_counter() - start
+
+    with open(jl_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return {'write': write_seconds, 'index': index_seconds, 'read': read_seconds, 'digest': digest}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=LINE_NUM)
+    args = parser.parse_args()
+
+    records = make_records(args.lines)
+    names = [i_name for i_name, (_, i_module) in SERIALIZERS.items() if i_module is not None]
+    digests = set()
+    print(f'{"serializer":>10} {"write [s]":>10} {"index [s]":>10} {"read [s]":>10}')
+    with tempfile.TemporaryDirectory() as directory:
+        for i_name in names:
+            result = run(i_name, records, directory)
+            digests.add(result['digest'])
+            print(f'{i_name:>10} {result["write"]:>10.2f} {result["index"]:>10.2f} {result["read"]:>10.2f}')
+    print('Output is identical for all serializers.' if len(digests) == 1 else 'WARNING: Output differs.')
+
+
+if __name__ == '__main__':
+    main()
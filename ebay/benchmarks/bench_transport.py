@@ -0,0 +1,170 @@
+"""
+Scraperのトランスポートのベンチマーク。
+
+ローカルのスタブサーバーから詳細ページ相当のHTMLを並列に取得し、次の3つを比較する。
+- bare: 従来どおりの素のrequests.Session
+- requests: transport.create_session('requests')で作成した、プールと圧縮を設定したSession
+- http2: transport.create_session('http2')で作成したhttpxのクライアント
+
+スタブサーバーは平文のHTTP/1.1なので、http2もHTTP/1.1で接続する(HTTP/2はTLSのALPNで選ばれる)。
+HTTP/2での多重化を計測する場合は、--urlでHTTP/2に対応したhttpsのURLを指定する。
+ebayディレクトリで`python benchmarks/bench_transport.py`として実行する。
+"""
+import os
+import sys
+import gzip
+import time
+import random
+import socket
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from transport import create_session
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+BODY_SIZE = 200 * 1024
+LATENCY = 0.02
+REQUEST_NUM = 500
+WORKER_NUMS = [1, 4, 16, 32]
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Accept-Encodingに応じてbr/gzipで圧縮したHTMLを返すスタブサーバー。
+    開いたコネクション数と送ったバイト数を数える。
+    """
+    daemon_threads = True
+
+
+    def __init__(self, body: bytes, latency: float):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.bodies = {'identity': body, 'gzip': gzip.compress(body)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(body)
+        self.latency = latency
+        self.connection_num = 0
+        self.sent_bytes = 0
+        self.lock = threading.Lock()
+
+
+    def reset(self):
+        with self.lock:
+            self.connection_num = 0
+            self.sent_bytes = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-aliveを有効にする
+
+
+    def setup(self):
+        super().setup()
+        # ヘッダーとbodyを別々に書き込むので、Nagleアルゴリズムで遅延しないようにする
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connection_num += 1
+
+
+    def do_GET(self):
+        accept_encoding = self.headers.get('Accept-Encoding', '')
+        encoding = 'identity'
+        for i_encoding in ('br', 'gzip'):
+            if i_encoding in accept_encoding and i_encoding in self.server.bodies:
+                encoding = i_encoding
+                break
+        body = self.server.bodies[encoding]
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.sent_bytes += len(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_body(size: int) -> bytes:
+    # 詳細ページと同じく、タグの繰り返しが多く、値は行ごとに異なるHTMLにする
+    rng = random.Random(0)
+    rows = []
+    length = 0
+    while length < size:
+        row = (f'<div class="ux-layout-section__row"><span class="ux-textspans">'
+               f'{rng.getrandbits(64):x} JPY {rng.randrange(100000):,}</span></div>\n')
+        rows.append(row)
+        length += len(row)
+    return ('<html><body>' + ''.join(rows) + '</body></html>').encode('utf-8')
+
+
+def create_client(name: str, pool_size: int):
+    if name == 'bare':
+        return requests.Session()
+    return create_session(name, pool_size=pool_size)
+
+
+def run(name: str, base_url: str, request_num: int, worker_num: int) -> float:
+    """
+    request_num件のリクエストをworker_num並列で送り、1秒あたりのリクエスト数を返す。
+    """
+    client = create_client(name, worker_num)
+    urls = [f'{base_url}/itm/{i}' for i in range(request_num)]
+
+    def fetch(url):
+        response = client.get(url)
+        assert response.status_code == 200
+        return len(response.content)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=worker_num) as executor:
+        list(executor.map(fetch, urls))
+    elapsed = time.perf_counter() - start
+    client.close()
+    return request_num / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default=None, help='指定した場合、スタブサーバーの代わりにこのURLに送る。')
+    parser.add_argument('--requests', type=int, default=REQUEST_NUM)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server = StubServer(make_body(BODY_SIZE), LATENCY)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        print(f'brotli: {"available" if brotli is not None else "not installed"}')
+
+    print(f'{"transport":>10} {"workers":>8} {"req/s":>10} {"connections":>12} {"sent bytes":>12}')
+    for i_worker_num in WORKER_NUMS:
+        for i_name in ('bare', 'requests', 'http2'):
+            if server is not None:
+                server.reset()
+            rate = run(i_name, base_url, args.requests, i_worker_num)
+            connection_num = server.connection_num if server is not None else '-'
+            sent_bytes = server.sent_bytes if server is not None else '-'
+            print(f'{i_name:>10} {i_worker_num:>8} {rate:>10.1f} {connection_num:>12} {sent_bytes:>12}')
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
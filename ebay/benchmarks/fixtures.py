@@ -0,0 +1,231 @@
+"""
+オフラインのベンチマーク用に、取得したHTMLを保存しておくフィクスチャストアと、
+それをローカルのHTTPサーバーから返すリプレイサーバー。
+
+フィクスチャストアはディレクトリで、manifest.jsonとgzip圧縮したHTMLからなる。
+manifest.jsonには、URLごとのファイル名とステータスコード、記録元のオリジン、
+検索キーワードごとの一覧ページ1ページ目のURLを記録する。
+"""
+import os
+import gzip
+import json
+import random
+import hashlib
+import threading
+import urllib.parse
+from types import SimpleNamespace
+from typing import Optional, Iterator
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from scraping import BASE_URL, get_first_list_page_url, get_list_page_url
+
+
+MANIFEST_FILE_NAME = 'manifest.json'
+ORIGIN = 'https://www.ebay.com'
+
+
+class FixtureStore:
+    """
+    URLをキーにHTMLを保存するフィクスチャストア。
+    """
+    def __init__(self, path: str, origin: str=ORIGIN):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest = {'origin': origin, 'keywords': {}, 'pages': {}}
+        manifest_path = os.path.join(path, MANIFEST_FILE_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+
+
+    @property
+    def origin(self) -> str:
+        return self.manifest['origin']
+
+
+    @property
+    def keywords(self) -> dict:
+        """
+        検索キーワードと一覧ページ1ページ目のURLのdict。
+        """
+        return self.manifest['keywords']
+
+
+    def add_keyword(self, keyword: str, first_list_page_url: str):
+        self.manifest['keywords'][keyword] = first_list_page_url
+
+
+    def save(self, url: str, text: str, status: int=200):
+        file_name = hashlib.sha256(url.encode('utf-8')).hexdigest() + '.html.gz'
+        with gzip.open(os.path.join(self.path, file_name), 'wt', encoding='utf-8') as f:
+            f.write(text)
+        self.manifest['pages'][url] = {'file': file_name, 'status': status}
+
+
+    def load(self, url: str) -> Optional[tuple[int, str]]:
+        """
+        URLの(ステータスコード, HTML)を返す。記録されていなければNoneを返す。
+        """
+        page = self.manifest['pages'].get(url)
+        if page is None:
+            return None
+        with gzip.open(os.path.join(self.path, page['file']), 'rt', encoding='utf-8') as f:
+            return page['status'], f.read()
+
+
+    def urls(self, prefix: str='') -> list[str]:
+        return [i for i in self.manifest['pages'] if i.startswith(prefix)]
+
+
+    def texts(self, prefix: str='') -> Iterator[str]:
+        for i_url in self.urls(prefix):
+            yield self.load(i_url)[1]
+
+
+    def write_manifest(self):
+        tmp_path = os.path.join(self.path, MANIFEST_FILE_NAME + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_FILE_NAME))
+
+
+def path_of(url: str) -> str:
+    """
+    URLのパスとクエリを返す。リプレイサーバーはこれでページを探す。
+    """
+    parts = urllib.parse.urlsplit(url)
+    return parts.path + ('?' + parts.query if parts.query else '')
+
+
+def normalize_path(path: str) -> str:
+    # クライアントによってキーワードの空白などのエスケープが異なるので、エスケープを外して比べる
+    return urllib.parse.unquote_plus(path)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    フィクスチャストアのページを返すローカルのHTTPサーバー。
+    ページ中の記録元のオリジンはこのサーバーのURLに置き換えるので、リンクをたどってもサーバー内で完結する。
+    記録されていないページには404を返す。
+    """
+    daemon_threads = True
+
+
+    def __init__(self, store: FixtureStore):
+        super().__init__(('127.0.0.1', 0), ReplayHandler)
+        self.store = store
+        self.base_url = f'http://127.0.0.1:{self.server_port}'
+        self.pages = {normalize_path(path_of(i_url)): i_url for i_url in store.urls()}
+        self.bodies = {}
+        self.lock = threading.Lock()
+
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        self.server_close()
+
+
+    def local_url(self, url: str) -> str:
+        return self.base_url + path_of(url)
+
+
+    def get_body(self, path: str) -> Optional[tuple[int, bytes]]:
+        path = normalize_path(path)
+        url = self.pages.get(path)
+        if url is None:
+            return None
+        with self.lock:
+            if path not in self.bodies:
+                status, text = self.store.load(url)
+                self.bodies[path] = (status, text.replace(self.store.origin, self.base_url).encode('utf-8'))
+            return self.bodies[path]
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+
+    def do_GET(self):
+        if self.path == '/robots.txt' and '/robots.txt' not in self.server.pages:
+            status, body = 200, b'User-agent: *\nAllow: /\n'
+        else:
+            page = self.server.get_body(self.path)
+            status, body = page if page is not None else (404, b'Not Found')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_sample_store(path: str, keyword_num: int=3, item_num: int=150, item_num_in_page: int=60,
+                      padding_size: int=50 * 1024, seed: int=0) -> FixtureStore:
+    """
+    記録したページがない環境(CIなど)のために、実際のページと同じセレクタで抽出できる
+    合成のページでフィクスチャストアを作る。
+
+    Args:
+        path (str): フィクスチャストアのディレクトリ
+        keyword_num (int, optional): 検索キーワード数. Defaults to 3.
+        item_num (int, optional): キーワードごとの商品数. Defaults to 150.
+        item_num_in_page (int, optional): 一覧ページ1ページあたりの商品数. Defaults to 60.
+        padding_size (int, optional): 実際のページの大きさに近づけるために加えるHTMLの大きさ. Defaults to 50*1024.
+        seed (int, optional): _description_. Defaults to 0.
+
+    Returns:
+        FixtureStore: _description_
+    """
+    rng = random.Random(seed)
+    sample_scraper = SimpleNamespace(base_url=BASE_URL)
+    padding = ''.join(f'<div class="pad"><span>{rng.getrandbits(64):x}</span></div>'
+                      for _ in range(padding_size // 48))
+    store = FixtureStore(path)
+    for i_keyword in range(keyword_num):
+        keyword = f'Maker{i_keyword}+Model{i_keyword}'
+        first_url = get_first_list_page_url(sample_scraper, {'keyword': keyword, '最低価格': 1000},
+                                            item_num_in_page)
+        store.add_keyword(keyword, first_url)
+        item_ids = [(i_keyword + 1) * 1_000_000 + i for i in range(item_num)]
+        for i_page, start in enumerate(range(0, item_num, item_num_in_page), start=1):
+            page_ids = item_ids[start:start + item_num_in_page]
+            url = first_url if i_page == 1 else get_list_page_url(first_url, i_page)
+            store.save(url, make_sample_list_page(item_num, page_ids, padding))
+        for i_id in item_ids:
+            store.save(f'{ORIGIN}/itm/{i_id}', make_sample_detail_page(i_id, rng, padding))
+    store.write_manifest()
+    return store
+
+
+def make_sample_list_page(total_item_num: int, item_ids: list[int], padding: str) -> str:
+    items = ''.join(
+        f'<li class="s-item s-item__pl-on-bottom"><div class="s-item__info">'
+        f'<a class="s-item__link" href="{ORIGIN}/itm/{i}?hash=item{i:x}">Keyboard {i}</a></div></li>'
+        for i in item_ids
+    )
+    return (f'<html><body><div id="mainContent"><h1 class="srp-controls__count">{total_item_num}件の結果</h1>'
+            f'{padding}<ul class="srp-results srp-list">{items}</ul></div></body></html>')
+
+
+def make_sample_detail_page(item_id: int, rng: random.Random, padding: str) -> str:
+    postage = '無料' if rng.random() < 0.2 else f'JPY {rng.randrange(1000, 5000):,}'
+    return (
+        f'<html><head><title>Keyboard {item_id}</title></head><body>{padding}'
+        f'<h1 class="x-item-title__mainTitle"><span>Ｋｅｙｂｏａｒｄ　{item_id}</span></h1>'
+        f'<div class="x-item-condition-value"><span class="clipped">中古</span></div>'
+        f'<div class="x-buybox__price-section"><div class="x-price-approx">約 JPY {rng.randrange(5000, 50000):,}</div></div>'
+        f'<div class="vim d-shipping-minview">'
+        f'<div class="ux-layout-section__row">送料: {postage} 国際郵便</div>'
+        f'<div class="ux-layout-section__row">輸入手数料: JPY {rng.randrange(100, 2000):,}</div>'
+        f'<div class="ux-layout-section__row">関税: 無料</div>'
+        f'<div class="ux-layout-section__row">お届け日</div></div>'
+        f'</body></html>'
+    )
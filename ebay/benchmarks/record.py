@@ -0,0 +1,73 @@
+"""
+ベンチマーク用に、実際のeBayのページをフィクスチャストアに記録する。
+
+入力のExcelファイルの先頭から--keywords件の検索条件について、一覧ページをすべてと、
+詳細ページを--items件まで記録する。Scraperを使うので、robots.txtとリクエスト間隔は守られる。
+ebayディレクトリで`python benchmarks/record.py fixtures/ebay`として実行する。
+"""
+import os
+import re
+import sys
+import math
+import argparse
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+from fixtures import FixtureStore
+from scraping import (INPUT_PATH, LIST_PAGE_EXTRACTOR, ITEM_NUM_IN_PAGE, create_scraper, read_excel,
+                      get_first_list_page_url, get_list_page_url)
+
+
+def record_keyword(scraper, store: FixtureStore, search_criteria: dict, item_num: int):
+    """
+    1つの検索条件の一覧ページと詳細ページを記録する。
+
+    Args:
+        scraper (Scraper): _description_
+        store (FixtureStore): _description_
+        search_criteria (dict): _description_
+        item_num (int): 記録する詳細ページの最大数
+    """
+    first_url = get_first_list_page_url(scraper, search_criteria)
+    scraper.get(first_url, success_message=f'Recorded "{first_url}"')
+    store.save(first_url, scraper.text)
+    store.add_keyword(search_criteria['keyword'], first_url)
+
+    page = LIST_PAGE_EXTRACTOR.extract(scraper.text)
+    hrefs = list(page['hrefs'])
+    total_page_num = math.ceil(int(re.search(r'(\d+)件', page['heading'])[1]) / ITEM_NUM_IN_PAGE)
+    for i_page in range(2, total_page_num + 1):
+        url = get_list_page_url(first_url, i_page)
+        scraper.get(url, success_message=f'Recorded "{url}"')
+        store.save(url, scraper.text)
+        hrefs.extend(LIST_PAGE_EXTRACTOR.extract(scraper.text)['hrefs'])
+
+    detail_urls = list(dict.fromkeys(i.split('?')[0] for i in hrefs))[:item_num]
+    for i_url in detail_urls:
+        try:
+            scraper.get(i_url, success_message=f'Recorded "{i_url}"')
+        except Exception as e:
+            print(e)
+            continue
+        store.save(i_url, scraper.text)
+    store.write_manifest()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('store_dir', help='フィクスチャストアのディレクトリ')
+    parser.add_argument('--input', default=INPUT_PATH)
+    parser.add_argument('--keywords', type=int, default=3, help='記録する検索条件の数')
+    parser.add_argument('--items', type=int, default=100, help='検索条件ごとに記録する詳細ページの最大数')
+    args = parser.parse_args()
+
+    store = FixtureStore(args.store_dir)
+    with create_scraper() as scraper:
+        for i_criteria in itertools.islice(read_excel(args.input), args.keywords):
+            record_keyword(scraper, store, i_criteria, args.items)
+    print(f'Recorded {len(store.urls())} pages into "{args.store_dir}".')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+
+
+class CacheEntry:
+    """
+    キャッシュされた1つのレスポンス。
+    """
+    def __init__(self, key: str, url: str, etag: Optional[str], last_modified: Optional[str],
+                 stored_at: float, size: int):
+        self.key = key
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+        self.size = size
+
+
+class ResponseCache:
+    """
+    URLをキーにレスポンスのbodyをgzip圧縮してディスクに保存するキャッシュ。
+
+    TTL以内のエントリはそのまま使い、TTLを過ぎたエントリはETag/Last-Modifiedを使って
+    条件付きリクエストで再検証する。合計サイズがmax_sizeを超えた場合、最も長く使われていない
+    エントリから削除する。
+    """
+    def __init__(self, cache_dir: str, ttl: Union[float, int]=24 * 60 * 60, max_size: int=1024 ** 3):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load_entries()
+
+
+    def load_entries(self):
+        """
+        キャッシュディレクトリのメタデータを読み込み、最終アクセス時刻順に並べる。
+        """
+        entries = []
+        for i_name in os.listdir(self.cache_dir):
+            if not i_name.endswith('.json'):
+                continue
+            key = i_name[:-len('.json')]
+            try:
+                with open(self.meta_path(key), 'r') as f:
+                    meta = json.load(f)
+                accessed_at = os.path.getmtime(self.body_path(key))
+            except (OSError, ValueError):
+                continue
+            entries.append((accessed_at, CacheEntry(key=key, **meta)))
+
+        self.entries = OrderedDict()
+        self.total_size = 0
+        for _, i_entry in sorted(entries, key=lambda x: x[0]):
+            self.entries[i_entry.key] = i_entry
+            self.total_size += i_entry.size
+
+
+    def make_key(self, url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+    def meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.json')
+
+
+    def body_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.html.gz')
+
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """
+        URLに対応するエントリを返す。存在しなければNoneを返す。
+        エントリがないか、TTLを過ぎている(再検証が必要な)場合はミスとして数える。
+        """
+        with self.lock:
+            entry = self.entries.get(self.make_key(url))
+            if entry is None or not self.is_fresh(entry):
+                self.misses += 1
+        return entry
+
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.stored_at < self.ttl
+
+
+    def conditional_headers(self, entry: Optional[CacheEntry]) -> dict:
+        """
+        再検証のための条件付きリクエストヘッダーを返す。
+        """
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+
+    def read(self, entry: CacheEntry, revalidated: bool=False) -> Optional[str]:
+        """
+        エントリのbodyを読み込む。読み込めなかった場合はエントリを削除してNoneを返す。
+        TTL以内のエントリを読み込めた場合はヒット、読み込めなかった場合はミスとして数える。
+
+        Args:
+            entry (CacheEntry): _description_
+            revalidated (bool, optional): 304で再検証されたエントリならTrue. Defaults to False.
+
+        Returns:
+            Optional[str]: body
+        """
+        try:
+            with gzip.open(self.body_path(entry.key), 'rt', encoding='utf-8') as f:
+                text = f.read()
+        except OSError:
+            with self.lock:
+                if not revalidated:
+                    self.misses += 1
+                self.remove(entry.key)
+            return None
+
+        with self.lock:
+            if revalidated:
+                # TTLを過ぎたエントリなので、lookupでミスとして数えている
+                self.revalidations += 1
+                entry.stored_at = time.time()
+                self.write_meta(entry)
+            else:
+                self.hits += 1
+            self.touch(entry)
+        return text
+
+
+    def store(self, url: str, response) -> CacheEntry:
+        """
+        レスポンスをキャッシュに保存する。
+
+        Args:
+            url (str): リクエストしたURL
+            response (requests.Response): _description_
+
+        Returns:
+            CacheEntry: _description_
+        """
+        key = self.make_key(url)
+        body = gzip.compress(response.text.encode('utf-8'))
+        tmp_path = self.body_path(key) + f'.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, self.body_path(key))
+
+        entry = CacheEntry(key=key, url=response.url, etag=response.headers.get('ETag'),
+                           last_modified=response.headers.get('Last-Modified'),
+                           stored_at=time.time(), size=len(body))
+        with self.lock:
+            self.write_meta(entry)
+            if key in self.entries:
+                self.total_size -= self.entries[key].size
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self.total_size += entry.size
+            self.evict()
+        return entry
+
+
+    def write_meta(self, entry: CacheEntry):
+        meta = {
+            'url': entry.url,
+            'etag': entry.etag,
+            'last_modified': entry.last_modified,
+            'stored_at': entry.stored_at,
+            'size': entry.size,
+        }
+        tmp_path = self.meta_path(entry.key) + f'.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path(entry.key))
+
+
+    def touch(self, entry: CacheEntry):
+        """
+        エントリを最近使われたものとして扱う。最終アクセス時刻はbodyファイルの更新時刻に記録する。
+        """
+        if entry.key in self.entries:
+            self.entries.move_to_end(entry.key)
+        try:
+            os.utime(self.body_path(entry.key))
+        except OSError:
+            pass
+
+
+    def evict(self):
+        """
+        合計サイズがmax_size以下になるまで、最も長く使われていないエントリから削除する。
+        """
+        while self.total_size > self.max_size and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            self.remove(key)
+
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_size -= entry.size
+        for i_path in (self.meta_path(key), self.body_path(key)):
+            try:
+                os.remove(i_path)
+            except FileNotFoundError:
+                pass
+
+
+    def stats(self) -> str:
+        return (f'hits: {self.hits}, misses: {self.misses}, revalidations: {self.revalidations}, '
+                f'entries: {len(self.entries)}, size: {self.total_size} bytes')
@@ -0,0 +1,155 @@
+import json
+import sqlite3
+import threading
+from typing import Optional
+
+
+PENDING = 'pending'
+DONE = 'done'
+WRITTEN = 'written'
+FAILED = 'failed'
+
+
+class Checkpoint:
+    """
+    検索キーワードごとの詳細ページURLと、その取得状態を記録するSQLiteのジャーナル。
+
+    詳細ページの状態は次のように遷移する。
+    - pending: 一覧ページから取得しただけで、まだ詳細ページを取得していない
+    - done: 詳細ページから情報を取得したが、まだjsonlineファイルに書き出していない
+    - written: jsonlineファイルに書き出した
+    - failed: 詳細ページの取得に失敗した(再試行待ち)
+    """
+    def __init__(self, path: str, timeout: float=30):
+        self.path = path
+        self.lock = threading.Lock()
+        # シャーディング時は複数のプロセスから同じファイルを使うので、ロック待ちのタイムアウトを長めにとる
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS keywords ('
+                'keyword TEXT PRIMARY KEY, criteria TEXT NOT NULL)'
+            )
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS items ('
+                'keyword TEXT NOT NULL, position INTEGER NOT NULL, url TEXT NOT NULL, '
+                'state TEXT NOT NULL, info TEXT, attempts INTEGER NOT NULL DEFAULT 0, '
+                'PRIMARY KEY (keyword, position))'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS items_state ON items (state)')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        self.conn.close()
+
+
+    def clear(self):
+        """
+        記録をすべて削除する。
+        """
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM items')
+            self.conn.execute('DELETE FROM keywords')
+
+
+    def add_keyword(self, keyword: str, criteria: dict, urls: list[str]):
+        """
+        検索キーワードと、一覧ページから取得した詳細ページのURLを記録する。
+
+        Args:
+            keyword (str): _description_
+            criteria (dict): 検索条件
+            urls (list[str]): 詳細ページのURL
+        """
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO keywords VALUES (?, ?)',
+                              (keyword, json.dumps(criteria, ensure_ascii=False, default=str)))
+            self.conn.execute('DELETE FROM items WHERE keyword = ?', (keyword,))
+            self.conn.executemany('INSERT INTO items (keyword, position, url, state) VALUES (?, ?, ?, ?)',
+                                  [(keyword, i, i_url, PENDING) for i, i_url in enumerate(urls)])
+
+
+    def has_keyword(self, keyword: str) -> bool:
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM keywords WHERE keyword = ?', (keyword,)).fetchone()
+        return row is not None
+
+
+    def get_criteria(self, keyword: str) -> Optional[dict]:
+        with self.lock:
+            row = self.conn.execute('SELECT criteria FROM keywords WHERE keyword = ?', (keyword,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+    def is_complete(self, keyword: str) -> bool:
+        """
+        検索キーワードの詳細ページをすべて処理し終えたか(書き出し済みか再試行待ち)を返す。
+        """
+        if not self.has_keyword(keyword):
+            return False
+        with self.lock:
+            row = self.conn.execute('SELECT COUNT(*) FROM items WHERE keyword = ? AND state IN (?, ?)',
+                                    (keyword, PENDING, DONE)).fetchone()
+        return row[0] == 0
+
+
+    def get_urls(self, keyword: str, state: str) -> list[tuple[int, str]]:
+        """
+        検索キーワードの詳細ページのうち、指定した状態のものを(position, url)のリストで返す。
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT position, url FROM items WHERE keyword = ? AND state = ? '
+                                     'ORDER BY position', (keyword, state)).fetchall()
+        return rows
+
+
+    def get_failed_keywords(self) -> list[str]:
+        with self.lock:
+            rows = self.conn.execute('SELECT DISTINCT keyword FROM items WHERE state = ?',
+                                     (FAILED,)).fetchall()
+        return [i[0] for i in rows]
+
+
+    def count_items(self, state: str) -> int:
+        with self.lock:
+            row = self.conn.execute('SELECT COUNT(*) FROM items WHERE state = ?', (state,)).fetchone()
+        return row[0]
+
+
+    def mark_done(self, keyword: str, position: int, info: dict):
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE items SET state = ?, info = ?, attempts = attempts + 1 '
+                              'WHERE keyword = ? AND position = ?',
+                              (DONE, json.dumps(info, ensure_ascii=False), keyword, position))
+
+
+    def mark_failed(self, keyword: str, position: int):
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE items SET state = ?, attempts = attempts + 1 '
+                              'WHERE keyword = ? AND position = ?', (FAILED, keyword, position))
+
+
+    def get_done_infos(self, keyword: str) -> list[tuple[int, dict]]:
+        """
+        取得済みで未書き出しの情報を(position, info)のリストで返す。
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT position, info FROM items WHERE keyword = ? AND state = ? '
+                                     'ORDER BY position', (keyword, DONE)).fetchall()
+        return [(i_position, json.loads(i_info)) for i_position, i_info in rows]
+
+
+    def mark_written(self, keyword: str, positions: list[int]):
+        with self.lock, self.conn:
+            self.conn.executemany('UPDATE items SET state = ?, info = NULL WHERE keyword = ? AND position = ?',
+                                  [(WRITTEN, keyword, i) for i in positions])
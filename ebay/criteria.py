@@ -0,0 +1,146 @@
+"""
+入力のExcelファイルから検索条件を1件ずつ読み込む。
+
+openpyxlの読み込み専用モードでシートを1行ずつ読むので、ワークブック全体をメモリに載せず、
+最初の検索条件はすぐに返る。
+最後まで読み込んだ検索条件はjsonlineファイルにキャッシュし、ワークブックが変わっていなければ
+次回からはキャッシュを読み込む。
+"""
+import os
+import hashlib
+from typing import Iterator, Optional
+
+from openpyxl import load_workbook
+
+from serializer import JsonSerializer, default_serializer
+
+
+HEADER_ROW = 2 # 1行目はタイトル、2行目が列名
+MAKER_COLUMN = 'メーカー'
+MODEL_NUMBER_COLUMN = '製品型番'
+CACHE_VERSION = 1
+
+
+def iter_criteria(input_path: str, cache_dir: Optional[str]=None,
+                  serializer: Optional[JsonSerializer]=None) -> Iterator[dict]:
+    """
+    検索条件dictを1件ずつ返す。
+
+    cache_dirを指定した場合、ワークブックのサイズと更新時刻が前回と同じならキャッシュから読み込む。
+    そうでなければワークブックから読み込みながらキャッシュを作り、最後まで読み込んだときに保存する。
+
+    Args:
+        input_path (str): _description_
+        cache_dir (Optional[str], optional): キャッシュを置くディレクトリ. Defaults to None.
+        serializer (Optional[JsonSerializer], optional): _description_. Defaults to None.
+
+    Yields:
+        Iterator[dict]: _description_
+    """
+    if cache_dir is None:
+        yield from iter_excel_criteria(input_path)
+        return
+
+    serializer = serializer or default_serializer()
+    cache_path = cache_path_of(cache_dir, input_path)
+    source = source_of(input_path)
+    cached = read_cache(cache_path, source, serializer)
+    if cached is not None:
+        yield from cached
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(serializer.dumps(source) + b'\n')
+            for i_criteria in iter_excel_criteria(input_path):
+                f.write(serializer.dumps(i_criteria) + b'\n')
+                yield i_criteria
+        os.replace(tmp_path, cache_path)
+    finally:
+        # 途中で読むのをやめた場合は、不完全なキャッシュを残さない
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def iter_excel_criteria(input_path: str) -> Iterator[dict]:
+    """
+    ワークブックのシートを順に1行ずつ読み込み、検索条件dictを返す。
+
+    各シートの2行目を列名とする。メーカーが空の行は、そのシートの最初の行のメーカーで埋める。
+    keywordは「メーカー+製品型番」。空の行は読み飛ばす。
+
+    Args:
+        input_path (str): _description_
+
+    Yields:
+        Iterator[dict]: _description_
+    """
+    workbook = load_workbook(input_path, read_only=True, data_only=True)
+    try:
+        for i_sheet in workbook.worksheets:
+            yield from iter_sheet_criteria(i_sheet)
+    finally:
+        workbook.close()
+
+
+def iter_sheet_criteria(sheet) -> Iterator[dict]:
+    rows = sheet.iter_rows(min_row=HEADER_ROW, values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    # pandas.read_excelと同じく、名前のない列はUnnamed: <列番号>とする
+    columns = [i_name if i_name is not None else f'Unnamed: {i}' for i, i_name in enumerate(header)]
+
+    maker = None
+    for i_row in rows:
+        if all(i_value is None for i_value in i_row):
+            continue
+        criteria = dict(zip(columns, i_row))
+        if maker is None:
+            maker = criteria[MAKER_COLUMN]
+        if criteria[MAKER_COLUMN] is None:
+            criteria[MAKER_COLUMN] = maker
+        criteria['keyword'] = f'{criteria[MAKER_COLUMN]}+{criteria[MODEL_NUMBER_COLUMN]}'
+        yield criteria
+
+
+def cache_path_of(cache_dir: str, input_path: str) -> str:
+    digest = hashlib.sha256(os.path.abspath(input_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{os.path.basename(input_path)}.{digest}.jl')
+
+
+def source_of(input_path: str) -> dict:
+    """
+    キャッシュが有効かどうかを判定するための、ワークブックの情報。
+    """
+    stat = os.stat(input_path)
+    return {'version': CACHE_VERSION, 'path': os.path.abspath(input_path),
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def read_cache(cache_path: str, source: dict, serializer: JsonSerializer) -> Optional[Iterator[dict]]:
+    """
+    キャッシュがワークブックと一致していれば、検索条件dictを1件ずつ返すイテレータを返す。
+    一致していなければNoneを返す。
+    """
+    try:
+        f = open(cache_path, 'rb')
+    except OSError:
+        return None
+    try:
+        cached_source = serializer.loads(f.readline())
+    except ValueError:
+        cached_source = None
+    if cached_source != source:
+        f.close()
+        return None
+    print(f'Read cached search criteria: "{cache_path}"')
+    return iter_cache(f, serializer)
+
+
+def iter_cache(f, serializer: JsonSerializer) -> Iterator[dict]:
+    with f:
+        for line in f:
+            yield serializer.loads(line)
@@ -0,0 +1,97 @@
+from typing import Optional
+
+import lxml.html
+from lxml import etree
+from cssselect import HTMLTranslator
+
+from metrics import METRICS
+
+
+TRANSLATOR = HTMLTranslator()
+
+
+def compile_selector(selector: str) -> etree.XPath:
+    """
+    CSSセレクタをXPathにコンパイルする。
+    BeautifulSoupのselectと同じく、起点の要素自身は対象に含めない。
+
+    Args:
+        selector (str): CSSセレクタ
+
+    Returns:
+        etree.XPath: コンパイル済みのXPath
+    """
+    return etree.XPath(TRANSLATOR.css_to_xpath(selector, prefix='descendant::'))
+
+
+class Field:
+    """
+    ページから抽出する1つの項目。
+
+    Args:
+        selector (str): 項目の要素を選択するCSSセレクタ
+        scope (str, optional): 指定した場合、最初に一致した要素の中だけでselectorを探す
+        many (bool, optional): Trueならselectorに一致したすべての要素の値をリストで返す
+        sub (str, optional): 指定した場合、selectorに一致した要素の中で最初に一致した要素の値を返す
+        attr (str, optional): 指定した場合、テキストではなく属性値を返す
+    """
+    def __init__(self, selector: str, scope: Optional[str]=None, many: bool=False,
+                 sub: Optional[str]=None, attr: Optional[str]=None):
+        self.selector = compile_selector(selector)
+        self.scope = compile_selector(scope) if scope else None
+        self.many = many
+        self.sub = compile_selector(sub) if sub else None
+        self.attr = attr
+
+
+    def extract(self, root: etree._Element):
+        if self.scope is not None:
+            scope_elements = self.scope(root)
+            if not scope_elements:
+                return None
+            root = scope_elements[0]
+
+        elements = self.selector(root)
+        if not self.many:
+            elements = elements[:1]
+        values = [self.get_value(i) for i in elements]
+        if self.many:
+            return values
+        return values[0] if values else None
+
+
+    def get_value(self, element: etree._Element):
+        if self.sub is not None:
+            sub_elements = self.sub(element)
+            if not sub_elements:
+                return None
+            element = sub_elements[0]
+        if self.attr:
+            return element.get(self.attr)
+        return element.text_content()
+
+
+class Extractor:
+    """
+    ページ種別ごとのセレクタをあらかじめコンパイルしておき、
+    HTMLを1回だけパースしてすべての項目を抽出する。
+    """
+    def __init__(self, fields: dict[str, Field]):
+        self.fields = fields
+
+
+    def extract(self, text: str) -> dict:
+        """
+        HTMLから各項目の値を抽出する。
+        見つからなかった項目はNone(manyの場合は空リスト)になる。
+
+        Args:
+            text (str): HTML
+
+        Returns:
+            dict: 項目名と値のdict
+        """
+        with METRICS.time('ebay_parse_seconds'):
+            root = lxml.html.document_fromstring(text)
+        with METRICS.time('ebay_extract_seconds'):
+            return {name: field.extract(root) for name, field in self.fields.items()}
@@ -0,0 +1,207 @@
+import os
+from typing import Iterable, Optional, Union
+
+from records import ItemRecord
+from serializer import JsonSerializer, default_serializer
+
+
+def index_path_of(jl_path: str) -> str:
+    return jl_path + '.idx'
+
+
+class JsonLinesWriter:
+    """
+    jsonlineファイルにレコードを1行ずつ追記するライター。
+
+    書き込みのたびにOSへflushするのでプロセスが落ちてもレコードは失われない。
+    fsyncはfsync_batch_size件ごとにまとめて行う。
+    また、キーワードごとの書き込み位置をサイドカーのインデックスファイル(<jl_path>.idx)に記録する。
+    インデックスファイルにはwriteで書き込んだ連続する同じキーワードのレコードごとに1行追記し、
+    read_indexで読み込むときに、続けて書き込んだ同じキーワードの行を1つのエントリにまとめる。
+    レコードはserializerで1行にする。serializerを省略するとorjsonなどの速いものを使う。
+    """
+    def __init__(self, jl_path: str, fsync_batch_size: int=1000, keyword_key: str='keyword',
+                 serializer: Optional[JsonSerializer]=None):
+        self.jl_path = jl_path
+        self.index_path = index_path_of(jl_path)
+        self.fsync_batch_size = fsync_batch_size
+        self.keyword_key = keyword_key
+        self.serializer = serializer or default_serializer()
+        # 既存のインデックスが古い場合は、追記する前に作り直しておく
+        build_index(jl_path, self.serializer)
+        self.file = open(jl_path, 'ab')
+        self.index_file = open(self.index_path, 'ab')
+        self.unsynced_num = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def write(self, records: Iterable[Union[ItemRecord, dict]]):
+        """
+        レコードを追記する。連続する同じキーワードのレコードごとにインデックスを1行追記する。
+
+        Args:
+            records (Iterable[Union[ItemRecord, dict]]): _description_
+        """
+        # 1行ずつwriteせず、まとめて書き込む。インデックスはレコードを書き込んでから書き込む
+        lines = []
+        entries = []
+        keyword = None
+        offset = end = self.file.tell()
+        count = 0
+        for i_record in records:
+            if count and i_record.get(self.keyword_key) != keyword:
+                entries.append({'keyword': keyword, 'offset': offset, 'count': count, 'end': end})
+                offset = end
+                count = 0
+            keyword = i_record.get(self.keyword_key)
+            line = self.serializer.dumps(i_record) + b'\n'
+            lines.append(line)
+            end += len(line)
+            count += 1
+        if count:
+            entries.append({'keyword': keyword, 'offset': offset, 'count': count, 'end': end})
+
+        self.file.write(b''.join(lines))
+        self.file.flush()
+        for i_entry in entries:
+            self.write_index(i_entry)
+        self.index_file.flush()
+        if self.unsynced_num >= self.fsync_batch_size:
+            self.sync()
+
+
+    def write_index(self, entry: dict):
+        self.index_file.write(self.serializer.dumps(entry) + b'\n')
+        self.unsynced_num += entry['count']
+
+
+    def sync(self):
+        """
+        書き込んだ内容をディスクに同期する。
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.index_file.flush()
+        os.fsync(self.index_file.fileno())
+        self.unsynced_num = 0
+
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.sync()
+        self.file.close()
+        self.index_file.close()
+
+
+def read_index(jl_path: str, serializer: Optional[JsonSerializer]=None) -> list[dict]:
+    """
+    インデックスを読み込む。インデックスがjsonlineファイルと食い違っている場合はNoneを返す。
+    パイプラインではバッチごとにインデックスの行を書き込むので、続けて書き込んだ同じキーワードの行はまとめる。
+
+    Args:
+        jl_path (str): _description_
+        serializer (Optional[JsonSerializer], optional): _description_. Defaults to None.
+
+    Returns:
+        list[dict]: インデックスのエントリ
+    """
+    index_path = index_path_of(jl_path)
+    jl_size = os.path.getsize(jl_path) if os.path.exists(jl_path) else 0
+    if not os.path.exists(index_path):
+        return [] if jl_size == 0 else None
+
+    serializer = serializer or default_serializer()
+    entries = []
+    with open(index_path, 'rb') as f:
+        for line in f:
+            try:
+                entries.append(serializer.loads(line))
+            except ValueError:
+                # 書き込み途中で落ちた行
+                return None
+    end = entries[-1]['end'] if entries else 0
+    if end != jl_size:
+        return None
+    return merge_entries(entries)
+
+
+def merge_entries(entries: list[dict]) -> list[dict]:
+    """
+    続けて書き込んだ同じキーワードのエントリを1つにまとめる。
+    """
+    merged = []
+    for i_entry in entries:
+        if merged and merged[-1]['keyword'] == i_entry['keyword'] and merged[-1]['end'] == i_entry['offset']:
+            merged[-1] = {**merged[-1], 'count': merged[-1]['count'] + i_entry['count'], 'end': i_entry['end']}
+        else:
+            merged.append(i_entry)
+    return merged
+
+
+def build_index(jl_path: str, serializer: Optional[JsonSerializer]=None) -> list[dict]:
+    """
+    インデックスを返す。インデックスが古い場合はjsonlineファイル全体を読んで作り直す。
+
+    書き込みの途中でプロセスが落ちて、最後の行が改行で終わらず読み込めない場合は、その行を切り捨てる。
+    その行のレコードはチェックポイントで書き出し済みになっていないので、再開したときに書き直される。
+
+    Args:
+        jl_path (str): _description_
+        serializer (Optional[JsonSerializer], optional): _description_. Defaults to None.
+
+    Returns:
+        list[dict]: インデックスのエントリ
+    """
+    serializer = serializer or default_serializer()
+    entries = read_index(jl_path, serializer)
+    if entries is not None:
+        return entries
+
+    entries = []
+    if not os.path.exists(jl_path):
+        open(jl_path, 'ab').close()
+    truncate_at = None
+    with open(jl_path, 'rb') as f:
+        offset = 0
+        for line in f:
+            end = offset + len(line)
+            if line.strip():
+                try:
+                    keyword = serializer.loads(line)['keyword']
+                except ValueError:
+                    if line.endswith(b'\n'):
+                        raise
+                    truncate_at = offset
+                    break
+                if entries and entries[-1]['keyword'] == keyword:
+                    entries[-1]['count'] += 1
+                    entries[-1]['end'] = end
+                else:
+                    entries.append({'keyword': keyword, 'offset': offset, 'count': 1, 'end': end})
+            offset = end
+    if truncate_at is not None:
+        print(f'WARNING: Truncated a partially written line at the end of "{jl_path}".')
+        os.truncate(jl_path, truncate_at)
+        offset = truncate_at
+    elif offset and not line.endswith(b'\n'):
+        # 改行で終わっていない最後の行(以前の形式のファイル)のあとに追記できるようにする
+        with open(jl_path, 'ab') as f:
+            f.write(b'\n')
+        offset += 1
+    if entries:
+        entries[-1]['end'] = offset
+
+    tmp_path = index_path_of(jl_path) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        for i_entry in entries:
+            f.write(serializer.dumps(i_entry) + b'\n')
+    os.replace(tmp_path, index_path_of(jl_path))
+    return entries
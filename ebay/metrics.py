@@ -0,0 +1,8 @@
+"""
+処理段階ごとの集計値。実装はyahoo_newsと共通の、リポジトリ直下のcommon/metrics.pyにある。
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.metrics import TIME_BUCKETS, SIZE_BUCKETS, Histogram, Metrics, MetricsDumper, METRICS
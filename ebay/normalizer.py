@@ -0,0 +1,104 @@
+"""
+詳細ページから抽出した文字列を、出力する型の列に変換する。
+
+詳細ページの取得中は文字列を抽出するだけにしておき、変換は書き出しの前に
+検索キーワード(またはパイプラインのバッチ)ごとにまとめて、pandasの.strの操作で行う。
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+
+NON_DIGIT_PATTERN = re.compile(r'\D')
+CHARGE_PATTERN = re.compile(r'JPY\s*([\d,]+)')
+FREE_WORD = '無料'
+# 配送欄の行に含まれる語と列名。1つの行に複数の語が含まれる場合は先のものを使う
+CHARGE_LABELS = {'送料': 'postage', '輸入手数料': 'import fees', '関税': 'duty'}
+CHARGE_COLUMNS = list(CHARGE_LABELS.values())
+TITLE_NORMALIZATION = 'NFKD'
+
+
+def normalize_item_infos(raw_infos: list[dict]) -> pd.DataFrame:
+    """
+    詳細ページから抽出した文字列のdictのリストを、型を変換したDataFrameにする。
+
+    Args:
+        raw_infos (list[dict]): title、condition、price(価格の文字列)、shipping_rows(配送欄の行の文字列のリスト)、urlのdict
+
+    Returns:
+        pd.DataFrame: title、condition、price、postage、import fees、duty、urlの列。
+            料金の列は欠損のあるInt64型で、料金が無料か記載がない場合は欠損になる。
+    """
+    raw = pd.DataFrame(raw_infos)
+    if raw.empty:
+        return raw
+    if 'shipping_rows' not in raw:
+        raw['shipping_rows'] = None
+    # 以前の形式(取得時に変換済み)でチェックポイントに記録された行はそのまま使う
+    is_raw = raw['shipping_rows'].notna()
+    legacy = cast_legacy(raw[~is_raw].drop(columns='shipping_rows'))
+    raw = raw[is_raw]
+    if raw.empty:
+        return legacy
+
+    result = pd.DataFrame(index=raw.index)
+    result['title'] = raw['title'].str.strip().str.normalize(TITLE_NORMALIZATION)
+    result['condition'] = raw['condition']
+    result['price'] = raw['price'].str.replace(NON_DIGIT_PATTERN, '', regex=True).astype('int64')
+    result = result.join(parse_charges(raw['shipping_rows']))
+    result['url'] = raw['url']
+    if legacy.empty:
+        return result
+    return pd.concat([legacy, result]).sort_index()
+
+
+def cast_legacy(legacy: pd.DataFrame) -> pd.DataFrame:
+    """
+    以前の形式の行の価格と料金の列を、変換した行と同じ型にする。
+    料金に欠損があるとfloat64になり、そのままではjsonlineファイルに5.0のように書き出されるため。
+
+    Args:
+        legacy (pd.DataFrame): _description_
+
+    Returns:
+        pd.DataFrame: _description_
+    """
+    legacy = legacy.copy()
+    if legacy.empty:
+        return legacy
+    legacy['price'] = legacy['price'].astype('int64')
+    for i_column in CHARGE_COLUMNS:
+        if i_column not in legacy:
+            legacy[i_column] = None
+        legacy[i_column] = legacy[i_column].astype('Int64')
+    return legacy
+
+
+def parse_charges(shipping_rows: pd.Series) -> pd.DataFrame:
+    """
+    配送欄の行から、送料、輸入手数料、関税の料金を取り出す。
+
+    Args:
+        shipping_rows (pd.Series): 商品ごとの配送欄の行の文字列のリスト
+
+    Returns:
+        pd.DataFrame: shipping_rowsと同じインデックスで、CHARGE_COLUMNSの列を持つDataFrame
+    """
+    # 1行に1つの配送欄の行にして、商品のインデックスはそのまま残す
+    rows = shipping_rows.explode().dropna()
+    # 関税や配送日の行など同じ文字列の行が多いので、異なる文字列ごとに1回だけ処理する
+    codes, unique_rows = pd.factorize(rows)
+    unique_rows = pd.Series(unique_rows, dtype=object)
+    unique_amounts = unique_rows.str.extract(CHARGE_PATTERN, expand=False)
+    unique_amounts = unique_amounts.where(~unique_rows.str.contains(FREE_WORD, regex=False))
+    unique_amounts = unique_amounts.str.replace(',', '', regex=False).astype('float64')
+    unique_labels = np.select([unique_rows.str.contains(i, regex=False) for i in CHARGE_LABELS], CHARGE_COLUMNS,
+                              default='')
+
+    charges = pd.DataFrame({'label': unique_labels[codes], 'amount': unique_amounts.to_numpy()[codes]},
+                           index=rows.index)
+    # 無料(0円)の料金は記録しない。同じ項目の行が複数ある場合は後の行の料金を使う
+    charges = charges[(charges['label'] != '') & charges['amount'].notna() & (charges['amount'] != 0)]
+    charges = charges.groupby([charges.index, 'label'])['amount'].last().unstack('label')
+    return charges.reindex(index=shipping_rows.index, columns=CHARGE_COLUMNS).astype('Int64')
@@ -0,0 +1,185 @@
+"""
+結果をmakerでパーティション分割したParquetのデータセットに書き出す。
+
+データセットはHive形式のディレクトリで、<dataset_path>/maker=<メーカー>/part-*.parquetからなる。
+JsonLinesWriterの代わりに使えるよう、同じくwriteでレコードを追記する。
+writeのたびにメーカーごとに1つのファイル(1つの行グループ)を書き出すので、書き出したレコードは
+プロセスが落ちても失われず、複数のプロセスから同じデータセットに書き出せる。
+closeでは、この実行で書き出したファイルをメーカーごとに1つのファイルにまとめ、小さなファイルが増え続けないようにする。
+
+pandasでは`pd.read_parquet(dataset_path, filters=[('maker', '==', ...)])`のように、
+必要なメーカーや列だけを読み込める。欠損のある料金の列をfloatにせず整数のまま読み込むには、
+dtype_backend='numpy_nullable'を指定する。
+"""
+import os
+import re
+import time
+import itertools
+import urllib.parse
+from typing import Iterable, Union
+
+from records import ItemRecord
+
+
+PARTITION_COLUMN = 'maker'
+# writeで書き出すファイルはpart-<時刻>-<pid>-<通し番号>.parquet、closeでまとめたファイルはpart-<時刻>-<pid>.parquet
+PART_FILE_PATTERN = re.compile(r'(part-\d+-\d+)-\d+\.parquet')
+COMPACTED_FILE_PATTERN = re.compile(r'part-\d+-\d+\.parquet')
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError('Parquet output requires pyarrow. Install it with "pip install pyarrow".')
+    return pyarrow
+
+
+class ParquetDatasetWriter:
+    """
+    レコードをmakerでパーティション分割したParquetのデータセットに追記するライター。
+
+    Args:
+        dataset_path (str): データセットのディレクトリ
+        compression (str, optional): _description_. Defaults to 'zstd'.
+    """
+    def __init__(self, dataset_path: str, compression: str='zstd'):
+        self.pa = import_pyarrow()
+        self.dataset_path = dataset_path
+        self.compression = compression
+        self.schema = make_schema(self.pa)
+        self.string_columns = [i_field.name for i_field in self.schema if i_field.type == self.pa.string()]
+        # 他のプロセスや以前の実行のファイルと名前が重ならないようにする
+        self.file_prefix = f'part-{time.time_ns()}-{os.getpid()}'
+        self.file_num = itertools.count()
+        # メーカーのディレクトリ -> この実行で書き出したファイルのパスのリスト
+        self.file_paths = {}
+        remove_compacted_parts(dataset_path)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def write(self, records: Iterable[Union[ItemRecord, dict]]):
+        """
+        レコードを追記する。メーカーごとに1つのファイルを書き出す。
+
+        Args:
+            records (Iterable[Union[ItemRecord, dict]]): _description_
+        """
+        partitions = {}
+        for i_record in records:
+            partitions.setdefault(i_record[PARTITION_COLUMN], []).append(i_record)
+
+        for i_maker, i_records in partitions.items():
+            columns = {i_field.name: [i_record.get(i_field.name) for i_record in i_records]
+                       for i_field in self.schema}
+            # Excelで数値のセルの製品型番はintなので、文字列の列に合わせる
+            for i_name in self.string_columns:
+                columns[i_name] = [i if i is None or isinstance(i, str) else str(i) for i in columns[i_name]]
+            table = self.pa.Table.from_pydict(columns, schema=self.schema)
+            self.write_table(i_maker, table)
+
+
+    def write_table(self, maker: str, table):
+        directory = os.path.join(self.dataset_path,
+                                 f'{PARTITION_COLUMN}={urllib.parse.quote(str(maker), safe="")}')
+        os.makedirs(directory, exist_ok=True)
+        file_name = f'{self.file_prefix}-{next(self.file_num)}.parquet'
+        # 書き込み途中のファイルを読まないよう、データセットの読み込みで無視される.で始まる名前で書いてから置き換える
+        tmp_path = os.path.join(directory, '.' + file_name + '.tmp')
+        self.pa.parquet.write_table(table, tmp_path, compression=self.compression)
+        file_path = os.path.join(directory, file_name)
+        os.replace(tmp_path, file_path)
+        self.file_paths.setdefault(directory, []).append(file_path)
+
+
+    def close(self):
+        for i_directory, i_paths in self.file_paths.items():
+            if len(i_paths) > 1:
+                self.compact(i_directory, i_paths)
+        self.file_paths = {}
+
+
+    def compact(self, directory: str, file_paths: list[str]):
+        """
+        メーカーのディレクトリに書き出したファイルを、1つのファイルにまとめる。
+        writeごとの行グループはそのまま残す。
+
+        まとめたファイルは書き終えてから置き換えるので、まとめたファイルがあれば元のファイルはすべて含まれている。
+        元のファイルを消す前にプロセスが落ちた場合は、次にデータセットを開いたときにremove_compacted_partsで消す。
+
+        Args:
+            directory (str): _description_
+            file_paths (list[str]): _description_
+        """
+        file_name = f'{self.file_prefix}.parquet'
+        tmp_path = os.path.join(directory, '.' + file_name + '.tmp')
+        with self.pa.parquet.ParquetWriter(tmp_path, self.schema, compression=self.compression) as writer:
+            for i_path in file_paths:
+                writer.write_table(self.pa.parquet.read_table(i_path, schema=self.schema))
+        os.replace(tmp_path, os.path.join(directory, file_name))
+        for i_path in file_paths:
+            os.remove(i_path)
+
+
+def remove_compacted_parts(dataset_path: str):
+    """
+    まとめたファイルがあるのに残っている、writeで書き出したファイルを消す。
+
+    Args:
+        dataset_path (str): _description_
+    """
+    if not os.path.isdir(dataset_path):
+        return
+    for i_directory in os.scandir(dataset_path):
+        if not i_directory.is_dir():
+            continue
+        file_names = os.listdir(i_directory.path)
+        compacted = {i_name[:-len('.parquet')] for i_name in file_names if COMPACTED_FILE_PATTERN.fullmatch(i_name)}
+        for i_name in file_names:
+            match = PART_FILE_PATTERN.fullmatch(i_name)
+            if match is not None and match.group(1) in compacted:
+                os.remove(os.path.join(i_directory.path, i_name))
+
+
+def make_schema(pa):
+    """
+    データセットのスキーマ。makerはディレクトリ名で表すので列には含めない。
+    conditionは値の種類が少ないので辞書型(pandasではcategory)にする。
+    """
+    return pa.schema([
+        ('model number', pa.string()),
+        ('keyword', pa.string()),
+        ('title', pa.string()),
+        ('condition', pa.dictionary(pa.int32(), pa.string())),
+        ('price', pa.int64()),
+        ('postage', pa.int64()),
+        ('import fees', pa.int64()),
+        ('duty', pa.int64()),
+        ('url', pa.string()),
+    ])
+
+
+def read_keywords(dataset_path: str) -> set:
+    """
+    データセットに書き出し済みの検索キーワードを返す。keywordの列だけを読み込む。
+
+    Args:
+        dataset_path (str): _description_
+
+    Returns:
+        set: _description_
+    """
+    if not os.path.exists(dataset_path):
+        return set()
+    pa = import_pyarrow()
+    dataset = pa.dataset.dataset(dataset_path, format='parquet', partitioning='hive')
+    return set(dataset.to_table(columns=['keyword']).column('keyword').to_pylist())
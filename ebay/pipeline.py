@@ -0,0 +1,184 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from scraper import Scraper
+
+
+END = object()
+
+
+class Failure:
+    """
+    ステージで発生した例外を次のステージに伝えるための入れ物。
+    """
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+class Pipeline:
+    """
+    詳細ページのダウンロード、HTMLのパース、書き出しを別々のステージで行うパイプライン。
+
+    - fetchステージ: scraper.mapで並列にダウンロードし、(url, text)を出力する
+    - parseステージ: ProcessPoolExecutorのワーカーでparse_func(url, text)を実行し、dictを出力する
+    - writeステージ: 呼び出し元のスレッドでdictをbatch_size件ずつwrite_funcに渡す
+
+    ステージ間は大きさqueue_sizeのキューでつながっているので、URLが多くてもメモリ使用量は増えない。
+    parser_numが0の場合、パースはプロセスプールを使わずparseステージのスレッドで行う。
+    """
+    def __init__(self, scraper: Scraper, fetch_func: Callable, parse_func: Callable,
+                 parser_num: int=2, queue_size: int=64, batch_size: int=60,
+                 on_parse_error: Optional[Callable]=None):
+        self.scraper = scraper
+        self.fetch_func = fetch_func
+        self.parse_func = parse_func
+        self.parser_num = parser_num
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.on_parse_error = on_parse_error
+        self.executor = None
+        self.stopped = threading.Event()
+
+
+    def __enter__(self):
+        if self.parser_num > 0:
+            self.executor = ProcessPoolExecutor(max_workers=self.parser_num)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+    def run(self, urls: Iterable[str], write_func: Callable[[list[dict]], None], total: Optional[int]=None):
+        """
+        urlsの詳細ページを取得・パースし、write_funcで書き出す。
+        書き出しの順序はurlsの順序と同じになる。
+
+        Args:
+            urls (Iterable[str]): 詳細ページのURL
+            write_func (Callable[[list[dict]], None]): 抽出した情報のリストを書き出す関数
+            total (Optional[int], optional): 進捗表示に使うURLの総数. Defaults to None.
+        """
+        self.stopped.clear()
+        fetch_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            threading.Thread(target=self.fetch_stage, args=(urls, fetch_queue), daemon=True),
+            threading.Thread(target=self.parse_stage, args=(fetch_queue, write_queue), daemon=True),
+        ]
+        for i_thread in threads:
+            i_thread.start()
+
+        try:
+            self.write_stage(write_queue, write_func, total)
+        finally:
+            self.stopped.set()
+            for i_thread in threads:
+                i_thread.join()
+
+
+    def put(self, q: queue.Queue, obj):
+        """
+        キューに空きができるまで待って追加する。ただし、パイプラインが停止した場合は諦める。
+        """
+        while not self.stopped.is_set():
+            try:
+                q.put(obj, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+    def get(self, q: queue.Queue):
+        """
+        キューから取り出す。ただし、パイプラインが停止した場合はENDを返す。
+        """
+        while not self.stopped.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return END
+
+
+    def fetch_stage(self, urls: Iterable[str], fetch_queue: queue.Queue):
+        pages = self.scraper.map(self.fetch_func, urls)
+        try:
+            for url, text in pages:
+                if not self.put(fetch_queue, (url, text)):
+                    return
+        except BaseException as e:
+            self.put(fetch_queue, Failure(e))
+            return
+        finally:
+            pages.close()
+        self.put(fetch_queue, END)
+
+
+    def parse_stage(self, fetch_queue: queue.Queue, write_queue: queue.Queue):
+        futures = deque()
+        try:
+            while True:
+                obj = self.get(fetch_queue)
+                if obj is END or isinstance(obj, Failure):
+                    break
+                url, text = obj
+                if self.executor is None:
+                    if not self.put(write_queue, self.parse(url, text)):
+                        return
+                    continue
+                futures.append((url, self.executor.submit(self.parse_func, url, text)))
+                # パース待ちのページが溜まりすぎないようにする
+                if len(futures) >= max(self.parser_num, 1) * 2:
+                    if not self.put(write_queue, self.result(*futures.popleft())):
+                        return
+            while futures:
+                if not self.put(write_queue, self.result(*futures.popleft())):
+                    return
+        except BaseException as e:
+            self.put(write_queue, Failure(e))
+            return
+        self.put(write_queue, obj)
+
+
+    def parse(self, url: str, text: str) -> dict:
+        try:
+            return self.parse_func(url, text)
+        except Exception as e:
+            if self.on_parse_error is None:
+                raise e
+            return self.on_parse_error(url, e)
+
+
+    def result(self, url: str, future) -> dict:
+        try:
+            return future.result()
+        except Exception as e:
+            if self.on_parse_error is None:
+                raise e
+            return self.on_parse_error(url, e)
+
+
+    def write_stage(self, write_queue: queue.Queue, write_func: Callable, total: Optional[int]):
+        batch = []
+        i = 0
+        while True:
+            obj = write_queue.get()
+            if obj is END:
+                break
+            if isinstance(obj, Failure):
+                raise obj.exception
+            i += 1
+            print(f'Item {i}/{total if total is not None else "?"}:', obj)
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                write_func(batch)
+                batch = []
+        if batch:
+            write_func(batch)
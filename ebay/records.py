@@ -0,0 +1,95 @@
+"""
+jsonlineファイルやParquetのデータセットに書き出す、商品1件のレコード。
+
+ItemRecordのフィールド名とjsonlineファイルのキー(出力の列名)はRECORD_FIELDSで対応させる。
+msgspecがインストールされていれば、ItemRecordはキーの名前を変えたmsgspec.Structになり、
+シリアライザがdictを作らずに直接1行にする。なければ__slots__のdataclassになり、to_dictでdictにしてから書き出す。
+"""
+from dataclasses import make_dataclass
+from typing import Iterator, Optional, Union
+
+import pandas as pd
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+# (フィールド名, jsonlineファイルのキー, 型)。この順序で出力する
+RECORD_FIELDS = [
+    ('maker', 'maker', str),
+    # Excelで数値のセルの製品型番はint
+    ('model_number', 'model number', Union[str, int]),
+    ('keyword', 'keyword', str),
+    ('title', 'title', str),
+    ('condition', 'condition', Optional[str]),
+    ('price', 'price', int),
+    ('postage', 'postage', Optional[int]),
+    ('import_fees', 'import fees', Optional[int]),
+    ('duty', 'duty', Optional[int]),
+    ('url', 'url', str),
+]
+# フィールド名 -> キー
+RECORD_KEYS = {i_name: i_key for i_name, i_key, _ in RECORD_FIELDS}
+# キー -> フィールド名
+RECORD_NAMES = {i_key: i_name for i_name, i_key in RECORD_KEYS.items()}
+RECORD_COLUMNS = list(RECORD_KEYS.values())
+
+
+def record_to_dict(self) -> dict:
+    """
+    jsonlineファイルに書き出すdictを返す。
+    """
+    return {i_key: getattr(self, i_name) for i_name, i_key in RECORD_KEYS.items()}
+
+
+def struct_to_dict(self) -> dict:
+    return msgspec.to_builtins(self)
+
+
+def record_get(self, key: str, default=None):
+    """
+    dict.getと同じく、jsonlineファイルのキーで値を返す。
+    """
+    return getattr(self, RECORD_NAMES.get(key, key), default)
+
+
+def record_getitem(self, key: str):
+    if key not in RECORD_NAMES:
+        raise KeyError(key)
+    return getattr(self, RECORD_NAMES[key])
+
+
+RECORD_METHODS = {'get': record_get, '__getitem__': record_getitem}
+if msgspec is not None:
+    ItemRecord = msgspec.defstruct(
+        'ItemRecord', [(i_name, i_type) for i_name, _, i_type in RECORD_FIELDS], rename=RECORD_KEYS,
+        module=__name__, namespace={**RECORD_METHODS, 'to_dict': struct_to_dict},
+    )
+else:
+    ItemRecord = make_dataclass(
+        'ItemRecord', [(i_name, i_type) for i_name, _, i_type in RECORD_FIELDS], slots=True,
+        namespace={**RECORD_METHODS, 'to_dict': record_to_dict},
+    )
+ItemRecord.__module__ = __name__
+ItemRecord.__doc__ = """
+    出力する商品1件。
+    """
+
+
+def iter_records(df: pd.DataFrame) -> Iterator[ItemRecord]:
+    """
+    DataFrameの行を、1件ずつItemRecordにして返す。
+
+    DataFrame.to_dict(orient='records')のように全行のdictのリストを作らず、
+    itertuplesの行からそのままItemRecordを作るので、書き出しながら1件ずつ捨てられる。
+
+    Args:
+        df (pd.DataFrame): RECORD_COLUMNSの列を持つDataFrame
+
+    Yields:
+        Iterator[ItemRecord]: _description_
+    """
+    for i_row in df[RECORD_COLUMNS].itertuples(index=False, name=None):
+        yield ItemRecord(*i_row)
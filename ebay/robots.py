@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import string
+import hashlib
+import threading
+import urllib.parse
+from urllib.robotparser import RobotFileParser
+from typing import Callable, Optional, Tuple, Union
+
+
+# quoteでもunquoteでも変わらない文字
+SAFE_CHARS = frozenset(string.ascii_letters + string.digits + '_.-~')
+
+
+class HostRobots:
+    """
+    1つのホストのrobots.txtと、判定結果をURLの先頭部分ごとにメモしたもの。
+
+    robots.txtのルールはパスの前方一致なので、あるディレクトリの中のURLの判定は、
+    ディレクトリに続く「そのディレクトリより長いルールの最大の長さ」分の文字列で決まる。
+    そのディレクトリより長いルールがなければ、ディレクトリの中のURLはすべて同じ判定になる。
+    詳細ページのように同じディレクトリのURLが大量にある場合は、最初の1つだけRobotFileParserで判定すればよい。
+
+    Args:
+        origin (str): スキームとホスト(例: https://www.ebay.com)
+        parser (RobotFileParser): _description_
+    """
+    def __init__(self, origin: str, parser: RobotFileParser):
+        self.origin = origin
+        self.parser = parser
+        self.rule_paths = [i_rule.path for i_entry in self.all_entries() for i_rule in i_entry.rulelines]
+        self.longer_rules = {}
+        self.decisions = {}
+
+
+    def all_entries(self) -> list:
+        entries = list(self.parser.entries)
+        if self.parser.default_entry is not None:
+            entries.append(self.parser.default_entry)
+        return entries
+
+
+    def get_longer_rules(self, directory: str) -> list[str]:
+        """
+        ディレクトリより長いルールの、ディレクトリに続く部分のリストを返す。
+
+        Args:
+            directory (str): URLのオリジンより後の、最後の/までの部分(エスケープはそのまま)
+
+        Returns:
+            list[str]: _description_
+        """
+        longer_rules = self.longer_rules.get(directory)
+        if longer_rules is None:
+            # RobotFileParser.can_fetchと同じ方法で、ルールと比べる文字列にする
+            parsed = urllib.parse.urlparse(urllib.parse.unquote(self.origin + directory))
+            normalized = urllib.parse.quote(urllib.parse.urlunparse(
+                ('', '', parsed.path, parsed.params, parsed.query, parsed.fragment)))
+            longer_rules = [i[len(normalized):] for i in self.rule_paths
+                            if i.startswith(normalized) and len(i) > len(normalized)]
+            self.longer_rules[directory] = longer_rules
+        return longer_rules
+
+
+    def get_key_length(self, longer_rules: list[str], name: str) -> Optional[int]:
+        """
+        ディレクトリに続く部分nameのうち、判定を決めるのに必要な長さを返す。
+        nameの先頭から、どのルールと一致するかが決まるところまでを使う。
+
+        Returns:
+            Optional[int]: name全体でも決まらない(クエリなども比べる必要がある)場合はNone
+        """
+        key_length = 0
+        for i_rule in longer_rules:
+            length = 0
+            while length < len(i_rule) and length < len(name) and i_rule[length] == name[length]:
+                length += 1
+            if length < len(i_rule):
+                # 一致しない文字まで含めれば、このルールと一致しないことが決まる
+                length += 1
+                if length > len(name):
+                    return None
+            key_length = max(key_length, length)
+        return key_length
+
+
+    def can_fetch(self, user_agent: str, url: str) -> bool:
+        # urlparseなどは遅いので、元のURLの文字列のままメモした判定結果を探す
+        path = url[len(self.origin):]
+        name = path.split('?', 1)[0].split('#', 1)[0]
+        directory_end = name.rfind('/') + 1
+        name = name[directory_end:]
+        key_length = self.get_key_length(self.get_longer_rules(path[:directory_end]), name)
+        # 判定に使う部分がエスケープで変わる文字を含む場合は、ルールとの比較が変わりうるのでメモしない
+        if directory_end == 0 or key_length is None or not SAFE_CHARS.issuperset(name[:key_length]):
+            return self.parser.can_fetch(user_agent, url)
+
+        key = (user_agent, path[:directory_end + key_length])
+        decision = self.decisions.get(key)
+        if decision is None:
+            decision = self.parser.can_fetch(user_agent, url)
+            self.decisions[key] = decision
+        return decision
+
+
+class RobotsCache:
+    """
+    ホストごとのrobots.txtを、最初にそのホストのURLを判定するときに取得してキャッシュする。
+
+    cache_dirを指定した場合、取得したrobots.txtをディスクに保存し、ttl秒の間は取得し直さない。
+    複数のScraperや、シャーディング時の複数のプロセスで共有できる。
+
+    Args:
+        cache_dir (Optional[str], optional): robots.txtを保存するディレクトリ. Defaults to None.
+        ttl (Union[float, int], optional): _description_. Defaults to 24*60*60.
+    """
+    def __init__(self, cache_dir: Optional[str]=None, ttl: Union[float, int]=24 * 60 * 60):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.host_locks = {}
+
+
+    def can_fetch(self, url: str, user_agent: str, fetch: Callable[[str], Tuple[int, str]]) -> bool:
+        """
+        user_agentがurlを取得してよいかを返す。
+
+        Args:
+            url (str): _description_
+            user_agent (str): _description_
+            fetch (Callable[[str], Tuple[int, str]]): robots.txtのURLを受け取り、(ステータスコード, 本文)を返す関数
+
+        Returns:
+            bool: _description_
+        """
+        parts = urllib.parse.urlsplit(url)
+        origin = f'{parts.scheme}://{parts.netloc}'
+        return self.get_host(origin, fetch).can_fetch(user_agent, url)
+
+
+    def get_host(self, origin: str, fetch: Callable[[str], Tuple[int, str]]) -> HostRobots:
+        host = self.hosts.get(origin)
+        if host is not None and not self.is_expired(host):
+            return host
+
+        with self.lock:
+            host_lock = self.host_locks.setdefault(origin, threading.Lock())
+        # 同じホストのrobots.txtを複数のスレッドで同時に取得しないようにする
+        with host_lock:
+            host = self.hosts.get(origin)
+            if host is None or self.is_expired(host):
+                host = HostRobots(origin, self.load(origin, fetch))
+                self.hosts[origin] = host
+        return host
+
+
+    def is_expired(self, host: HostRobots) -> bool:
+        return time.time() - host.parser.mtime() >= self.ttl
+
+
+    def load(self, origin: str, fetch: Callable[[str], Tuple[int, str]]) -> RobotFileParser:
+        """
+        ディスクのキャッシュか、なければ取得したrobots.txtを読み込む。
+        """
+        robots_url = origin + '/robots.txt'
+        cached = self.read_cache(origin)
+        if cached is not None:
+            status, text, fetched_at = cached
+        else:
+            status, text = fetch(robots_url)
+            fetched_at = time.time()
+            if status >= 500:
+                # 一時的なエラーなのでキャッシュしない。呼び出し元で再試行する
+                raise Exception(f'Error: Failed to get robots.txt "{robots_url}" (status code: {status})')
+            self.write_cache(origin, status, text, fetched_at)
+            print(f'Read robots.txt: "{robots_url}"')
+
+        parser = RobotFileParser(robots_url)
+        # RobotFileParser.readと同じく、401/403はすべて禁止、それ以外の4xxはすべて許可とする
+        if status in (401, 403):
+            parser.disallow_all = True
+        elif 400 <= status < 500:
+            parser.allow_all = True
+        else:
+            parser.parse(text.splitlines())
+        parser.last_checked = fetched_at
+        return parser
+
+
+    def cache_path(self, origin: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(origin.encode('utf-8')).hexdigest() + '.json')
+
+
+    def read_cache(self, origin: str) -> Optional[tuple[int, str, float]]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.cache_path(origin), 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - cached['fetched_at'] >= self.ttl:
+            return None
+        return cached['status'], cached['text'], cached['fetched_at']
+
+
+    def write_cache(self, origin: str, status: int, text: str, fetched_at: float):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_path(origin)
+        tmp_path = path + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'origin': origin, 'status': status, 'text': text, 'fetched_at': fetched_at}, f,
+                      ensure_ascii=False)
+        os.replace(tmp_path, path)
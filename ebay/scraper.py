@@ -1,23 +1,38 @@
 import time
+import threading
 import requests
-from urllib.robotparser import RobotFileParser
-import urllib.parse
-from typing import Union
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Callable, Iterable, Iterator, Any, Optional, Tuple
 
 import pandas as pd
 from bs4 import BeautifulSoup
 
+from throttle import AutoThrottle, RETRY_STATUS_CODES, parse_retry_after
+from cache import ResponseCache
+from robots import RobotsCache
+from metrics import METRICS, SIZE_BUCKETS
+
 
 class Scraper:
-    def __init__(self, base_url: str, html_parser: str='lxml', download_delay: Union[float, int]=2):
-        self.session = requests.Session()
-        self.soup = None
-        self.url = None
-        self.text = None
+    def __init__(self, base_url: str, html_parser: str='lxml', download_delay: Union[float, int]=2,
+                 max_workers: int=1, cache: Optional[ResponseCache]=None,
+                 throttle: Optional[AutoThrottle]=None, max_retries: int=3, session=None,
+                 robots: Optional[RobotsCache]=None):
+        # sessionはrequests.Sessionか、transport.create_sessionで作成したもの
+        self.session = session if session is not None else requests.Session()
+        # 並列取得時にスレッドごとにページを保持するため、soup, url, textはスレッドローカルに置く
+        self.local = threading.local()
         self.base_url = base_url
         self.html_parser = html_parser
         self.download_delay = download_delay
-        self.read_robots_txt()
+        self.max_workers = max_workers
+        # download_delayはリクエスト間隔の初期値で、以降はレスポンスに応じて調整される
+        self.throttle = throttle if throttle is not None else AutoThrottle(download_delay)
+        self.max_retries = max_retries
+        self.cache = cache
+        # robots.txtは各ホストのURLを最初に取得するときに読み込む
+        self.robots = robots if robots is not None else RobotsCache()
 
 
     def __enter__(self):
@@ -28,30 +43,166 @@ class Scraper:
         self.session.close()
 
 
-    def read_robots_txt(self):
-        self.rp = RobotFileParser()
-        robots_url= urllib.parse.urljoin(self.base_url, '/robots.txt')
-        self.rp.set_url(robots_url)
-        self.rp.read()
-        print(f'Read robots.txt: "{robots_url}"')
+    @property
+    def soup(self):
+        # パースはコストが高いので、select等で必要になったときに初めて行う
+        if getattr(self.local, 'soup', None) is None and self.text is not None:
+            self.local.soup = BeautifulSoup(self.text, self.html_parser)
+        return getattr(self.local, 'soup', None)
+
+
+    @property
+    def url(self):
+        return getattr(self.local, 'url', None)
+
+
+    @url.setter
+    def url(self, value):
+        self.local.url = value
+
+
+    @property
+    def text(self):
+        return getattr(self.local, 'text', None)
+
+
+    @text.setter
+    def text(self, value):
+        self.local.text = value
+
+
+    def fetch_robots_txt(self, robots_url: str) -> Tuple[int, str]:
+        response = self.request(robots_url)
+        return response.status_code, response.text
 
 
     def get(self, url: str, success_message: str=''):
         self.url = url
         user_agent = self.session.headers['User-Agent']
-        if not self.rp.can_fetch(useragent=user_agent, url=self.url):
+        if not self.robots.can_fetch(self.url, user_agent, self.fetch_robots_txt):
             raise Exception(f'Error: Access to URL "{self.url}" is prohibited by robots.txt.')
 
-        response = self.session.get(self.url)
+        text = self.get_text(url)
+        if success_message:
+            print(success_message)
+        self.local.soup = None
+        self.text = text
+
+
+    def get_text(self, url: str) -> str:
+        """
+        URLのHTMLを取得する。キャッシュがある場合はキャッシュを使い、
+        TTLを過ぎたキャッシュは条件付きリクエストで再検証する。
+
+        Args:
+            url (str): _description_
+
+        Returns:
+            str: HTML
+        """
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.lookup(url)
+            if entry is not None and self.cache.is_fresh(entry):
+                text = self.cache.read(entry)
+                if text is not None:
+                    self.url = entry.url
+                    METRICS.inc('ebay_cache_hits_total')
+                    return text
+                entry = None
+
+        headers = self.cache.conditional_headers(entry) if self.cache is not None else {}
+        response = self.request(url, headers)
         self.url = response.url # リダイレクトに対応
-        time.sleep(self.download_delay)
+        if response.status_code == 304 and entry is not None:
+            text = self.cache.read(entry, revalidated=True)
+            if text is not None:
+                self.url = entry.url
+                METRICS.inc('ebay_cache_revalidations_total')
+                return text
+            # キャッシュが壊れていた場合は、条件なしで取得し直す
+            response = self.request(url)
+            self.url = response.url
+
         if response.status_code != 200:
             raise Exception(f'Error: Failed to get URL "{self.url}" (status code: {response.status_code})')
 
-        if success_message:
-            print(success_message)
-        self.soup = BeautifulSoup(response.text, self.html_parser)
-        self.text = response.text
+        if self.cache is not None:
+            self.cache.store(url, response)
+        return response.text
+
+
+    def request(self, url: str, headers: dict={}) -> requests.Response:
+        """
+        ホストごとのリクエスト間隔に従ってGETリクエストを送る。
+        429、5xx、接続エラーの場合は、間隔を広げて最大max_retries回まで再試行する。
+        待ち時間、TTFB、ダウンロード時間、転送量を記録する。
+        requestsは名前解決と接続の時間を区別できないので、それらはTTFBに含まれる。
+
+        Args:
+            url (str): _description_
+            headers (dict, optional): _description_. Defaults to {}.
+
+        Returns:
+            requests.Response: 最後に受け取ったレスポンス
+        """
+        for i in range(self.max_retries + 1):
+            with METRICS.time('ebay_throttle_wait_seconds'):
+                self.throttle.acquire(url)
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.throttle.feedback(url, time.perf_counter() - start, None)
+                METRICS.inc('ebay_connection_errors_total')
+                if i == self.max_retries:
+                    raise e
+                print(f'INFO: {e}. Retry "{url}" ({i + 1}/{self.max_retries}).')
+                METRICS.inc('ebay_retries_total')
+                continue
+
+            total = time.perf_counter() - start
+            # elapsedはリクエストを送ってからレスポンスヘッダーを受け取るまでの時間
+            ttfb = response.elapsed.total_seconds()
+            METRICS.observe('ebay_ttfb_seconds', ttfb)
+            METRICS.observe('ebay_download_seconds', max(total - ttfb, 0))
+            METRICS.observe('ebay_response_bytes', len(response.content), buckets=SIZE_BUCKETS)
+            METRICS.inc('ebay_response_bytes_total', len(response.content))
+            METRICS.inc(f'ebay_responses_status_{response.status_code}_total')
+
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            self.throttle.feedback(url, ttfb, response.status_code, retry_after)
+            METRICS.observe('ebay_download_delay_seconds', self.throttle.get_delay(url))
+            if response.status_code not in RETRY_STATUS_CODES or i == self.max_retries:
+                return response
+            print(f'INFO: Status code {response.status_code}. Retry "{url}" ({i + 1}/{self.max_retries}).')
+            METRICS.inc('ebay_retries_total')
+
+
+    def map(self, func: Callable, iterable: Iterable) -> Iterator[Any]:
+        """
+        func(scraper, x)を最大max_workers個のスレッドで並列に実行し、入力順に結果を返す。
+        同一ホストへのリクエスト間隔はthrottleによって調整される。
+
+        Args:
+            func (Callable): Scraperと入力要素を受け取る関数
+            iterable (Iterable): 入力要素
+
+        Yields:
+            Iterator[Any]: funcの戻り値
+        """
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = deque()
+        try:
+            for i in iterable:
+                futures.append(executor.submit(func, self, i))
+                # 実行待ちのタスクが溜まりすぎないようにする
+                if len(futures) >= self.max_workers * 2:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
 
     def select_one(self, selector):
@@ -72,25 +223,66 @@ class Scraper:
 
 class Item:
     def __init__(self, columns):
-        self.df = pd.DataFrame(columns=columns)
         self.columns = columns
+        self._df = pd.DataFrame(columns=columns)
+        self._init_buffer()
+
+
+    def _init_buffer(self):
+        # add_rowのたびにpd.concatするとO(n^2)になるので、列ごとのリストに追記しておき、
+        # DataFrameが必要になったときにまとめて変換する
+        self._buffer = {i_column: [] for i_column in self.columns}
+        self._buffer_len = 0
+
+
+    def __len__(self):
+        return len(self._df) + self._buffer_len
 
 
     def __setitem__(self, key, value):
         self.df[key] = value
 
 
+    @property
+    def df(self):
+        if self._buffer_len:
+            # object型にしておくと、欠損のある整数列がfloatに変換されず、これまでと同じjsonが出力される
+            new_df = pd.DataFrame(self._buffer, columns=self.columns, dtype=object)
+            if self._df.empty:
+                self._df = new_df
+            else:
+                self._df = pd.concat([self._df, new_df], ignore_index=True)
+            self._init_buffer()
+        return self._df
+
+
     @property
     def empty(self):
-        return self.df.empty
+        return len(self) == 0
 
 
     def add_row(self, data):
         if not set(data.keys()).issubset(set(self.columns)):
             raise ValueError('Data contains columns not in Item.')
-        new_df = pd.DataFrame(data, index=[0])
-        self.df = pd.concat([self.df, new_df], ignore_index=True)
+        for i_column, i_values in self._buffer.items():
+            i_values.append(data.get(i_column))
+        self._buffer_len += 1
+
+
+    def add_df(self, df):
+        if not set(df.columns).issubset(set(self.columns)):
+            raise ValueError('Data contains columns not in Item.')
+        if df.empty:
+            return
+        # add_rowと同じく、欠損はNoneにしてobject型で保持する
+        new_df = df.reindex(columns=self.columns).astype(object).reset_index(drop=True)
+        new_df = new_df.where(new_df.notna(), None)
+        self._df = new_df if self.df.empty else pd.concat([self.df, new_df], ignore_index=True)
 
 
     def to_json(self, path_or_buf=None, orient='columns', **kwargs):
         return self.df.to_json(path_or_buf=path_or_buf, orient=orient, **kwargs)
+
+
+    def to_dict(self, orient='dict', **kwargs):
+        return self.df.to_dict(orient=orient, **kwargs)
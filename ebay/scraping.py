@@ -1,50 +1,120 @@
-import sys
 import re
 import math
-import unicodedata
 import traceback
-from typing import Callable, Tuple, Any
-import json
+from typing import Tuple, Optional, Iterator
 import argparse
 from argparse import Namespace
+from contextlib import ExitStack
 
-import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Border, Side, Alignment
 
 from scraper import Scraper, Item
+from cache import ResponseCache
+from throttle import AutoThrottle
+from transport import create_session, TRANSPORTS
+from robots import RobotsCache
+from extractor import Extractor, Field
+from normalizer import normalize_item_infos
+from records import iter_records, RECORD_COLUMNS
+from criteria import iter_criteria
+from pipeline import Pipeline
+from checkpoint import Checkpoint, PENDING, FAILED
+from jsonl import JsonLinesWriter, build_index
+from serializer import JsonSerializer, get_serializer, SERIALIZER_NAMES
+from parquet_writer import ParquetDatasetWriter, read_keywords
+from metrics import METRICS, MetricsDumper
 
 DOWNLOAD_DELAY = 2
+MIN_DOWNLOAD_DELAY = 0.5
+MAX_DOWNLOAD_DELAY = 60
+TARGET_CONCURRENCY = 1.0
+MAX_RETRIES = 3
+CONCURRENT_REQUESTS = 4
+CONNECTION_POOL_SIZE = CONCURRENT_REQUESTS * 2
+ADAPTER_MAX_RETRIES = 2
+REQUEST_TIMEOUT = 30
 BASE_URL = 'https://www.ebay.com/sch/i.html'
 INPUT_PATH = 'inputs/keyboard_list.xlsx'
 OUTPUT_JL_PATH = 'outputs/results.jl'
 OUTPUT_PATH = 'outputs/results.xlsx'
-OUTPUT_COLUMNS = ['maker', 'model number', 'keyword', 'title', 'condition', 'price', 'postage',
-                  'import fees', 'duty', 'url']
+OUTPUT_PARQUET_PATH = 'outputs/results.parquet'
+INPUT_CACHE_DIR = 'outputs/inputs'
+SINKS = ['jl', 'parquet']
+CHECKPOINT_PATH = 'outputs/checkpoint.db'
+JL_FSYNC_BATCH_SIZE = 1000
+# 列名はrecords.RECORD_FIELDSで定義する
+OUTPUT_COLUMNS = RECORD_COLUMNS
 HTML_PARSER = 'lxml'
 ITEM_NUM_IN_PAGE = 60
+CACHE_TTL = 24 * 60 * 60
+CACHE_MAX_SIZE = 1024 ** 3
+ROBOTS_CACHE_DIR = 'outputs/robots'
+ROBOTS_TTL = 24 * 60 * 60
+PIPELINE_QUEUE_SIZE = 64
+PIPELINE_BATCH_SIZE = ITEM_NUM_IN_PAGE
+METRICS_INTERVAL = 60
+EXCEL_HEADER_FONT = Font(bold=True)
+EXCEL_HEADER_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'),
+                             top=Side(style='thin'), bottom=Side(style='thin'))
+EXCEL_HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+
+LIST_PAGE_EXTRACTOR = Extractor({
+    'heading': Field('#mainContent .srp-controls__count'),
+    'hrefs': Field('li.s-item.s-item__pl-on-bottom', scope='.srp-results.srp-list', many=True,
+                   sub='.s-item__info a.s-item__link', attr='href'),
+})
+DETAIL_PAGE_EXTRACTOR = Extractor({
+    'title': Field('h1.x-item-title__mainTitle'),
+    'condition': Field('.x-item-condition-value .clipped'),
+    'price': Field('.x-buybox__price-section .x-price-approx'),
+    'shipping_rows': Field('.ux-layout-section__row', scope='.vim.d-shipping-minview', many=True),
+})
 
 
 def main():
     args = get_args()
 
-    search_criteria_list = read_excel(INPUT_PATH)
+    serializer = get_serializer(args.serializer)
+    search_criteria_list = read_excel(INPUT_PATH, serializer)
 
     scraped_keywords = set()
     if args.restart:
-        scraped_keywords = read_jl(OUTPUT_JL_PATH)
+        scraped_keywords = read_scraped_keywords(args.sink, serializer)
+
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir, ttl=CACHE_TTL, max_size=CACHE_MAX_SIZE)
+
+    with ExitStack() as stack:
+        if args.metrics_json or args.metrics_prometheus:
+            stack.enter_context(MetricsDumper(METRICS, args.metrics_json, args.metrics_prometheus,
+                                              interval=args.metrics_interval))
+        scraper = stack.enter_context(create_scraper(cache, args.transport))
+        checkpoint = stack.enter_context(Checkpoint(CHECKPOINT_PATH))
+        writer = stack.enter_context(create_writer(args.sink, OUTPUT_JL_PATH, serializer))
+        if not args.restart:
+            checkpoint.clear()
+        pipeline = None
+        if args.parser_processes > 0:
+            pipeline = stack.enter_context(create_pipeline(scraper, args.parser_processes))
 
-    with Scraper(BASE_URL, HTML_PARSER, DOWNLOAD_DELAY) as scraper:
         for search_criteria in search_criteria_list:
-            if search_criteria['keyword'] in scraped_keywords:
-                print(f'INFO: Skip scraped keyword "{search_criteria["keyword"]}"')
+            keyword = search_criteria['keyword']
+            if is_scraped(keyword, checkpoint, scraped_keywords):
+                print(f'INFO: Skip scraped keyword "{keyword}"')
                 continue
+            scrape_keyword(scraper, pipeline, checkpoint, writer, search_criteria)
 
-            first_list_page_url = get_first_list_page_url(scraper, search_criteria)
-            detail_urls = fetch_detail_urls(scraper, first_list_page_url)
-            item_infos = fetch_item_infos(scraper, detail_urls)
-            modify_item_infos(item_infos, search_criteria)
-            overwrite_jl(OUTPUT_JL_PATH, item_infos)
+        retry_failed_items(scraper, pipeline, checkpoint, writer)
 
-    write_excel(OUTPUT_PATH, OUTPUT_JL_PATH)
+    if cache is not None:
+        print(f'Cache: {cache.stats()}')
+    if args.sink == 'jl':
+        write_excel(OUTPUT_PATH, OUTPUT_JL_PATH, serializer)
+    else:
+        print(f'Finished to write output parquet dataset "{OUTPUT_PARQUET_PATH}".')
 
 
 def get_args() -> Namespace:
@@ -54,50 +124,142 @@ def get_args() -> Namespace:
     Returns:
         Namespace: _description_
     """
+    return make_arg_parser().parse_args()
+
+
+def make_arg_parser() -> argparse.ArgumentParser:
+    """
+    コマンドライン引数のパーサーを返す。
+
+    Returns:
+        argparse.ArgumentParser: _description_
+    """
     parser = argparse.ArgumentParser()
     parser.add_argument('--restart', action='store_true')
-    return parser.parse_args()
+    parser.add_argument('--parser-processes', type=int, default=0,
+                        help='詳細ページのパースを行うプロセス数。0の場合、取得と同じスレッドでパースする。')
+    parser.add_argument('--cache-dir', default=None,
+                        help='指定した場合、レスポンスをこのディレクトリにキャッシュする。')
+    parser.add_argument('--transport', choices=TRANSPORTS, default='requests',
+                        help='HTTPクライアント。http2の場合、httpxで1つのコネクションに複数のリクエストを多重化する。')
+    parser.add_argument('--metrics-json', default=None,
+                        help='指定した場合、処理段階ごとの処理時間などの集計値を定期的にこのjsonlineファイルに追記する。')
+    parser.add_argument('--metrics-prometheus', default=None,
+                        help='指定した場合、集計値を定期的にPrometheusのテキスト形式でこのファイルに書き出す。')
+    parser.add_argument('--metrics-interval', type=float, default=METRICS_INTERVAL,
+                        help='集計値を書き出す間隔(秒)。')
+    parser.add_argument('--sink', choices=SINKS, default='jl',
+                        help='結果の書き出し先。parquetの場合、jsonlineファイルとexcelファイルの代わりに'
+                             'makerでパーティション分割したParquetのデータセットに書き出す。')
+    parser.add_argument('--serializer', choices=SERIALIZER_NAMES, default='auto',
+                        help='jsonlineファイルの読み書きに使うライブラリ。autoの場合、orjson、msgspec、jsonの順に使えるものを使う。')
+    return parser
+
+
+def create_scraper(cache: Optional[ResponseCache]=None, transport: str='requests') -> Scraper:
+    """
+    リクエスト間隔をレスポンスに応じて調整するScraperを作成する。
+
+    Args:
+        cache (Optional[ResponseCache], optional): _description_. Defaults to None.
+        transport (str, optional): 'requests'または'http2'. Defaults to 'requests'.
+
+    Returns:
+        Scraper: _description_
+    """
+    throttle = AutoThrottle(DOWNLOAD_DELAY, min_delay=MIN_DOWNLOAD_DELAY, max_delay=MAX_DOWNLOAD_DELAY,
+                            target_concurrency=TARGET_CONCURRENCY)
+    session = create_session(transport, pool_size=CONNECTION_POOL_SIZE, max_retries=ADAPTER_MAX_RETRIES,
+                             timeout=REQUEST_TIMEOUT)
+    # robots.txtはディスクにキャッシュするので、シャーディング時の他のワーカーも取得し直さない
+    robots = RobotsCache(ROBOTS_CACHE_DIR, ttl=ROBOTS_TTL)
+    return Scraper(BASE_URL, HTML_PARSER, DOWNLOAD_DELAY, CONCURRENT_REQUESTS, cache=cache,
+                   throttle=throttle, max_retries=MAX_RETRIES, session=session, robots=robots)
 
 
-def read_excel(input_path: str) -> list[dict]:
+def create_writer(sink: str, jl_path: str, serializer: Optional[JsonSerializer]=None):
     """
-    Excelファイルを読み込んで検索条件dictのリストを返す。
+    結果を書き出すライターを作成する。どちらもwriteでレコードを追記する。
 
     Args:
-        input_path (str): _description_
+        sink (str): 'jl'または'parquet'
+        jl_path (str): 'jl'の場合に書き出すjsonlineファイル
+        serializer (Optional[JsonSerializer], optional): _description_. Defaults to None.
+
+    Returns:
+        _type_: JsonLinesWriterまたはParquetDatasetWriter
+    """
+    if sink == 'parquet':
+        return ParquetDatasetWriter(OUTPUT_PARQUET_PATH)
+    return JsonLinesWriter(jl_path, JL_FSYNC_BATCH_SIZE, serializer=serializer)
+
+
+def is_scraped(keyword: str, checkpoint: Checkpoint, scraped_keywords: set) -> bool:
+    """
+    検索キーワードをスクレイピング済みとして読み飛ばしてよいかを返す。
+
+    書き出し先にはキーワードの途中までのレコードも書き出されるので、checkpointにあるキーワードは
+    checkpointで判定し、書き出し済みのキーワードはcheckpointにない場合だけ読み飛ばす。
+
+    Args:
+        keyword (str): _description_
+        checkpoint (Checkpoint): _description_
+        scraped_keywords (set): 書き出し先に書き出し済みの検索キーワード
+
+    Returns:
+        bool: _description_
+    """
+    if checkpoint.has_keyword(keyword):
+        return checkpoint.is_complete(keyword)
+    return keyword in scraped_keywords
+
+
+def read_scraped_keywords(sink: str, serializer: Optional[JsonSerializer]=None) -> set:
+    """
+    書き出し先からスクレイピング済みの検索キーワードを返す。
+
+    Args:
+        sink (str): 'jl'または'parquet'
+        serializer (Optional[JsonSerializer], optional): _description_. Defaults to None.
 
     Returns:
-        list[dict]: _description_
+        set: _description_
+    """
+    if sink == 'parquet':
+        return read_keywords(OUTPUT_PARQUET_PATH)
+    return read_jl(OUTPUT_JL_PATH, serializer)
+
+
+def read_excel(input_path: str, serializer: Optional[JsonSerializer]=None) -> Iterator[dict]:
     """
-    df_dict = pd.read_excel(input_path, sheet_name=None, header=1)
-    for i_df in df_dict.values():
-        maker = i_df['メーカー'].iloc[0]
-        i_df['メーカー'].fillna(maker, inplace=True)
-        i_df['keyword'] = (i_df['メーカー'] + '+' + i_df['製品型番']).replace(' ', '+')
-    tmp_df = pd.concat(df_dict.values())
+    Excelファイルから検索条件dictを1件ずつ読み込む。
+    ワークブック全体を読み込むのを待たずに、最初の検索条件からスクレイピングを始められる。
+    読み込んだ検索条件はINPUT_CACHE_DIRにキャッシュし、ワークブックが変わっていなければ次回はそれを使う。
 
-    # tmp_df = tmp_df.drop(['メーカー', '製品型番'], axis=1)
-    result = tmp_df.to_dict('records')
+    Args:
+        input_path (str): _description_
+        serializer (Optional[JsonSerializer], optional): _description_. Defaults to None.
+
+    Yields:
+        Iterator[dict]: _description_
+    """
+    yield from iter_criteria(input_path, INPUT_CACHE_DIR, serializer)
     print('Finished to read input excel file.')
-    return result
 
 
-def read_jl(jl_path: str) -> set:
+def read_jl(jl_path: str, serializer: Optional[JsonSerializer]=None) -> set:
     """
     'results.jl'を読み込んで、スクレイピング済みの検索キーワードを返す。
 
     Args:
         jl_path (str): _description_
+        serializer (Optional[JsonSerializer], optional): _description_. Defaults to None.
 
     Returns:
         set: _description_
     """
-    existed_keywords = set()
-    with open(jl_path, 'r') as file:
-        for line in file:
-            obj = json.loads(line)
-            existed_keywords.add(obj['keyword'])
-    return existed_keywords
+    # サイドカーのインデックスを使うので、レコード数ではなくキーワード数に比例する時間で済む
+    return {i_entry['keyword'] for i_entry in build_index(jl_path, serializer)}
 
 
 def get_first_list_page_url(scraper: Scraper, criteria: dict,
@@ -127,7 +289,7 @@ def fetch_detail_urls(scraper: Scraper, first_list_page_url: str,
                       item_num_in_page: int=ITEM_NUM_IN_PAGE) -> list:
     """
     一覧ページから詳細ページを取得する。
-    ただし、取得に失敗した場合、複数回試行を繰り返す。
+    一時的なエラーはScraperが間隔を広げて再試行する。それでも失敗した場合はNoneを返す。
 
     Args:
         scraper (Scraper): _description_
@@ -135,16 +297,13 @@ def fetch_detail_urls(scraper: Scraper, first_list_page_url: str,
         item_num_in_page (int, optional): _description_. Defaults to ITEM_NUM_IN_PAGE.
 
     Returns:
-        list: _description_
+        Optional[list]: _description_
     """
     try:
-        urls = try_func(scrape_detail_urls, kwargs={'scraper': scraper,
-                                                    'first_list_page_url': first_list_page_url,
-                                                    'item_num_in_page': item_num_in_page})
+        return scrape_detail_urls(scraper, first_list_page_url, item_num_in_page)
     except Exception as e:
         handle_scraping_error(e, scraper)
-
-    return urls
+        return None
 
 
 def scrape_detail_urls(scraper: Scraper, first_list_page_url: str,
@@ -162,14 +321,19 @@ def scrape_detail_urls(scraper: Scraper, first_list_page_url: str,
     """
     scraper.get(first_list_page_url,
                 success_message=f'First list page "{first_list_page_url}" access succeeded.')
-    heading = scraper.select_one('#mainContent .srp-controls__count').text
+    page = LIST_PAGE_EXTRACTOR.extract(scraper.text)
+    heading = page['heading']
     total_item_num = int(re.search(r'(\d+)件', heading)[1])
     total_page_num = math.ceil(total_item_num / item_num_in_page)
     print('Number of detail pages: ' + str(total_item_num))
 
+    # 1ページ目を読めば残りのページのURLはすべて分かるので、2ページ目以降はまとめて並列に取得する
+    page_urls = [get_list_page_url(first_list_page_url, i) for i in range(2, total_page_num+1)]
+    pages = [page['hrefs']] + list(scraper.map(scrape_list_page, page_urls))
+
     urls = []
     undisplayed_item_num = total_item_num
-    for page_num in range(1, total_page_num+1):
+    for hrefs in pages:
         # 表示件数が少ないとき、「一部の語句に一致する検索結果」が表示されてしまうので、
         # 「一部の語句に一致する検索結果」のaタグをa_elementsに含めないようにする対策。
         if undisplayed_item_num > item_num_in_page:
@@ -179,62 +343,276 @@ def scrape_detail_urls(scraper: Scraper, first_list_page_url: str,
             item_num_in_current_page = undisplayed_item_num
             undisplayed_item_num = 0
 
-        srp_list_element = scraper.select_one('.srp-results.srp-list')
-        item_elements = srp_list_element.select('li.s-item.s-item__pl-on-bottom')
-        a_elements = [i.select_one('.s-item__info a.s-item__link') for i in item_elements]
-        a_elements = a_elements[:item_num_in_current_page] # 「一部の語句に一致する検索結果」を除外
-        urls.extend([i.get('href').split('?')[0] for i in a_elements])
-
-        if page_num < total_page_num:
-            get_next_page(scraper, first_list_page_url, page_num+1)
+        hrefs = hrefs[:item_num_in_current_page] # 「一部の語句に一致する検索結果」を除外
+        urls.extend([i.split('?')[0] for i in hrefs])
 
-    return urls
+    # ページをまたいで同じ商品が表示されることがあるので、順序を保ったまま重複を除く
+    return list(dict.fromkeys(urls))
 
 
-def get_next_page(scraper: Scraper, first_url: str, page_num: int):
+def get_list_page_url(first_url: str, page_num: int) -> str:
     """
-    次のページの一覧ページを取得する。
+    一覧ページのpage_numページ目のURLを返す。
 
     Args:
-        scraper (Scraper): _description_
         first_url (str): _description_
         page_num (int): _description_
 
     Returns:
-        bool: _description_
+        str: _description_
     """
     param_key = '_pgn'
-    next_url = first_url + f'&{param_key}={page_num}'
-    scraper.get(next_url, success_message=f'Next list page "{next_url}" access succeeded.')
+    return first_url + f'&{param_key}={page_num}'
+
+
+def scrape_list_page(scraper: Scraper, url: str) -> list[str]:
+    """
+    2ページ目以降の一覧ページを取得し、詳細ページへのリンクを返す。
+
+    Args:
+        scraper (Scraper): _description_
+        url (str): _description_
+
+    Returns:
+        list[str]: _description_
+    """
+    scraper.get(url, success_message=f'Next list page "{url}" access succeeded.')
+    return LIST_PAGE_EXTRACTOR.extract(scraper.text)['hrefs']
+
+
+def scrape_keyword(scraper: Scraper, pipeline: Optional[Pipeline], checkpoint: Checkpoint,
+                   writer: JsonLinesWriter, search_criteria: dict):
+    """
+    1つの検索条件について、一覧ページと詳細ページから情報を取得し、jsonlineファイルに追記する。
+    一覧ページを取得済みのキーワードは、未取得の詳細ページだけを取得する。
+
+    Args:
+        scraper (Scraper): _description_
+        pipeline (Optional[Pipeline]): _description_
+        checkpoint (Checkpoint): _description_
+        writer (JsonLinesWriter): _description_
+        search_criteria (dict): _description_
+    """
+    keyword = search_criteria['keyword']
+    if not checkpoint.has_keyword(keyword):
+        first_list_page_url = get_first_list_page_url(scraper, search_criteria)
+        detail_urls = fetch_detail_urls(scraper, first_list_page_url)
+        if detail_urls is None:
+            return
+        checkpoint.add_keyword(keyword, search_criteria, detail_urls)
+
+    scrape_items(scraper, pipeline, checkpoint, writer, keyword, PENDING)
+
+
+def scrape_items(scraper: Scraper, pipeline: Optional[Pipeline], checkpoint: Checkpoint,
+                 writer: JsonLinesWriter, keyword: str, state: str):
+    """
+    検索キーワードの詳細ページのうち、checkpointで指定した状態のものから情報を取得し、
+    jsonlineファイルに追記する。
+
+    Args:
+        scraper (Scraper): _description_
+        pipeline (Optional[Pipeline]): Noneでなければパイプラインで取得する
+        checkpoint (Checkpoint): _description_
+        writer (JsonLinesWriter): _description_
+        keyword (str): _description_
+        state (str): 取得する詳細ページの状態(PENDINGまたはFAILED)
+    """
+    targets = checkpoint.get_urls(keyword, state)
+    search_criteria = checkpoint.get_criteria(keyword)
+    if pipeline is None:
+        fetch_item_infos(scraper, checkpoint, keyword, targets)
+    else:
+        run_pipeline(pipeline, checkpoint, writer, keyword, targets, search_criteria)
+    write_item_infos(checkpoint, writer, keyword, search_criteria)
+
+
+def retry_failed_items(scraper: Scraper, pipeline: Optional[Pipeline], checkpoint: Checkpoint,
+                       writer: JsonLinesWriter, keywords: Optional[set]=None):
+    """
+    取得に失敗して再試行待ちになっている詳細ページを、もう一度取得する。
+    それでも失敗したものは、次回の--restartで再試行する。
+
+    Args:
+        scraper (Scraper): _description_
+        pipeline (Optional[Pipeline]): _description_
+        checkpoint (Checkpoint): _description_
+        writer (JsonLinesWriter): _description_
+        keywords (Optional[set], optional): 指定した場合、このキーワードの詳細ページだけを再試行する. Defaults to None.
+    """
+    failed_keywords = [i for i in checkpoint.get_failed_keywords() if keywords is None or i in keywords]
+    for i_keyword in failed_keywords:
+        print(f'INFO: Retry failed items of keyword "{i_keyword}"')
+        scrape_items(scraper, pipeline, checkpoint, writer, i_keyword, FAILED)
+
+    for i_keyword in failed_keywords:
+        failed_num = len(checkpoint.get_urls(i_keyword, FAILED))
+        print(f'WARNING: {failed_num} items of keyword "{i_keyword}" failed. Run with --restart to retry.')
+
+
+def fetch_item_infos(scraper: Scraper, checkpoint: Checkpoint, keyword: str, targets: list[Tuple[int, str]]):
+    """
+    すべての詳細ページから情報を取得し、checkpointに記録する。
+    詳細ページはscraper.max_workers並列で取得する。
+
+    Args:
+        scraper (Scraper): _description_
+        checkpoint (Checkpoint): _description_
+        keyword (str): _description_
+        targets (list[Tuple[int, str]]): 詳細ページの(position, url)のリスト
+    """
+    len_targets = len(targets)
+
+    urls = [i_url for _, i_url in targets]
+    item_infos = scraper.map(fetch_item_info, urls)
+    for i, ((position, _), item_info) in enumerate(zip(targets, item_infos), start=1):
+        record_item_info(checkpoint, keyword, position, item_info)
+        print(f'Item {i}/{len_targets}:', item_info)
 
 
-def fetch_item_infos(scraper: Scraper, detail_urls: list) -> Item:
+def fetch_item_info(scraper: Scraper, url: str) -> Optional[dict]:
     """
-    すべての詳細ページから情報を取得する。
-    ただし、取得に失敗した場合、複数回試行を繰り返す。
+    1つの詳細ページから情報を取得する。
+    一時的なエラーはScraperが間隔を広げて再試行する。それでも失敗した場合はNoneを返す。
 
     Args:
         scraper (Scraper): _description_
-        detail_urls (list): _description_
+        url (str): _description_
 
     Returns:
-        Item: _description_
+        Optional[dict]: _description_
+    """
+    try:
+        item_info = scrape_item_info(scraper, url)
+    except Exception as e:
+        handle_scraping_error(e, scraper)
+        return None
+
+    item_info['url'] = scraper.url # リダイレクトされている場合もあるのでurlではなく、scraper.url
+    return item_info
+
+
+def record_item_info(checkpoint: Checkpoint, keyword: str, position: int, item_info: Optional[dict]):
+    """
+    詳細ページの取得結果をcheckpointに記録する。失敗した詳細ページは再試行待ちにする。
+
+    Args:
+        checkpoint (Checkpoint): _description_
+        keyword (str): _description_
+        position (int): _description_
+        item_info (Optional[dict]): _description_
+    """
+    if item_info is None:
+        checkpoint.mark_failed(keyword, position)
+        print(f'INFO: Item {position} of keyword "{keyword}" is parked for retry.')
+    else:
+        checkpoint.mark_done(keyword, position, item_info)
+
+
+def write_item_infos(checkpoint: Checkpoint, writer: JsonLinesWriter, keyword: str, search_criteria: dict):
     """
-    len_detail_urls = len(detail_urls)
+    取得済みで未書き出しの情報の型をまとめて変換してjsonlineファイルに追記し、書き出し済みとして記録する。
 
+    Args:
+        checkpoint (Checkpoint): _description_
+        writer (JsonLinesWriter): _description_
+        keyword (str): _description_
+        search_criteria (dict): _description_
+    """
+    done_infos = checkpoint.get_done_infos(keyword)
     item_infos = Item(OUTPUT_COLUMNS)
-    for i, i_url in enumerate(detail_urls, start=1):
-        try:
-            item_info = try_func(scrape_item_info, kwargs={'scraper': scraper, 'url': i_url})
-        except Exception as e:
-            handle_scraping_error(e, scraper)
+    with METRICS.time('ebay_normalize_seconds'):
+        item_infos.add_df(normalize_item_infos([i_info for _, i_info in done_infos]))
+    modify_item_infos(item_infos, search_criteria)
+    with METRICS.time('ebay_storage_seconds'):
+        overwrite_jl(writer, item_infos)
+        checkpoint.mark_written(keyword, [i_position for i_position, _ in done_infos])
+    METRICS.inc('ebay_items_written_total', len(done_infos))
+
+
+def create_pipeline(scraper: Scraper, parser_num: int) -> Pipeline:
+    """
+    詳細ページの取得、パース、書き出しを別々のステージで行うパイプラインを作成する。
+
+    Args:
+        scraper (Scraper): _description_
+        parser_num (int): パースを行うプロセス数
+
+    Returns:
+        Pipeline: _description_
+    """
+    def on_parse_error(url: str, e: Exception) -> Optional[dict]:
+        # パースに失敗した場合は、ページを取得し直して再試行する
+        print(e)
+        print(f'INFO: parse_detail_page failed. Try again.')
+        return fetch_item_info(scraper, url)
+
+    return Pipeline(scraper, fetch_detail_page, parse_detail_page, parser_num=parser_num,
+                    queue_size=PIPELINE_QUEUE_SIZE, batch_size=PIPELINE_BATCH_SIZE,
+                    on_parse_error=on_parse_error)
+
 
-        item_info['url'] = scraper.url # リダイレクトされている場合もあるのでi_urlではなく、scraper.url
+def run_pipeline(pipeline: Pipeline, checkpoint: Checkpoint, writer: JsonLinesWriter, keyword: str,
+                 targets: list[Tuple[int, str]], search_criteria: dict):
+    """
+    パイプラインですべての詳細ページから情報を取得し、jsonlineファイルに追記する。
+
+    Args:
+        pipeline (Pipeline): _description_
+        checkpoint (Checkpoint): _description_
+        writer (JsonLinesWriter): _description_
+        keyword (str): _description_
+        targets (list[Tuple[int, str]]): 詳細ページの(position, url)のリスト
+        search_criteria (dict): _description_
+    """
+    # パイプラインは入力順に出力するので、出力とpositionを順番に対応させる
+    positions = iter([i_position for i_position, _ in targets])
+
+    def write_batch(infos: list[Optional[dict]]):
+        for i_info in infos:
+            record_item_info(checkpoint, keyword, next(positions), i_info)
+        write_item_infos(checkpoint, writer, keyword, search_criteria)
+
+    pipeline.run([i_url for _, i_url in targets], write_batch, total=len(targets))
+
+
+def fetch_detail_page(scraper: Scraper, url: str) -> Tuple[str, Optional[str]]:
+    """
+    1つの詳細ページのHTMLを取得する。
+    一時的なエラーはScraperが間隔を広げて再試行する。それでも失敗した場合、HTMLはNoneになる。
+
+    Args:
+        scraper (Scraper): _description_
+        url (str): _description_
+
+    Returns:
+        Tuple[str, Optional[str]]: リダイレクト後のURLとHTML
+    """
+    try:
+        scraper.get(url)
+    except Exception as e:
+        handle_scraping_error(e, scraper)
+        return url, None
+    return scraper.url, scraper.text
 
-        item_infos.add_row(item_info)
-        print(f'Item {i}/{len_detail_urls}:', item_info)
 
-    return item_infos
+def parse_detail_page(url: str, text: Optional[str]) -> Optional[dict]:
+    """
+    詳細ページのHTMLから情報を抽出し、URLを加える。HTMLがNone(取得失敗)の場合はNoneを返す。
+    プロセスプールのワーカーで実行されるので、モジュールのトップレベルに定義しておく。
+
+    Args:
+        url (str): _description_
+        text (Optional[str]): _description_
+
+    Returns:
+        Optional[dict]: _description_
+    """
+    if text is None:
+        return None
+    info = parse_item_info(text)
+    info['url'] = url
+    return info
 
 
 def scrape_item_info(scraper: Scraper, url: str) -> dict:
@@ -249,47 +627,34 @@ def scrape_item_info(scraper: Scraper, url: str) -> dict:
         dict: _description_
     """
     scraper.get(url)
-
-    info = {}
-    info['title'] = unicodedata.normalize('NFKD', scraper.select_one('h1.x-item-title__mainTitle').text.strip())
-    info['condition'] = scraper.select_one('.x-item-condition-value .clipped').text
-    price_string = scraper.select_one('.x-buybox__price-section .x-price-approx').text
-    info['price'] = int(re.sub(r'\D', '', price_string))
-    shipping_element = scraper.select_one('.vim.d-shipping-minview')
-    row_elements = shipping_element.select('.ux-layout-section__row')
-    for row_element in row_elements:
-        row_text = row_element.text
-        charge = get_charge(row_text)
-        if charge:
-            if '送料' in row_text:
-                info['postage'] = charge
-            elif '輸入手数料' in row_text:
-                info['import fees'] = charge
-            elif '関税' in row_text:
-                info['duty'] = charge
-
-    return info
+    return parse_item_info(scraper.text)
 
 
-def get_charge(string: str) -> int:
+def parse_item_info(text: str) -> dict:
     """
-    与えられた文字列からJPY以降の料金を抜き出す。
+    詳細ページのHTMLから情報の文字列を抽出する。
+    型の変換はwrite_item_infosでキーワードごとにまとめて行うので、ここでは抽出できたかだけを確かめる。
 
     Args:
-        string (str): _description_
+        text (str): _description_
 
     Returns:
-        int: _description_
+        dict: _description_
     """
-    if '無料' in string:
-        return 0
-    else:
-        match = re.search(r'JPY\s*([\d,]+)', string)
-        if match:
-            num = int(match[1].replace(',', ''))
-            return num
-        else:
-            return None
+    page = DETAIL_PAGE_EXTRACTOR.extract(text)
+
+    if page['title'] is None:
+        raise ValueError('Title is not found.')
+    if page['price'] is None or not any(i.isdigit() for i in page['price']):
+        raise ValueError('Price is not found.')
+    if page['shipping_rows'] is None:
+        raise ValueError('Shipping section is not found.')
+    return {
+        'title': page['title'],
+        'condition': page['condition'],
+        'price': page['price'],
+        'shipping_rows': page['shipping_rows'],
+    }
 
 
 def modify_item_infos(item_infos: Item, search_criteria: dict):
@@ -305,76 +670,92 @@ def modify_item_infos(item_infos: Item, search_criteria: dict):
     item_infos['keyword'] = search_criteria['keyword']
 
 
-def overwrite_jl(jl_path: str, item_infos: Item):
+def overwrite_jl(writer: JsonLinesWriter, item_infos: Item):
     """
-    Itemをjsonlineファイルに追記する。
+    Itemを1行ずつItemRecordにしてjsonlineファイル(--sink parquetの場合はParquetのデータセット)に追記する。
 
     Args:
-        jl_path (str): _description_
+        writer (JsonLinesWriter): _description_
         item_infos (Item): _description_
     """
     if item_infos.empty:
         return
 
-    with open(jl_path, 'a') as f:
-        f.write(item_infos.to_json(orient='records', force_ascii=False, lines=True))
+    writer.write(iter_records(item_infos.df))
 
 
-def write_excel(excel_path: str, jl_path: str):
+def write_excel(excel_path: str, jl_path: str, serializer: Optional[JsonSerializer]=None):
     """
     jsonlineファイルをexcelファイルに変換する。
 
     Args:
         excel_path (str): _description_
         jl_path (str): _description_
+        serializer (Optional[JsonSerializer], optional): _description_. Defaults to None.
     """
-    item_infos = pd.read_json(jl_path, orient='records', lines=True)
-    makers = item_infos['maker'].unique()
-    with pd.ExcelWriter(excel_path) as writer:
-        for i_maker in makers:
-            item_infos[item_infos['maker'] == i_maker].to_excel(writer, sheet_name=i_maker)
+    serializer = serializer or get_serializer()
+    # jsonlineファイルを1行ずつ読みながら、メーカーごとのシートに追記していく。
+    # write_onlyモードのWorkbookは各シートを一時ファイルに書き出すので、行数によらずメモリ使用量は一定。
+    workbook = Workbook(write_only=True)
+    sheets = {}
+    columns = None
+    with open(jl_path, 'rb') as f:
+        i = 0
+        for line in f:
+            if not line.strip():
+                continue
+            record = serializer.loads(line)
+            if columns is None:
+                columns = list(record.keys())
+            maker = record['maker']
+            if maker not in sheets:
+                sheets[maker] = workbook.create_sheet(title=maker)
+                sheets[maker].append(make_excel_header(sheets[maker], columns))
+            # pandasのto_excelと同じく、先頭の列には元のDataFrameでの行番号を書く
+            sheets[maker].append([make_excel_header_cell(sheets[maker], i)] +
+                                 [record.get(i_column) for i_column in columns])
+            i += 1
+
+    workbook.save(excel_path)
     print('Finished to write output excel file.')
 
 
-def try_func(func: Callable, args: Tuple=(), kwargs: dict={}, max_retry: int=3) -> Any:
+def make_excel_header(sheet, columns: list[str]) -> list[WriteOnlyCell]:
     """
-    funcが成功するまで、複数回試行する。
+    pandasのto_excelと同じ見た目のヘッダー行を作る。
 
     Args:
-        func (Callable): _description_
-        args (Tuple, optional): _description_. Defaults to ().
-        kwargs (dict, optional): _description_. Defaults to {}.
-        max_retry (int, optional): _description_. Defaults to 3.
-
-    Raises:
-        e: _description_
+        sheet (_type_): _description_
+        columns (list[str]): _description_
 
     Returns:
-        Any: _description_
+        list[WriteOnlyCell]: _description_
     """
-    for i in range(max_retry):
-        try:
-            return func(*args, **kwargs)
-        except Exception as e:
-            print(e)
-            if i == max_retry - 1:
-                raise e
-            print(f'INFO: {func.__name__} failed. Try again.')
+    return [None] + [make_excel_header_cell(sheet, i_column) for i_column in columns]
+
+
+def make_excel_header_cell(sheet, value) -> WriteOnlyCell:
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.font = EXCEL_HEADER_FONT
+    cell.border = EXCEL_HEADER_BORDER
+    cell.alignment = EXCEL_HEADER_ALIGNMENT
+    return cell
 
 
 def handle_scraping_error(e: Exception, scraper: Scraper):
     """
     スクレイピング時のエラーを処理する。
+    処理は中断せず、呼び出し元で失敗したページを再試行待ちにする。
 
     Args:
         e (Exception): _description_
         scraper (Scraper): _description_
     """
-    with open('scraping_error.html', 'w') as f:
-        f.write(scraper.text)
+    if scraper.text is not None:
+        with open('scraping_error.html', 'w') as f:
+            f.write(scraper.text)
     traceback.print_exc()
     print(f'scraping error in URL "{scraper.url}"')
-    sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,122 @@
+"""
+jsonlineファイルの1行とオブジェクトを相互に変換するシリアライザ。
+
+orjsonかmsgspecがインストールされていればそれを使い、なければ標準のjsonを使う。
+どれも空白を入れず、ASCII以外の文字をエスケープせずにUTF-8で書き出すので、出力は同じになる。
+msgspecはItemRecord(msgspec.Struct)をそのまま1行にする。jsonとorjsonはto_dictでdictにしてから1行にする。
+"""
+import json
+from typing import Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+class JsonSerializer:
+    """
+    標準のjsonを使うシリアライザ。
+    """
+    name = 'json'
+
+
+    def dumps(self, obj) -> bytes:
+        """
+        オブジェクトを改行を含まない1行のJSON(UTF-8)にする。
+        """
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=to_builtins).encode('utf-8')
+
+
+    def loads(self, data: Union[bytes, str]):
+        """
+        1行のJSONを読み込む。壊れた行ではValueErrorを送出する。
+        """
+        return json.loads(data)
+
+
+class OrjsonSerializer(JsonSerializer):
+    name = 'orjson'
+
+
+    def dumps(self, obj) -> bytes:
+        # dataclassのItemRecordも、フィールド名ではなくjsonlineファイルのキーで書き出す
+        return orjson.dumps(obj, default=to_builtins, option=orjson.OPT_PASSTHROUGH_DATACLASS)
+
+
+    def loads(self, data: Union[bytes, str]):
+        # orjson.JSONDecodeErrorはValueErrorのサブクラス
+        return orjson.loads(data)
+
+
+class MsgspecSerializer(JsonSerializer):
+    name = 'msgspec'
+
+
+    def __init__(self):
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
+
+
+    def dumps(self, obj) -> bytes:
+        return self.encoder.encode(obj)
+
+
+    def loads(self, data: Union[bytes, str]):
+        try:
+            return self.decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+
+def to_builtins(obj) -> dict:
+    """
+    そのままでは1行にできないオブジェクト(ItemRecordなど)を、to_dictでdictにする。
+    """
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+    return to_dict()
+
+
+SERIALIZERS = {
+    'orjson': (OrjsonSerializer, orjson),
+    'msgspec': (MsgspecSerializer, msgspec),
+    'json': (JsonSerializer, json),
+}
+SERIALIZER_NAMES = ['auto'] + list(SERIALIZERS)
+DEFAULT_SERIALIZER = None
+
+
+def get_serializer(name: Optional[str]='auto') -> JsonSerializer:
+    """
+    シリアライザを返す。
+
+    Args:
+        name (Optional[str], optional): 'orjson'、'msgspec'、'json'のいずれか。
+            'auto'かNoneの場合、インストールされているものをこの順で探す. Defaults to 'auto'.
+
+    Returns:
+        JsonSerializer: _description_
+    """
+    if name is None or name == 'auto':
+        return default_serializer()
+    if name not in SERIALIZERS:
+        raise ValueError(f'Unknown serializer "{name}". Choose from {SERIALIZER_NAMES}.')
+    serializer_class, module = SERIALIZERS[name]
+    if module is None:
+        raise ImportError(f'Serializer "{name}" is not installed. Install it with "pip install {name}".')
+    return serializer_class()
+
+
+def default_serializer() -> JsonSerializer:
+    global DEFAULT_SERIALIZER
+    if DEFAULT_SERIALIZER is None:
+        name = next(i_name for i_name, (_, i_module) in SERIALIZERS.items() if i_module is not None)
+        DEFAULT_SERIALIZER = get_serializer(name)
+    return DEFAULT_SERIALIZER
@@ -0,0 +1,339 @@
+"""
+検索キーワードを複数のワーカープロセスに分配してスクレイピングする。
+
+コーディネーターは検索条件をSQLiteの作業キューに登録し、ワーカーを起動して進捗を報告する。
+ワーカーは作業キューからキーワードを1つずつ取り出してスクレイピングし、自分専用の
+jsonlineファイル(シャード)に書き出す。すべてのワーカーが終わると、コーディネーターが
+シャードを入力の順にresults.jlへマージし、excelファイルを出力する。
+--sink parquetの場合、ワーカーはParquetのデータセットに直接書き出すので、マージは行わない。
+
+作業キューのファイルを共有すれば、別のマシンから--workerでワーカーを追加することもできる。
+各ワーカーはそれぞれ独自のScraperを持つので、ホストごとのリクエスト間隔もワーカーごとに守られる。
+"""
+import os
+import glob
+import json
+import time
+import sqlite3
+import threading
+import multiprocessing
+import multiprocessing.connection
+from argparse import Namespace
+from contextlib import ExitStack
+from typing import Optional, Iterable
+
+from cache import ResponseCache
+from checkpoint import Checkpoint, WRITTEN
+from jsonl import JsonLinesWriter, build_index
+from metrics import METRICS, MetricsDumper
+from serializer import JsonSerializer, get_serializer
+from scraping import (INPUT_PATH, OUTPUT_JL_PATH, OUTPUT_PATH, JL_FSYNC_BATCH_SIZE, CACHE_TTL, CACHE_MAX_SIZE,
+                      OUTPUT_PARQUET_PATH, create_scraper, is_scraped, make_arg_parser, read_excel,
+                      read_scraped_keywords, write_excel, create_pipeline, create_writer,
+                      scrape_keyword, retry_failed_items)
+
+SHARD_DIR = 'outputs/shards'
+QUEUE_FILE_NAME = 'queue.db'
+CHECKPOINT_FILE_NAME = 'checkpoint.db'
+REPORT_INTERVAL = 30
+
+QUEUED = 'queued'
+CLAIMED = 'claimed'
+FINISHED = 'finished'
+
+
+class WorkQueue:
+    """
+    検索条件を保持するSQLiteの作業キュー。
+    複数のプロセスから同時にclaimしても、1つの検索条件は1つのワーカーにしか渡されない。
+    """
+    def __init__(self, path: str, timeout: float=30):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            'keyword TEXT PRIMARY KEY, position INTEGER NOT NULL, criteria TEXT NOT NULL, '
+            'state TEXT NOT NULL, worker TEXT, claimed_at REAL, finished_at REAL)'
+        )
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def close(self):
+        self.conn.close()
+
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM tasks')
+
+
+    def put_all(self, criteria_list: Iterable[dict]):
+        """
+        検索条件を登録する。登録済みのキーワードは無視する。
+        """
+        rows = [(i_criteria['keyword'], i, json.dumps(i_criteria, ensure_ascii=False, default=str), QUEUED)
+                for i, i_criteria in enumerate(criteria_list)]
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany('INSERT OR IGNORE INTO tasks (keyword, position, criteria, state) '
+                                  'VALUES (?, ?, ?, ?)', rows)
+            self.conn.execute('COMMIT')
+
+
+    def requeue_claimed(self):
+        """
+        前回の実行で取り出されたまま終わらなかった検索条件を、キューに戻す。
+        """
+        with self.lock:
+            self.conn.execute('UPDATE tasks SET state = ?, worker = NULL, claimed_at = NULL WHERE state = ?',
+                              (QUEUED, CLAIMED))
+
+
+    def claim(self, worker_id: str) -> Optional[dict]:
+        """
+        キューの先頭の検索条件を取り出す。キューが空の場合はNoneを返す。
+        """
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute('SELECT keyword, criteria FROM tasks WHERE state = ? '
+                                        'ORDER BY position LIMIT 1', (QUEUED,)).fetchone()
+                if row is not None:
+                    self.conn.execute('UPDATE tasks SET state = ?, worker = ?, claimed_at = ? WHERE keyword = ?',
+                                      (CLAIMED, worker_id, time.time(), row[0]))
+            finally:
+                self.conn.execute('COMMIT')
+        return json.loads(row[1]) if row else None
+
+
+    def finish(self, keyword: str):
+        with self.lock:
+            self.conn.execute('UPDATE tasks SET state = ?, finished_at = ? WHERE keyword = ?',
+                              (FINISHED, time.time(), keyword))
+
+
+    def count(self, state: str) -> int:
+        with self.lock:
+            row = self.conn.execute('SELECT COUNT(*) FROM tasks WHERE state = ?', (state,)).fetchone()
+        return row[0]
+
+
+    def count_by_worker(self) -> dict:
+        with self.lock:
+            rows = self.conn.execute('SELECT worker, COUNT(*) FROM tasks WHERE state = ? GROUP BY worker',
+                                     (FINISHED,)).fetchall()
+        return dict(rows)
+
+
+    def get_keywords(self) -> list[str]:
+        with self.lock:
+            rows = self.conn.execute('SELECT keyword FROM tasks ORDER BY position').fetchall()
+        return [i[0] for i in rows]
+
+
+def main():
+    args = get_args()
+    os.makedirs(args.shard_dir, exist_ok=True)
+    queue_path = os.path.join(args.shard_dir, QUEUE_FILE_NAME)
+
+    if args.worker:
+        run_worker(args, args.worker_id)
+        return
+
+    serializer = get_serializer(args.serializer)
+    search_criteria_list = read_excel(INPUT_PATH, serializer)
+    scraped_keywords = set()
+    if args.restart:
+        scraped_keywords = read_scraped_keywords(args.sink, serializer)
+
+    with WorkQueue(queue_path) as queue, Checkpoint(checkpoint_path_of(args.shard_dir)) as checkpoint:
+        if not args.restart:
+            queue.clear()
+            checkpoint.clear()
+        queue.put_all(i for i in search_criteria_list
+                      if not is_scraped(i['keyword'], checkpoint, scraped_keywords))
+        queue.requeue_claimed()
+
+        workers = [multiprocessing.Process(target=run_worker, args=(args, f'local-{i}'))
+                   for i in range(args.shards)]
+        for i_worker in workers:
+            i_worker.start()
+        monitor(workers, queue, checkpoint)
+
+        keywords = queue.get_keywords()
+
+    if args.sink == 'parquet':
+        # ワーカーがデータセットに直接書き出しているので、マージは不要
+        print(f'Finished to write output parquet dataset "{OUTPUT_PARQUET_PATH}".')
+        return
+    merge_shards(args.shard_dir, OUTPUT_JL_PATH, keywords, serializer)
+    write_excel(OUTPUT_PATH, OUTPUT_JL_PATH, serializer)
+
+
+def get_args() -> Namespace:
+    """
+    コマンドライン引数の名前空間を返す。scraping.pyの引数に加えて、シャーディング用の引数をとる。
+
+    Returns:
+        Namespace: _description_
+    """
+    parser = make_arg_parser()
+    parser.add_argument('--shards', type=int, default=4,
+                        help='起動するワーカープロセスの数。')
+    parser.add_argument('--shard-dir', default=SHARD_DIR,
+                        help='作業キューとシャードを置くディレクトリ。')
+    parser.add_argument('--worker', action='store_true',
+                        help='コーディネーターを起動せず、既存の作業キューに対するワーカーとしてだけ動く。')
+    parser.add_argument('--worker-id', default=f'{os.uname().nodename}-{os.getpid()}',
+                        help='--workerのときのワーカーID。シャードのファイル名に使われる。')
+    return parser.parse_args()
+
+
+def checkpoint_path_of(shard_dir: str) -> str:
+    return os.path.join(shard_dir, CHECKPOINT_FILE_NAME)
+
+
+def shard_path_of(shard_dir: str, worker_id: str) -> str:
+    return os.path.join(shard_dir, f'results-{worker_id}.jl')
+
+
+def worker_path_of(path: Optional[str], worker_id: str) -> Optional[str]:
+    """
+    ファイル名の拡張子の前にワーカーIDを挿入したパスを返す。
+    """
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}-{worker_id}{ext}'
+
+
+def run_worker(args: Namespace, worker_id: str):
+    """
+    作業キューが空になるまで検索条件を取り出してスクレイピングし、シャードに書き出す。
+
+    Args:
+        args (Namespace): _description_
+        worker_id (str): _description_
+    """
+    cache = None
+    if args.cache_dir:
+        cache = ResponseCache(args.cache_dir, ttl=CACHE_TTL, max_size=CACHE_MAX_SIZE)
+
+    with ExitStack() as stack:
+        # 集計値はプロセスごとなので、ワーカーごとに別のファイルに書き出す
+        if args.metrics_json or args.metrics_prometheus:
+            stack.enter_context(MetricsDumper(METRICS, worker_path_of(args.metrics_json, worker_id),
+                                              worker_path_of(args.metrics_prometheus, worker_id),
+                                              interval=args.metrics_interval))
+        queue = stack.enter_context(WorkQueue(os.path.join(args.shard_dir, QUEUE_FILE_NAME)))
+        scraper = stack.enter_context(create_scraper(cache, args.transport))
+        # 中断したキーワードを別のワーカーが再開しても重複しないよう、checkpointは全ワーカーで共有する
+        checkpoint = stack.enter_context(Checkpoint(checkpoint_path_of(args.shard_dir)))
+        writer = stack.enter_context(create_writer(args.sink, shard_path_of(args.shard_dir, worker_id),
+                                                   get_serializer(args.serializer)))
+        pipeline = None
+        if args.parser_processes > 0:
+            pipeline = stack.enter_context(create_pipeline(scraper, args.parser_processes))
+
+        claimed_keywords = set()
+        while (search_criteria := queue.claim(worker_id)) is not None:
+            keyword = search_criteria['keyword']
+            claimed_keywords.add(keyword)
+            print(f'INFO: Worker {worker_id} claimed keyword "{keyword}"')
+            if not checkpoint.is_complete(keyword):
+                scrape_keyword(scraper, pipeline, checkpoint, writer, search_criteria)
+            queue.finish(keyword)
+
+        retry_failed_items(scraper, pipeline, checkpoint, writer, keywords=claimed_keywords)
+
+    if cache is not None:
+        print(f'Cache ({worker_id}): {cache.stats()}')
+
+
+def monitor(workers: list[multiprocessing.Process], queue: WorkQueue, checkpoint: Checkpoint):
+    """
+    ワーカーが終わるまで、全体のスループットを定期的に表示する。
+
+    Args:
+        workers (list[multiprocessing.Process]): _description_
+        queue (WorkQueue): _description_
+        checkpoint (Checkpoint): _description_
+    """
+    start_time = time.monotonic()
+    start_item_num = checkpoint.count_items(WRITTEN)
+    alive_workers = list(workers)
+    while alive_workers:
+        # いずれかのワーカーが終わるか、REPORT_INTERVAL秒経つまで待つ
+        # is_alive()は終わったワーカーを回収するまでTrueを返すことがあるので、sentinelで判定する
+        ready = multiprocessing.connection.wait([i.sentinel for i in alive_workers], timeout=REPORT_INTERVAL)
+        alive_workers = [i for i in alive_workers if i.sentinel not in ready]
+        report(queue, checkpoint, start_time, start_item_num)
+
+    for i_worker in workers:
+        i_worker.join()
+        if i_worker.exitcode != 0:
+            print(f'WARNING: Worker {i_worker.name} exited with code {i_worker.exitcode}.')
+
+
+def report(queue: WorkQueue, checkpoint: Checkpoint, start_time: float, start_item_num: int):
+    elapsed = time.monotonic() - start_time
+    item_num = checkpoint.count_items(WRITTEN) - start_item_num
+    finished_num = queue.count(FINISHED)
+    total_num = finished_num + queue.count(CLAIMED) + queue.count(QUEUED)
+    per_worker = ', '.join(f'{k}: {v}' for k, v in sorted(queue.count_by_worker().items()))
+    print(f'Progress: {finished_num}/{total_num} keywords, {item_num} items in {elapsed:.0f}s '
+          f'({item_num / elapsed if elapsed else 0:.2f} items/s) [{per_worker}]')
+
+
+def merge_shards(shard_dir: str, jl_path: str, keywords: list[str], serializer: Optional[JsonSerializer]=None):
+    """
+    シャードをjl_pathに追記してから削除する。
+    シャードのインデックスを使って、キーワードを作業キューに登録した順(入力の順)に並べる。
+
+    Args:
+        shard_dir (str): _description_
+        jl_path (str): _description_
+        keywords (list[str]): _description_
+        serializer (Optional[JsonSerializer], optional): _description_. Defaults to None.
+    """
+    serializer = serializer or get_serializer()
+    shard_paths = sorted(glob.glob(os.path.join(shard_dir, 'results-*.jl')))
+    segments = {}
+    for i_path in shard_paths:
+        for i_entry in build_index(i_path, serializer):
+            segments.setdefault(i_entry['keyword'], []).append((i_path, i_entry['offset'], i_entry['end']))
+
+    keyword_set = set(keywords)
+    ordered_keywords = [i for i in keywords if i in segments]
+    ordered_keywords += [i for i in segments if i not in keyword_set]
+    with JsonLinesWriter(jl_path, JL_FSYNC_BATCH_SIZE, serializer=serializer) as writer:
+        for i_keyword in ordered_keywords:
+            for i_path, i_offset, i_end in segments[i_keyword]:
+                writer.write(read_segment(i_path, i_offset, i_end, serializer))
+
+    for i_path in shard_paths:
+        os.remove(i_path)
+        os.remove(i_path + '.idx')
+    print(f'Merged {len(shard_paths)} shards into "{jl_path}".')
+
+
+def read_segment(jl_path: str, offset: int, end: int, serializer: JsonSerializer):
+    with open(jl_path, 'rb') as f:
+        f.seek(offset)
+        while f.tell() < end:
+            line = f.readline()
+            if line.strip():
+                yield serializer.loads(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# ebayのモジュールはebayディレクトリから`from scraper import Scraper`のように読み込む
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from cache import ResponseCache
+from scraper import Scraper
+
+
+class Response:
+    def __init__(self, url: str, status_code: int=200, text: str='', headers: dict=None):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class Server:
+    """
+    Scraper.requestの代わりに、URLごとのbodyとETagを返す。条件付きリクエストには304を返す。
+    """
+    def __init__(self):
+        self.pages = {}
+        self.requests = []
+
+    def request(self, url: str, headers: dict={}) -> Response:
+        self.requests.append((url, headers))
+        text, etag = self.pages[url]
+        if headers.get('If-None-Match') == etag:
+            return Response(url, 304)
+        return Response(url, 200, text, {'ETag': etag})
+
+
+def make_scraper(cache: ResponseCache, server: Server) -> Scraper:
+    scraper = Scraper('https://www.ebay.com/', cache=cache)
+    scraper.request = server.request
+    return scraper
+
+
+def test_fresh_entry_is_served_without_request(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    server = Server()
+    server.pages['https://www.ebay.com/itm/1'] = ('<html>1</html>', '"v1"')
+    scraper = make_scraper(cache, server)
+    assert scraper.get_text('https://www.ebay.com/itm/1') == '<html>1</html>'
+    assert scraper.get_text('https://www.ebay.com/itm/1') == '<html>1</html>'
+    assert len(server.requests) == 1
+    assert (cache.hits, cache.misses, cache.revalidations) == (1, 1, 0)
+
+
+def test_stale_entry_is_revalidated(tmp_path):
+    cache = ResponseCache(str(tmp_path), ttl=0)
+    server = Server()
+    server.pages['https://www.ebay.com/itm/1'] = ('<html>1</html>', '"v1"')
+    scraper = make_scraper(cache, server)
+    scraper.get_text('https://www.ebay.com/itm/1')
+    assert scraper.get_text('https://www.ebay.com/itm/1') == '<html>1</html>'
+    assert server.requests[-1] == ('https://www.ebay.com/itm/1', {'If-None-Match': '"v1"'})
+
+    # ETagが変わっていれば取得し直す
+    server.pages['https://www.ebay.com/itm/1'] = ('<html>2</html>', '"v2"')
+    assert scraper.get_text('https://www.ebay.com/itm/1') == '<html>2</html>'
+    # TTLを過ぎたエントリは、再検証できてもミスとして数える
+    assert (cache.hits, cache.misses, cache.revalidations) == (0, 3, 1)
+    assert cache.lookup('https://www.ebay.com/itm/1').etag == '"v2"'
+
+
+def test_miss_is_counted_when_request_fails(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    scraper = make_scraper(cache, Server())
+    with pytest.raises(KeyError):
+        scraper.get_text('https://www.ebay.com/itm/404')
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_evict_least_recently_used(tmp_path):
+    server = Server()
+    for i in range(3):
+        server.pages[f'https://www.ebay.com/itm/{i}'] = (f'<html>{i}</html>' * 100, f'"{i}"')
+    cache = ResponseCache(str(tmp_path))
+    scraper = make_scraper(cache, server)
+    scraper.get_text('https://www.ebay.com/itm/0')
+    entry_size = cache.total_size
+    cache.max_size = entry_size * 2
+    scraper.get_text('https://www.ebay.com/itm/1')
+    # 0を使ったので、2を保存すると1が削除される
+    scraper.get_text('https://www.ebay.com/itm/0')
+    scraper.get_text('https://www.ebay.com/itm/2')
+    assert cache.lookup('https://www.ebay.com/itm/1') is None
+    assert cache.lookup('https://www.ebay.com/itm/0') is not None
+    assert cache.total_size <= cache.max_size
+    assert len([i for i in os.listdir(tmp_path) if i.endswith('.html.gz')]) == 2
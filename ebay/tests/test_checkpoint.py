@@ -0,0 +1,52 @@
+from checkpoint import Checkpoint, DONE, FAILED, PENDING, WRITTEN
+
+
+URLS = [f'https://www.ebay.com/itm/{i}' for i in range(3)]
+
+
+def test_state_transitions(tmp_path):
+    with Checkpoint(str(tmp_path / 'checkpoint.sqlite3')) as checkpoint:
+        assert not checkpoint.is_complete('a')
+        checkpoint.add_keyword('a', {'maker': 'kawai'}, URLS)
+        assert checkpoint.has_keyword('a')
+        assert checkpoint.get_criteria('a') == {'maker': 'kawai'}
+        assert checkpoint.get_urls('a', PENDING) == list(enumerate(URLS))
+        assert not checkpoint.is_complete('a')
+
+        checkpoint.mark_done('a', 0, {'title': 'Keyboard 0'})
+        checkpoint.mark_done('a', 2, {'title': 'Keyboard 2'})
+        checkpoint.mark_failed('a', 1)
+        # 書き出していない情報が残っているので、まだ終わっていない
+        assert not checkpoint.is_complete('a')
+        assert checkpoint.get_done_infos('a') == [(0, {'title': 'Keyboard 0'}), (2, {'title': 'Keyboard 2'})]
+
+        checkpoint.mark_written('a', [0, 2])
+        # 再試行待ちだけが残っていれば終わったとみなす
+        assert checkpoint.is_complete('a')
+        assert checkpoint.get_done_infos('a') == []
+        assert checkpoint.get_urls('a', FAILED) == [(1, URLS[1])]
+        assert checkpoint.get_failed_keywords() == ['a']
+        assert [checkpoint.count_items(i) for i in (PENDING, DONE, WRITTEN, FAILED)] == [0, 0, 2, 1]
+
+
+def test_add_keyword_again_replaces_items(tmp_path):
+    with Checkpoint(str(tmp_path / 'checkpoint.sqlite3')) as checkpoint:
+        checkpoint.add_keyword('a', {}, URLS)
+        checkpoint.mark_failed('a', 0)
+        checkpoint.add_keyword('a', {}, URLS[:1])
+        assert checkpoint.get_urls('a', PENDING) == [(0, URLS[0])]
+        assert checkpoint.get_failed_keywords() == []
+
+
+def test_resume_from_file(tmp_path):
+    path = str(tmp_path / 'checkpoint.sqlite3')
+    with Checkpoint(path) as checkpoint:
+        checkpoint.add_keyword('a', {}, URLS)
+        checkpoint.mark_done('a', 0, {'title': 'Keyboard 0'})
+    # 別のプロセスで開き直しても、状態が残っている
+    with Checkpoint(path) as checkpoint:
+        assert checkpoint.get_done_infos('a') == [(0, {'title': 'Keyboard 0'})]
+        assert checkpoint.get_urls('a', PENDING) == [(1, URLS[1]), (2, URLS[2])]
+        checkpoint.clear()
+        assert not checkpoint.has_keyword('a')
+        assert checkpoint.count_items(DONE) == 0
@@ -0,0 +1,50 @@
+import json
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from scraping import write_excel
+
+
+RECORDS = [
+    {'maker': 'kawai', 'model number': 'NV10S', 'title': 'Keyboard 1', 'price': 10000, 'shipping': None},
+    {'maker': 'yamaha', 'model number': 'P-125', 'title': 'Keyboard 2', 'price': 20000, 'shipping': 500},
+    {'maker': 'kawai', 'model number': 'CA49', 'title': 'Keyboard 3', 'price': 30000, 'shipping': None},
+]
+
+
+def write_jl(jl_path, records: list[dict]):
+    jl_path.write_text(''.join(json.dumps(i, ensure_ascii=False) + '\n' for i in records), encoding='utf-8')
+
+
+def read_sheets(excel_path) -> dict[str, list[tuple]]:
+    workbook = load_workbook(excel_path)
+    return {i_sheet.title: list(i_sheet.iter_rows(values_only=True)) for i_sheet in workbook.worksheets}
+
+
+def test_same_as_pandas_to_excel(tmp_path):
+    jl_path = tmp_path / 'results.jl'
+    write_jl(jl_path, RECORDS)
+    write_excel(str(tmp_path / 'results.xlsx'), str(jl_path))
+
+    # 以前のpandasでの書き出しと同じ内容になる
+    item_infos = pd.read_json(jl_path, orient='records', lines=True)
+    with pd.ExcelWriter(tmp_path / 'expected.xlsx') as writer:
+        for i_maker in item_infos['maker'].unique():
+            item_infos[item_infos['maker'] == i_maker].to_excel(writer, sheet_name=i_maker)
+
+    sheets = read_sheets(tmp_path / 'results.xlsx')
+    assert sheets == read_sheets(tmp_path / 'expected.xlsx')
+    assert sheets['kawai'][0] == (None, 'maker', 'model number', 'title', 'price', 'shipping')
+    assert [i[0] for i in sheets['kawai'][1:]] == [0, 2]
+
+    header = load_workbook(tmp_path / 'results.xlsx')['kawai']['B1']
+    assert header.font.b
+    assert header.border.left.style == 'thin'
+
+
+def test_skip_blank_lines(tmp_path):
+    jl_path = tmp_path / 'results.jl'
+    jl_path.write_text(json.dumps(RECORDS[0]) + '\n\n' + json.dumps(RECORDS[2]) + '\n', encoding='utf-8')
+    write_excel(str(tmp_path / 'results.xlsx'), str(jl_path))
+    assert [i[3] for i in read_sheets(tmp_path / 'results.xlsx')['kawai'][1:]] == ['Keyboard 1', 'Keyboard 3']
@@ -0,0 +1,74 @@
+import os
+import json
+
+import pytest
+
+from jsonl import JsonLinesWriter, build_index, index_path_of, read_index
+
+
+def make_records(keyword: str, num: int) -> list[dict]:
+    return [{'keyword': keyword, 'title': f'{keyword} {i}', 'price': i} for i in range(num)]
+
+
+def read_lines(jl_path) -> list[dict]:
+    return [json.loads(i_line) for i_line in jl_path.read_text(encoding='utf-8').splitlines()]
+
+
+def test_index_has_one_entry_per_keyword(tmp_path):
+    jl_path = tmp_path / 'results.jl'
+    with JsonLinesWriter(str(jl_path)) as writer:
+        # パイプラインではキーワードのレコードをバッチごとに書き込む
+        writer.write(make_records('a', 3))
+        writer.write(make_records('a', 2))
+        writer.write(make_records('b', 1) + make_records('c', 2))
+    entries = read_index(str(jl_path))
+    assert [(i['keyword'], i['count']) for i in entries] == [('a', 5), ('b', 1), ('c', 2)]
+    assert entries[-1]['end'] == jl_path.stat().st_size
+
+    # インデックスを作り直しても同じになる
+    os.remove(index_path_of(str(jl_path)))
+    assert build_index(str(jl_path)) == entries
+
+
+def test_offsets_point_at_records(tmp_path):
+    jl_path = tmp_path / 'results.jl'
+    with JsonLinesWriter(str(jl_path)) as writer:
+        writer.write(make_records('a', 2))
+        writer.write(make_records('b', 3))
+    data = jl_path.read_bytes()
+    entry = read_index(str(jl_path))[1]
+    lines = data[entry['offset']:entry['end']].splitlines()
+    assert [json.loads(i)['keyword'] for i in lines] == ['b'] * 3
+
+
+def test_truncate_partially_written_line(tmp_path):
+    jl_path = tmp_path / 'results.jl'
+    with JsonLinesWriter(str(jl_path)) as writer:
+        writer.write(make_records('a', 2))
+    complete_size = jl_path.stat().st_size
+    # レコードを書き込んでいる途中で落ちて、インデックスは書き込まれていない
+    with open(jl_path, 'ab') as f:
+        f.write(b'{"keyword":"b","title":"b 0","price":0}\n{"keyword":"b","ti')
+
+    with JsonLinesWriter(str(jl_path)) as writer:
+        assert jl_path.stat().st_size == complete_size + len(b'{"keyword":"b","title":"b 0","price":0}\n')
+        writer.write(make_records('b', 2))
+    assert [i['keyword'] for i in read_lines(jl_path)] == ['a', 'a', 'b', 'b', 'b']
+    assert [(i['keyword'], i['count']) for i in read_index(str(jl_path))] == [('a', 2), ('b', 3)]
+
+
+def test_keep_last_line_without_newline(tmp_path):
+    jl_path = tmp_path / 'results.jl'
+    # 以前の形式で書き出した、最後に改行のないファイル
+    jl_path.write_text('{"keyword":"a","price":1}\n{"keyword":"a","price":2}', encoding='utf-8')
+    with JsonLinesWriter(str(jl_path)) as writer:
+        writer.write(make_records('b', 1))
+    assert [i['keyword'] for i in read_lines(jl_path)] == ['a', 'a', 'b']
+    assert [(i['keyword'], i['count']) for i in read_index(str(jl_path))] == [('a', 2), ('b', 1)]
+
+
+def test_corrupted_line_in_the_middle(tmp_path):
+    jl_path = tmp_path / 'results.jl'
+    jl_path.write_text('{"keyword":"a"}\n{"keyword":\n{"keyword":"b"}\n', encoding='utf-8')
+    with pytest.raises(ValueError):
+        build_index(str(jl_path))
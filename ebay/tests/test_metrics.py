@@ -0,0 +1,24 @@
+import json
+
+from metrics import Metrics, SIZE_BUCKETS
+
+
+def test_histogram_quantiles_and_prometheus(tmp_path):
+    metrics = Metrics()
+    for i_value in [0.002, 0.02, 0.02, 0.2, 3]:
+        metrics.observe('ebay_ttfb_seconds', i_value)
+    metrics.observe('ebay_response_bytes', 2000, buckets=SIZE_BUCKETS)
+    metrics.inc('ebay_items_written_total', 5)
+
+    histogram = metrics.histograms['ebay_ttfb_seconds']
+    assert (histogram.quantile(0.5), histogram.quantile(0.9)) == (0.025, 5)
+    text = metrics.to_prometheus()
+    assert 'ebay_items_written_total 5' in text
+    assert 'ebay_ttfb_seconds_bucket{le="0.025"} 3' in text
+    assert 'ebay_ttfb_seconds_bucket{le="+Inf"} 5' in text
+    assert 'ebay_response_bytes_bucket{le="4096"} 1' in text
+
+    json_path = tmp_path / 'metrics.jl'
+    metrics.dump_json(str(json_path))
+    snapshot = json.loads(json_path.read_text(encoding='utf-8'))
+    assert snapshot['histograms']['ebay_ttfb_seconds']['count'] == 5
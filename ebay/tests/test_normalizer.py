@@ -0,0 +1,55 @@
+import json
+
+from jsonl import JsonLinesWriter
+from normalizer import normalize_item_infos
+from scraper import Item
+from scraping import OUTPUT_COLUMNS, modify_item_infos, overwrite_jl
+
+
+SEARCH_CRITERIA = {'メーカー': 'kawai', '製品型番': 'NV10S', 'keyword': 'kawai+NV10S'}
+# 以前の形式で、取得時に変換してチェックポイントに記録された行
+LEGACY_INFOS = [
+    {'title': 'Keyboard 1', 'condition': '中古', 'price': 10000, 'postage': 5,
+     'import fees': None, 'duty': None, 'url': 'https://www.ebay.com/itm/1'},
+    {'title': 'Keyboard 2', 'condition': '中古', 'price': 20000, 'postage': None,
+     'import fees': 7, 'duty': None, 'url': 'https://www.ebay.com/itm/2'},
+]
+RAW_INFO = {'title': ' Ｋｅｙｂｏａｒｄ 3 ', 'condition': '新品', 'price': '約 JPY 36,577',
+            'shipping_rows': ['送料: JPY 1,983 国際郵便', '輸入手数料: JPY 821', '関税: 無料', 'お届け日'],
+            'url': 'https://www.ebay.com/itm/3'}
+
+
+def write_jl(tmp_path, raw_infos):
+    item_infos = Item(OUTPUT_COLUMNS)
+    item_infos.add_df(normalize_item_infos(raw_infos))
+    modify_item_infos(item_infos, SEARCH_CRITERIA)
+    jl_path = tmp_path / 'results.jl'
+    with JsonLinesWriter(str(jl_path)) as writer:
+        overwrite_jl(writer, item_infos)
+    return [json.loads(i_line) for i_line in jl_path.read_text(encoding='utf-8').splitlines()]
+
+
+def test_normalize_raw_infos():
+    df = normalize_item_infos([RAW_INFO])
+    records = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+    assert records == [{
+        'title': 'Keyboard 3', 'condition': '新品', 'price': 36577,
+        'postage': 1983, 'import fees': 821, 'duty': None, 'url': 'https://www.ebay.com/itm/3',
+    }]
+    assert df['price'].dtype == 'int64'
+    assert all(df[i].dtype == 'Int64' for i in ['postage', 'import fees', 'duty'])
+
+
+def test_only_legacy_rows(tmp_path):
+    records = write_jl(tmp_path, LEGACY_INFOS)
+    assert [(i['price'], i['postage'], i['import fees']) for i in records] == [(10000, 5, None), (20000, None, 7)]
+    assert all(type(i['postage']) is int for i in records if i['postage'] is not None)
+
+
+def test_mixed_legacy_and_raw_rows(tmp_path):
+    records = write_jl(tmp_path, LEGACY_INFOS + [RAW_INFO])
+    assert [(i['price'], i['postage'], i['import fees']) for i in records] == \
+        [(10000, 5, None), (20000, None, 7), (36577, 1983, 821)]
+    for i_record in records:
+        for i_column in ['price', 'postage', 'import fees', 'duty']:
+            assert i_record[i_column] is None or type(i_record[i_column]) is int
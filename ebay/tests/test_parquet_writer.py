@@ -0,0 +1,30 @@
+import pandas as pd
+
+from parquet_writer import ParquetDatasetWriter, read_keywords
+from records import ItemRecord
+
+
+def make_record(model_number, index: int) -> ItemRecord:
+    return ItemRecord('kawai', model_number, f'kawai+{model_number}', f'Keyboard {index}', '中古', 10000 + index,
+                      None if index % 2 else 500, 1100, None, f'https://www.ebay.com/itm/{index}')
+
+
+def test_numeric_model_number(tmp_path):
+    dataset_path = str(tmp_path / 'results.parquet')
+    with ParquetDatasetWriter(dataset_path) as writer:
+        writer.write([make_record(12345, 0), make_record('NV10S', 1)])
+    df = pd.read_parquet(dataset_path, dtype_backend='numpy_nullable')
+    assert sorted(df['model number']) == ['12345', 'NV10S']
+    assert read_keywords(dataset_path) == {'kawai+12345', 'kawai+NV10S'}
+
+
+def test_compact_one_file_per_maker(tmp_path):
+    dataset_path = tmp_path / 'results.parquet'
+    with ParquetDatasetWriter(str(dataset_path)) as writer:
+        for i in range(3):
+            writer.write([make_record('NV10S', i)])
+    files = list(dataset_path.glob('maker=kawai/*.parquet'))
+    assert len(files) == 1
+    df = pd.read_parquet(str(dataset_path), dtype_backend='numpy_nullable')
+    assert sorted(df['price']) == [10000, 10001, 10002]
+    assert df['postage'].isna().sum() == 1
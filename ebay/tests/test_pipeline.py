@@ -0,0 +1,78 @@
+import time
+import threading
+
+import pytest
+
+from pipeline import Pipeline
+from scraper import Scraper
+
+
+URLS = [f'https://www.ebay.com/itm/{i}' for i in range(10)]
+
+
+def fetch(scraper, url):
+    i = int(url.rsplit('/', 1)[1])
+    # 後のURLほど速く取得できる
+    time.sleep((10 - i) * 0.002)
+    return url, f'<p>{i}</p>'
+
+
+def parse(url, text):
+    # プロセスプールのワーカーで実行するので、モジュールのトップレベルに置く
+    if text == '<p>3</p>':
+        raise ValueError(url)
+    return {'url': url, 'text': text}
+
+
+def run(pipeline: Pipeline, urls: list[str]) -> list[list[dict]]:
+    batches = []
+    with pipeline:
+        pipeline.run(urls, batches.append, total=len(urls))
+    return batches
+
+
+@pytest.mark.parametrize('parser_num', [0, 2])
+def test_write_in_input_order_by_batch(parser_num):
+    pipeline = Pipeline(Scraper('https://www.ebay.com/', max_workers=4), fetch, parse, parser_num=parser_num,
+                        queue_size=2, batch_size=4, on_parse_error=lambda url, e: {'url': url, 'error': str(e)})
+    batches = run(pipeline, URLS)
+    assert [len(i) for i in batches] == [4, 4, 2]
+    items = [j for i in batches for j in i]
+    assert [i['url'] for i in items] == URLS
+    assert items[3] == {'url': URLS[3], 'error': URLS[3]}
+
+
+@pytest.mark.parametrize('parser_num', [0, 2])
+def test_parse_error_stops_pipeline(parser_num):
+    pipeline = Pipeline(Scraper('https://www.ebay.com/', max_workers=2), fetch, parse, parser_num=parser_num,
+                        batch_size=1)
+    batches = []
+    with pytest.raises(ValueError):
+        with pipeline:
+            pipeline.run(URLS, batches.append)
+    # 失敗したページより前のページは書き出している
+    assert [i[0]['url'] for i in batches] == URLS[:3]
+
+
+def test_fetch_error_stops_pipeline():
+    def fail(scraper, url):
+        raise ConnectionError(url)
+
+    pipeline = Pipeline(Scraper('https://www.ebay.com/'), fail, parse, parser_num=0)
+    with pytest.raises(ConnectionError):
+        run(pipeline, URLS)
+
+
+def test_write_error_stops_stages():
+    pipeline = Pipeline(Scraper('https://www.ebay.com/', max_workers=2), fetch, parse, parser_num=0,
+                        queue_size=1, batch_size=1)
+
+    def write(batch):
+        raise OSError('disk full')
+
+    thread_num = threading.active_count()
+    with pytest.raises(OSError):
+        with pipeline:
+            pipeline.run(iter(URLS * 100), write)
+    # 書き出しが失敗したら、fetchステージとparseステージのスレッドも終わる
+    assert threading.active_count() == thread_num
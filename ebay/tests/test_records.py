@@ -0,0 +1,63 @@
+import sys
+import json
+import importlib.util
+
+import pandas as pd
+import pytest
+
+import records
+from jsonl import JsonLinesWriter
+from records import ItemRecord, RECORD_COLUMNS, iter_records
+from serializer import SERIALIZERS, get_serializer
+
+
+ROW = ('kawai', 'NV10S', 'kawai+NV10S', 'Keyboard 1', '中古', 10000, None, 1100, None, 'https://www.ebay.com/itm/1')
+RECORD_DICT = dict(zip(RECORD_COLUMNS, ROW))
+INSTALLED_SERIALIZERS = [i_name for i_name, (_, i_module) in SERIALIZERS.items() if i_module is not None]
+
+
+def load_fallback_records(monkeypatch):
+    # msgspecがない環境のrecordsを、別のモジュールとして読み込む
+    monkeypatch.setitem(sys.modules, 'msgspec', None)
+    spec = importlib.util.spec_from_file_location('records_fallback', records.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize('serializer_name', INSTALLED_SERIALIZERS)
+def test_dumps_record_with_output_keys(serializer_name):
+    serializer = get_serializer(serializer_name)
+    line = serializer.dumps(ItemRecord(*ROW))
+    assert line == serializer.dumps(RECORD_DICT)
+    assert list(json.loads(line)) == RECORD_COLUMNS
+
+
+# msgspecがない環境ではmsgspecのシリアライザは使えない
+@pytest.mark.parametrize('serializer_name', [i for i in INSTALLED_SERIALIZERS if i != 'msgspec'])
+def test_dumps_fallback_record(serializer_name, monkeypatch):
+    fallback = load_fallback_records(monkeypatch)
+    record = fallback.ItemRecord(*ROW)
+    assert not hasattr(record, '__dict__')
+    assert get_serializer(serializer_name).dumps(record) == get_serializer(serializer_name).dumps(RECORD_DICT)
+
+
+def test_record_access_by_output_key():
+    record = ItemRecord(*ROW)
+    assert record['model number'] == 'NV10S'
+    assert record.get('import fees') == 1100
+    assert record.get('unknown') is None
+    assert record.to_dict() == RECORD_DICT
+    with pytest.raises(KeyError):
+        record['unknown']
+
+
+def test_iter_records_into_jsonl(tmp_path):
+    df = pd.DataFrame([ROW, ROW[:3] + ('Keyboard 2', None, 20000, 500, None, 7, 'https://www.ebay.com/itm/2')],
+                      columns=RECORD_COLUMNS, dtype=object)
+    jl_path = tmp_path / 'results.jl'
+    with JsonLinesWriter(str(jl_path)) as writer:
+        writer.write(iter_records(df))
+    lines = [json.loads(i_line) for i_line in jl_path.read_text(encoding='utf-8').splitlines()]
+    assert lines == df.to_dict(orient='records')
+    assert all(type(i_line['price']) is int for i_line in lines)
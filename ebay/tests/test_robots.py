@@ -0,0 +1,68 @@
+import pytest
+
+from robots import RobotsCache
+
+
+ROBOTS_TXT = '''User-agent: *
+Disallow: /sch/
+Disallow: /itm/private
+Allow: /sch/i.html
+'''
+
+
+class Fetcher:
+    def __init__(self, status: int=200, text: str=ROBOTS_TXT):
+        self.status = status
+        self.text = text
+        self.urls = []
+
+    def __call__(self, url: str):
+        self.urls.append(url)
+        return self.status, self.text
+
+
+def test_same_decisions_as_robot_file_parser():
+    robots = RobotsCache()
+    fetch = Fetcher()
+    urls = ['https://www.ebay.com/itm/1', 'https://www.ebay.com/itm/private1', 'https://www.ebay.com/itm/priv',
+            'https://www.ebay.com/sch/i.html?_nkw=a', 'https://www.ebay.com/sch/other', 'https://www.ebay.com/',
+            'https://www.ebay.com/itm/%7Eprivate']
+    host = robots.get_host('https://www.ebay.com', fetch)
+    for i_url in urls * 2:
+        assert robots.can_fetch(i_url, 'bot', fetch) == host.parser.can_fetch('bot', i_url), i_url
+    assert fetch.urls == ['https://www.ebay.com/robots.txt']
+
+
+def test_memoize_by_directory_prefix():
+    robots = RobotsCache()
+    fetch = Fetcher()
+    for i in range(100):
+        assert robots.can_fetch(f'https://www.ebay.com/itm/{i}', 'bot', fetch)
+    assert not robots.can_fetch('https://www.ebay.com/itm/private2', 'bot', fetch)
+    host = robots.get_host('https://www.ebay.com', fetch)
+    # /itm/privateと区別できる長さだけをキーにするので、数字で始まるURLは先頭1文字ごとにまとまる
+    assert len([i for i in host.decisions if i[1].startswith('/itm/')]) == 11
+
+
+@pytest.mark.parametrize('status, expected', [(404, True), (403, False)])
+def test_client_error_status(status, expected):
+    assert RobotsCache().can_fetch('https://www.ebay.com/sch/a', 'bot', Fetcher(status, '')) == expected
+
+
+def test_server_error_is_not_cached(tmp_path):
+    robots = RobotsCache(str(tmp_path))
+    with pytest.raises(Exception):
+        robots.can_fetch('https://www.ebay.com/itm/1', 'bot', Fetcher(503, ''))
+    assert list(tmp_path.iterdir()) == []
+    assert robots.can_fetch('https://www.ebay.com/itm/1', 'bot', Fetcher())
+
+
+def test_share_cache_dir(tmp_path):
+    fetch = Fetcher()
+    assert not RobotsCache(str(tmp_path)).can_fetch('https://www.ebay.com/sch/a', 'bot', fetch)
+    # 別のプロセスのRobotsCacheでも、保存したrobots.txtを使う
+    assert not RobotsCache(str(tmp_path)).can_fetch('https://www.ebay.com/sch/a', 'bot', fetch)
+    assert len(fetch.urls) == 1
+    # 期限が切れていれば取得し直す
+    RobotsCache(str(tmp_path), ttl=0).can_fetch('https://www.ebay.com/sch/a', 'bot', fetch)
+    assert len(fetch.urls) == 2
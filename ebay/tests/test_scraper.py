@@ -0,0 +1,79 @@
+import time
+import threading
+
+import pytest
+
+from scraper import Scraper
+from throttle import AutoThrottle
+
+
+class Response:
+    def __init__(self, url: str, status_code: int, text: str):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = {}
+
+
+def slow_request(url: str, headers: dict={}) -> Response:
+    if url.endswith('/robots.txt'):
+        return Response(url, 404, '')
+    i = int(url.rsplit('/', 1)[1])
+    # 後のURLほど速く返ってくる
+    time.sleep((10 - i) * 0.005)
+    return Response(url, 200, f'<p>{i}</p>')
+
+
+def test_map_returns_results_in_input_order():
+    scraper = Scraper('https://www.ebay.com/', max_workers=4)
+    scraper.request = slow_request
+    threads = set()
+
+    def fetch(scraper, url):
+        threads.add(threading.current_thread())
+        scraper.get(url)
+        time.sleep(0.01)
+        # 他のスレッドが取得したページに置き換わっていない
+        return scraper.url, scraper.select_one('p').text
+
+    urls = [f'https://www.ebay.com/itm/{i}' for i in range(10)]
+    assert list(scraper.map(fetch, urls)) == [(i_url, str(i)) for i, i_url in enumerate(urls)]
+    assert len(threads) > 1
+
+
+def test_map_raises_exception_of_task():
+    scraper = Scraper('https://www.ebay.com/', max_workers=2)
+
+    def fetch(scraper, i):
+        if i == 3:
+            raise ValueError(i)
+        return i
+
+    results = scraper.map(fetch, range(10))
+    assert [next(results) for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        next(results)
+
+
+def test_acquire_spaces_out_requests_to_same_host():
+    throttle = AutoThrottle(0.05)
+    times = {}
+
+    def acquire(url):
+        throttle.acquire(url)
+        times.setdefault(url.split('/')[2], []).append(time.monotonic())
+
+    threads = [threading.Thread(target=acquire, args=(f'https://{i_host}/itm/{i}',))
+               for i in range(4) for i_host in ('www.ebay.com', 'www.ebay.co.uk')]
+    for i_thread in threads:
+        i_thread.start()
+    for i_thread in threads:
+        i_thread.join()
+
+    for i_times in times.values():
+        i_times.sort()
+        assert len(i_times) == 4
+        # 同時に待っても、同じホストには間隔を空けて1つずつリクエストする
+        assert all(j - i >= 0.045 for i, j in zip(i_times, i_times[1:]))
+    # 別のホストは互いに待たない
+    assert abs(times['www.ebay.com'][0] - times['www.ebay.co.uk'][0]) < 0.03
@@ -0,0 +1,69 @@
+import time
+import threading
+import multiprocessing
+
+import shard
+from checkpoint import Checkpoint
+from shard import WorkQueue, QUEUED, CLAIMED, FINISHED
+
+
+CRITERIA_LIST = [{'メーカー': 'kawai', '製品型番': f'NV{i}', 'keyword': f'kawai+NV{i}'} for i in range(5)]
+
+
+def test_claim_in_input_order(tmp_path):
+    with WorkQueue(str(tmp_path / 'queue.db')) as queue:
+        queue.put_all(CRITERIA_LIST)
+        # 登録済みのキーワードは無視する
+        queue.put_all(CRITERIA_LIST[:2])
+        assert queue.count(QUEUED) == 5
+
+        assert queue.claim('w1') == CRITERIA_LIST[0]
+        assert queue.claim('w2') == CRITERIA_LIST[1]
+        queue.finish(CRITERIA_LIST[0]['keyword'])
+        assert (queue.count(QUEUED), queue.count(CLAIMED), queue.count(FINISHED)) == (3, 1, 1)
+        assert queue.count_by_worker() == {'w1': 1}
+
+
+def test_requeue_claimed(tmp_path):
+    with WorkQueue(str(tmp_path / 'queue.db')) as queue:
+        queue.put_all(CRITERIA_LIST)
+        queue.claim('w1')
+        queue.claim('w1')
+        queue.requeue_claimed()
+        assert queue.count(CLAIMED) == 0
+        assert queue.claim('w2') == CRITERIA_LIST[0]
+
+
+def test_concurrent_claims_are_unique(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    with WorkQueue(path) as queue:
+        queue.put_all(CRITERIA_LIST + [{'keyword': f'k{i}'} for i in range(45)])
+    claimed = []
+
+    def claim_all(worker_id):
+        # ワーカーごとに別の接続を使う
+        with WorkQueue(path) as queue:
+            while (criteria := queue.claim(worker_id)) is not None:
+                claimed.append(criteria['keyword'])
+
+    threads = [threading.Thread(target=claim_all, args=(f'w{i}',)) for i in range(4)]
+    for i_thread in threads:
+        i_thread.start()
+    for i_thread in threads:
+        i_thread.join()
+    assert len(claimed) == 50
+    assert len(set(claimed)) == 50
+
+
+def test_monitor_reports_once_per_exit(tmp_path, monkeypatch):
+    reports = []
+    monkeypatch.setattr(shard, 'report', lambda *args: reports.append(time.monotonic()))
+    monkeypatch.setattr(shard, 'REPORT_INTERVAL', 60)
+    workers = [multiprocessing.Process(target=time.sleep, args=(i * 0.2,)) for i in range(1, 4)]
+    for i_worker in workers:
+        i_worker.start()
+    with WorkQueue(str(tmp_path / 'queue.db')) as queue, Checkpoint(str(tmp_path / 'checkpoint.db')) as checkpoint:
+        shard.monitor(workers, queue, checkpoint)
+    # 終わったワーカーでwaitがすぐに返り続けると、報告が繰り返される
+    assert 1 <= len(reports) <= len(workers)
+    assert all(i.exitcode == 0 for i in workers)
@@ -0,0 +1,12 @@
+import sys
+
+import pytest
+
+from transport import Http2Session
+
+
+@pytest.mark.parametrize('module', ['httpx', 'h2'])
+def test_http2_requires_httpx_and_h2(module, monkeypatch):
+    monkeypatch.setitem(sys.modules, module, None)
+    with pytest.raises(ImportError, match=r'pip install httpx\[http2\]'):
+        Http2Session()
@@ -0,0 +1,129 @@
+import time
+import random
+import threading
+import urllib.parse
+import email.utils
+from typing import Union, Optional
+
+
+# 429とこれらのステータスコードは一時的なエラーとして、間隔を広げて再試行する
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-Afterヘッダーの値(秒数またはHTTP日付)を、待つべき秒数に変換する。
+
+    Args:
+        value (Optional[str]): _description_
+
+    Returns:
+        Optional[float]: 解釈できなかった場合はNone
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0)
+
+
+class HostState:
+    """
+    1つのホストに対するリクエスト間隔と、次にリクエストしてよい時刻。
+    """
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+
+class AutoThrottle:
+    """
+    ScrapyのAutoThrottleと同じ方法で、ホストごとのリクエスト間隔をレスポンスに応じて調整する。
+
+    - 成功したレスポンスでは、間隔を「レイテンシ / target_concurrency」に近づける。
+      レスポンスが速ければ間隔は短くなり、遅ければ長くなる。
+    - 429と5xxでは間隔を2倍にし(指数バックオフ)、次のリクエストの時刻にジッターを加える。
+      Retry-Afterが指定されていれば、その時刻まで次のリクエストを待たせる。
+
+    Args:
+        start_delay (Union[float, int]): 最初のリクエスト間隔(秒)
+        min_delay (Union[float, int], optional): リクエスト間隔の下限. Defaults to 0.
+        max_delay (Union[float, int], optional): リクエスト間隔の上限. Defaults to 60.
+        target_concurrency (float, optional): 1つのホストに同時に送るリクエスト数の目安. Defaults to 1.
+    """
+    def __init__(self, start_delay: Union[float, int], min_delay: Union[float, int]=0,
+                 max_delay: Union[float, int]=60, target_concurrency: float=1):
+        self.start_delay = start_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.target_concurrency = target_concurrency
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+
+    def get_state(self, url: str) -> HostState:
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None:
+                state = HostState(self.clamp(self.start_delay))
+                self.hosts[host] = state
+        return state
+
+
+    def clamp(self, delay: float) -> float:
+        return min(max(delay, self.min_delay), self.max_delay)
+
+
+    def get_delay(self, url: str) -> float:
+        return self.get_state(url).delay
+
+
+    def acquire(self, url: str):
+        """
+        URLのホストに対するリクエストが許可されるまで待機する。
+        待機している間に他のスレッドが次の枠を予約できるよう、予約してから待つ。
+
+        Args:
+            url (str): リクエスト先のURL
+        """
+        state = self.get_state(url)
+        with state.lock:
+            now = time.monotonic()
+            start = max(state.next_time, now)
+            state.next_time = start + state.delay
+        if start > now:
+            time.sleep(start - now)
+
+
+    def feedback(self, url: str, latency: float, status_code: Optional[int], retry_after: Optional[float]=None):
+        """
+        レスポンスの結果からホストのリクエスト間隔を調整する。
+
+        Args:
+            url (str): _description_
+            latency (float): リクエストを送ってからレスポンスヘッダーを受け取るまでの時間
+            status_code (Optional[int]): ステータスコード。接続エラーの場合はNone
+            retry_after (Optional[float], optional): Retry-Afterで指定された秒数. Defaults to None.
+        """
+        state = self.get_state(url)
+        with state.lock:
+            if status_code is None or status_code in RETRY_STATUS_CODES:
+                # 初期値が0でもバックオフできるように、1秒を下限にして2倍にする
+                state.delay = self.clamp(max(state.delay, 1) * 2)
+                wait_time = retry_after if retry_after is not None else state.delay * random.uniform(1, 1.5)
+                state.next_time = max(state.next_time, time.monotonic() + wait_time)
+                return
+
+            target_delay = latency / self.target_concurrency
+            new_delay = max(target_delay, (state.delay + target_delay) / 2)
+            # エラーのレスポンスは速く返ってくることが多いので、それで間隔を縮めない
+            if status_code != 200 and new_delay <= state.delay:
+                return
+            state.delay = self.clamp(new_delay)
@@ -0,0 +1,115 @@
+"""
+Scraperが使うHTTPクライアント(トランスポート)を作成する。
+
+- requests: コネクションプールの大きさ、アダプタでの再試行、圧縮方式を指定したrequests.Session
+- http2: httpxのHTTP/2クライアント。多数の詳細ページへのリクエストを少数のコネクションで多重化する
+
+どちらもrequests.Sessionと同じく、headers、get(url, headers=...)、close()を持つ。
+"""
+from datetime import timedelta
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from urllib3.util.request import ACCEPT_ENCODING
+
+
+TRANSPORTS = ['requests', 'http2']
+
+
+def create_session(transport: str='requests', pool_size: int=10, max_retries: int=2,
+                   timeout: Optional[float]=None):
+    """
+    トランスポートを作成する。
+
+    Args:
+        transport (str, optional): 'requests'または'http2'. Defaults to 'requests'.
+        pool_size (int, optional): ホストごとに保持するコネクション数. Defaults to 10.
+        max_retries (int, optional): 接続エラーや読み込みエラーを再試行する回数. Defaults to 2.
+        timeout (Optional[float], optional): 接続と読み込みのタイムアウト(秒). Defaults to None.
+
+    Returns:
+        _type_: requests.Sessionまたはhttpxのクライアントをラップしたもの
+    """
+    if transport == 'requests':
+        return TunedSession(pool_size, max_retries, timeout)
+    if transport == 'http2':
+        return Http2Session(pool_size, max_retries, timeout)
+    raise ValueError(f'Unknown transport "{transport}". Choose from {TRANSPORTS}.')
+
+
+class TunedSession(requests.Session):
+    """
+    コネクションプールと再試行を設定したrequests.Session。
+
+    ステータスコードによる再試行はScraperのAutoThrottleが間隔を調整しながら行うので、
+    アダプタでは接続エラーと読み込みエラーだけを再試行する。
+    """
+    def __init__(self, pool_size: int=10, max_retries: int=2, timeout: Optional[float]=None):
+        super().__init__()
+        self.timeout = timeout
+        retry = Retry(total=max_retries, connect=max_retries, read=max_retries, status=0,
+                      backoff_factor=0.5, allowed_methods=['GET', 'HEAD'], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        # brotliがインストールされていればbrも受け付ける
+        self.headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+class Http2Response:
+    """
+    httpxのレスポンスを、Scraperとキャッシュが使うrequests.Responseの属性に合わせたもの。
+    """
+    def __init__(self, response):
+        self.url = str(response.url)
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+        self.text = response.text
+        self.elapsed = response.elapsed if response.elapsed is not None else timedelta(0)
+        self.http_version = response.http_version
+
+
+class Http2Session:
+    """
+    httpxのHTTP/2クライアントをrequests.Sessionと同じように使えるようにしたもの。
+    HTTP/2をサポートしないサーバーにはHTTP/1.1で接続する。
+    """
+    def __init__(self, pool_size: int=10, max_retries: int=2, timeout: Optional[float]=None):
+        try:
+            import httpx
+            # http2=Trueのトランスポートはh2がないと作れない
+            import h2
+        except ImportError:
+            raise ImportError('HTTP/2 transport requires httpx. Install it with "pip install httpx[http2]".')
+        self.httpx = httpx
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        # 接続エラーの再試行はhttpxのトランスポートに任せる
+        transport = httpx.HTTPTransport(http2=True, limits=limits, retries=max_retries)
+        # Accept-Encodingはhttpxが展開できる方式(brotliがあればbrも)を自動で送る
+        self.client = httpx.Client(transport=transport, timeout=timeout, follow_redirects=True)
+        self.headers = self.client.headers
+        self.headers['User-Agent'] = requests.utils.default_user_agent()
+
+
+    def get(self, url: str, headers: dict={}) -> Http2Response:
+        """
+        GETリクエストを送る。httpxの例外はScraperが扱えるようrequestsの例外に変換する。
+        """
+        try:
+            return Http2Response(self.client.get(url, headers=headers))
+        except self.httpx.TimeoutException as e:
+            raise requests.Timeout(str(e)) from e
+        except self.httpx.TransportError as e:
+            raise requests.ConnectionError(str(e)) from e
+
+
+    def close(self):
+        self.client.close()
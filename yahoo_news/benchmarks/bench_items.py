@@ -0,0 +1,83 @@
+"""
+Itemの表現のベンチマーク。MongoDBには接続しない。
+
+--items件のItemについて、次の2つの表現のメモリと、MongoPipelineが保存するドキュメントにする時間を比較する。
+- scrapy.Item: 以前のdictを持つscrapy.Item(post_timeは文字列)をItemAdapter.asdictで変換する
+- dataclass: __slots__のNewsTopicsItemをto_bsonで変換する
+yahoo_newsディレクトリで`python benchmarks/bench_items.py`として実行する。
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import scrapy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from yahoo_news.items import NewsTopicsItem
+from yahoo_news.pipelines import to_document
+
+
+ITEM_NUM = 100_000
+JST = timezone(timedelta(hours=9))
+
+
+class LegacyNewsTopicsItem(scrapy.Item):
+    key = scrapy.Field()
+    title = scrapy.Field()
+    post_time = scrapy.Field()
+    vender = scrapy.Field()
+    description = scrapy.Field()
+    article_url = scrapy.Field()
+
+
+def make_items(name: str, item_num: int) -> list:
+    post_time = datetime(2024, 1, 1, 10, tzinfo=JST)
+    items = []
+    for i in range(item_num):
+        fields = {
+            'key': f'{i:040x}',
+            'title': f'Title {i}',
+            'post_time': post_time,
+            'vender': 'Vendor',
+            'description': f'description {i}',
+            'article_url': f'https://news.yahoo.co.jp/articles/{i:040x}',
+        }
+        if name == 'scrapy.Item':
+            fields['post_time'] = post_time.strftime('%Y-%m-%d %H:%M:%S')
+            items.append(LegacyNewsTopicsItem(**fields))
+        else:
+            items.append(NewsTopicsItem(**fields))
+    return items
+
+
+def run(name: str, item_num: int) -> dict:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = make_items(name, item_num)
+    # 値の文字列は表現によらず同じなので、メモリは値を含めた合計で比べる
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for i_item in items:
+        to_document(i_item)
+    seconds = time.perf_counter() - start
+    return {'bytes_per_item': memory / item_num, 'seconds': seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=ITEM_NUM)
+    args = parser.parse_args()
+
+    print(f'{"item":>12} {"bytes/item":>11} {"to document [s]":>16}')
+    for i_name in ('scrapy.Item', 'dataclass'):
+        result = run(i_name, args.items)
+        print(f'{i_name:>12} {result["bytes_per_item"]:>11.1f} {result["seconds"]:>16.3f}')
+
+
+if __name__ == '__main__':
+    main()
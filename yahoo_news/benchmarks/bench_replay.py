@@ -0,0 +1,180 @@
+"""
+フィクスチャストアを使ったNewsTopicsSpiderのオフラインのベンチマーク。ネットワークとMongoDBには接続しない。
+
+- parse_pickup: フィクスチャから作ったHtmlResponseに対するparse_pickup_article(pages/s)
+- end_to_end: トピックスのページからルールでリンクを抽出し、各ピックアップ記事のコールバックで
+  Itemを作るまで(items/s)。ダウンロードの代わりにフィクスチャのHtmlResponseを使う
+
+各ベンチマークは別のプロセスで実行し、そのプロセスのピークRSSも記録する。
+--storeを指定しない場合は合成のページでフィクスチャストアを作る。
+--baselineに以前の--outputの結果を指定すると、スループットかピークRSSが--toleranceを超えて
+悪化したときに終了コード1で終わる。
+yahoo_newsディレクトリで`python benchmarks/bench_replay.py`として実行する。
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import resource
+import tempfile
+import traceback
+import argparse
+import multiprocessing
+
+from scrapy.http import Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+from fixtures import FixtureStore, ORIGIN, TOPICS_URL, make_response, make_sample_store
+from yahoo_news.spiders.news_topics import NewsTopicsSpider
+
+
+REPEAT_NUM = 20
+TOLERANCE = 0.2
+
+
+def create_spider():
+    # from_crawlerはMongoDBに接続するので、直接インスタンスを作る
+    spider = NewsTopicsSpider()
+    # CrawlSpider.from_crawlerで設定される属性
+    spider._follow_links = True
+    spider.seen_keys = set()
+    spider.incremental = False
+    return spider
+
+
+def bench_parse_pickup(store_dir):
+    store = FixtureStore(store_dir)
+    spider = create_spider()
+    urls = store.urls(prefix=ORIGIN + '/pickup/')
+    start = time.perf_counter()
+    for _ in range(REPEAT_NUM):
+        for i_url in urls:
+            # HTMLのパースも計測に含めるため、毎回新しいレスポンスを作る
+            list(spider.parse_pickup_article(make_response(store, i_url)))
+    return {'count': len(urls) * REPEAT_NUM, 'seconds': time.perf_counter() - start, 'unit': 'pages'}
+
+
+async def iterate(result):
+    """
+    コールバックの戻り値をリストにする。Scrapyのバージョンによって非同期ジェネレータの場合がある。
+    """
+    if inspect.isasyncgen(result):
+        return [i async for i in result]
+    return list(result or [])
+
+
+async def crawl_fixtures(store):
+    spider = create_spider()
+    item_num = 0
+    for i_request in await iterate(spider._parse(make_response(store, TOPICS_URL))):
+        if not isinstance(i_request, Request):
+            continue
+        response = make_response(store, i_request.url, request=i_request)
+        if response is None:
+            continue
+        for i_result in await iterate(i_request.callback(response, **i_request.cb_kwargs)):
+            if not isinstance(i_result, Request):
+                item_num += 1
+    return item_num
+
+
+def bench_end_to_end(store_dir):
+    store = FixtureStore(store_dir)
+    item_num = 0
+    start = time.perf_counter()
+    for _ in range(REPEAT_NUM):
+        item_num += asyncio.run(crawl_fixtures(store))
+    return {'count': item_num, 'seconds': time.perf_counter() - start, 'unit': 'items'}
+
+
+BENCHMARKS = {
+    'parse_pickup': bench_parse_pickup,
+    'end_to_end': bench_end_to_end,
+}
+
+
+def run_in_process(name, store_dir, result_queue):
+    try:
+        result = BENCHMARKS[name](store_dir)
+    except Exception:
+        # 親プロセスが結果を待ち続けないよう、例外も結果として返す
+        result_queue.put({'error': traceback.format_exc()})
+        return
+    result['rate'] = result['count'] / result['seconds']
+    # Linuxではru_maxrssの単位はKiB
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    result_queue.put(result)
+
+
+def run(name, store_dir):
+    """
+    ベンチマークを新しいプロセスで実行する。親プロセスのメモリがピークRSSに含まれないようspawnを使う。
+    """
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=run_in_process, args=(name, store_dir, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    if 'error' in result:
+        raise RuntimeError(f'Benchmark "{name}" failed.\n{result["error"]}')
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    baselineより悪化したベンチマークの説明のリストを返す。
+    """
+    regressions = []
+    for name, i_result in results.items():
+        if name not in baseline:
+            continue
+        if i_result['rate'] < baseline[name]['rate'] * (1 - tolerance):
+            regressions.append(f'{name}: {i_result["rate"]:.1f} {i_result["unit"]}/s '
+                               f'(baseline {baseline[name]["rate"]:.1f})')
+        if i_result['peak_rss_mb'] > baseline[name]['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f'{name}: peak RSS {i_result["peak_rss_mb"]:.1f} MB '
+                               f'(baseline {baseline[name]["peak_rss_mb"]:.1f})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', default=None, help='フィクスチャストアのディレクトリ。省略すると合成のページを使う。')
+    parser.add_argument('--only', nargs='*', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--output', default=None, help='結果を書き出すjsonファイル')
+    parser.add_argument('--baseline', default=None, help='比較する以前の結果のjsonファイル')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_dir = args.store
+        if store_dir is None:
+            store_dir = os.path.join(tmp_dir, 'store')
+            make_sample_store(store_dir)
+
+        results = {}
+        print(f'{"benchmark":>14} {"rate":>12} {"unit":>10} {"count":>7} {"peak RSS [MB]":>14}')
+        for i_name in args.only:
+            result = run(i_name, store_dir)
+            results[i_name] = result
+            print(f'{i_name:>14} {result["rate"]:>12.1f} {result["unit"] + "/s":>10} {result["count"]:>7} '
+                  f'{result["peak_rss_mb"]:>14.1f}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for i_regression in regressions:
+            print(f'REGRESSION: {i_regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
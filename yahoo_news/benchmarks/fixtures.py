@@ -0,0 +1,107 @@
+"""
+オフラインのベンチマーク用に、取得したHTMLを保存しておくフィクスチャストアと、
+そこからScrapyのHtmlResponseを作るファクトリ。
+
+フィクスチャストアはディレクトリで、manifest.jsonとgzip圧縮したHTMLからなる。
+ebay/benchmarks/fixtures.pyと同じ形式なので、どちらで記録したものも読める。
+"""
+import os
+import gzip
+import json
+import random
+import hashlib
+from typing import Optional
+
+from scrapy.http import HtmlResponse, Request
+
+
+MANIFEST_FILE_NAME = 'manifest.json'
+ORIGIN = 'https://news.yahoo.co.jp'
+TOPICS_URL = ORIGIN + '/topics'
+
+
+class FixtureStore:
+    """
+    URLをキーにHTMLを保存するフィクスチャストア。
+    """
+    def __init__(self, path, origin=ORIGIN):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest = {'origin': origin, 'keywords': {}, 'pages': {}}
+        manifest_path = os.path.join(path, MANIFEST_FILE_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+
+
+    def save(self, url, text, status=200):
+        file_name = hashlib.sha256(url.encode('utf-8')).hexdigest() + '.html.gz'
+        with gzip.open(os.path.join(self.path, file_name), 'wt', encoding='utf-8') as f:
+            f.write(text)
+        self.manifest['pages'][url] = {'file': file_name, 'status': status}
+
+
+    def load(self, url) -> Optional[tuple[int, str]]:
+        page = self.manifest['pages'].get(url)
+        if page is None:
+            return None
+        with gzip.open(os.path.join(self.path, page['file']), 'rt', encoding='utf-8') as f:
+            return page['status'], f.read()
+
+
+    def urls(self, prefix=''):
+        return [i for i in self.manifest['pages'] if i.startswith(prefix)]
+
+
+    def write_manifest(self):
+        tmp_path = os.path.join(self.path, MANIFEST_FILE_NAME + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_FILE_NAME))
+
+
+def make_response(store, url, request=None) -> Optional[HtmlResponse]:
+    """
+    フィクスチャのHTMLからHtmlResponseを作る。記録されていなければNoneを返す。
+
+    Args:
+        store (FixtureStore): _description_
+        url (str): _description_
+        request (Request, optional): Spiderのコールバックに渡すためのRequest. Defaults to None.
+    """
+    page = store.load(url)
+    if page is None:
+        return None
+    status, text = page
+    return HtmlResponse(url=url, status=status, body=text.encode('utf-8'), encoding='utf-8',
+                        request=request if request is not None else Request(url))
+
+
+def make_sample_store(path, pickup_num=8, padding_size=100 * 1024, seed=0) -> FixtureStore:
+    """
+    記録したページがない環境(CIなど)のために、NewsTopicsSpiderと同じセレクタで抽出できる
+    合成のページでフィクスチャストアを作る。
+
+    Args:
+        path (str): フィクスチャストアのディレクトリ
+        pickup_num (int, optional): ピックアップ記事の数. Defaults to 8.
+        padding_size (int, optional): 実際のページの大きさに近づけるために加えるHTMLの大きさ. Defaults to 100*1024.
+        seed (int, optional): _description_. Defaults to 0.
+    """
+    rng = random.Random(seed)
+    padding = ''.join(f'<div class="pad"><span>{rng.getrandbits(64):x}</span></div>'
+                      for _ in range(padding_size // 48))
+    store = FixtureStore(path)
+    pickup_ids = [6400000 + i for i in range(pickup_num)]
+    links = ''.join(f'<li><a href="{ORIGIN}/pickup/{i}">トピック {i}</a></li>' for i in pickup_ids)
+    store.save(TOPICS_URL, f'<html><body><div id="contentsWrap"><div><ul>{links}</ul></div>{padding}</div></body></html>')
+    for i_id in pickup_ids:
+        store.save(f'{ORIGIN}/pickup/{i_id}', (
+            f'<html><head><title>記事 {i_id} - Yahoo!ニュース</title>'
+            f'<meta name="pubdate" content="2024-01-{rng.randrange(1, 29):02d}T10:{rng.randrange(60):02d}:00+09:00">'
+            f'</head><body>{padding}<article><div><span><a href="{ORIGIN}/articles/{i_id:x}">'
+            f'<span><span>配信元{i_id % 7}</span></span></a></span></div></article>'
+            f'<p class="highLightSearchTarget">  記事 {i_id} の\n 概要   です。  </p></body></html>'
+        ))
+    store.write_manifest()
+    return store
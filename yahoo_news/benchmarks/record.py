@@ -0,0 +1,61 @@
+"""
+ベンチマーク用に、実際のYahoo!ニュースのトピックスとピックアップ記事をフィクスチャストアに記録する。
+
+NewsTopicsSpiderのルールでリンクをたどり、取得したレスポンスをすべて記録する。
+MongoDBには接続せず、Itemも保存しない。
+yahoo_newsディレクトリで`python benchmarks/record.py fixtures/yahoo`として実行する。
+"""
+import os
+import sys
+import argparse
+
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+from fixtures import FixtureStore
+from yahoo_news.spiders.news_topics import NewsTopicsSpider
+
+
+class RecordingSpider(NewsTopicsSpider):
+    """
+    MongoDBに接続せず、処理済みの記事も含めてすべてのピックアップ記事を取得するNewsTopicsSpider。
+    """
+    name = 'news_topics_recording'
+
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        # NewsTopicsSpider.from_crawlerはMongoDBに接続するので、CrawlSpider.from_crawlerを直接呼ぶ
+        spider = super(NewsTopicsSpider, cls).from_crawler(crawler, *args, **kwargs)
+        spider.seen_keys = set()
+        spider.incremental = True
+        return spider
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('store_dir', help='フィクスチャストアのディレクトリ')
+    args = parser.parse_args()
+
+    store = FixtureStore(args.store_dir)
+
+    def response_received(response, request, spider):
+        store.save(response.url, response.text, response.status)
+
+    settings = get_project_settings()
+    settings.set('ITEM_PIPELINES', {})
+    settings.set('INCREMENTAL_CRAWL', False)
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(RecordingSpider)
+    crawler.signals.connect(response_received, signal=signals.response_received)
+    process.crawl(crawler)
+    process.start()
+    store.write_manifest()
+    print(f'Recorded {len(store.urls())} pages into "{args.store_dir}".')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# yahoo_newsパッケージをscrapy.cfgのあるディレクトリから読み込む
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
@@ -0,0 +1,181 @@
+import time
+import asyncio
+import threading
+
+import fakeredis
+import mongomock
+import pytest
+import redis
+from mongomock.store import ServerStore
+from scrapy import Request
+from scrapy.utils.request import RequestFingerprinter
+
+import yahoo_news.frontier
+from yahoo_news.frontier import (FrontierDupeFilter, FrontierScheduler, MongoFrontierStore, RedisFrontierStore,
+                                 SharedDelayMiddleware)
+
+
+class Spider:
+    name = 'news_topics'
+
+
+class Downloader:
+    def __init__(self):
+        self.active = set()
+        self._delay = 3
+
+
+class Crawler:
+    def __init__(self):
+        self.engine = type('Engine', (), {})()
+        self.engine.downloader = Downloader()
+
+
+@pytest.fixture(params=['mongodb', 'redis'])
+def make_store(request, monkeypatch):
+    """
+    同じバックエンドを共有するストアを作る関数を返す。ストアごとに別のプロセスとみなせる。
+    """
+    if request.param == 'mongodb':
+        server_store = ServerStore()
+
+        class MockMongoClient(mongomock.MongoClient):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, _store=server_store, **kwargs)
+
+            @property
+            def admin(self):
+                class Admin:
+                    def command(self, *args, **kwargs):
+                        return {'ok': 1}
+                return Admin()
+
+        monkeypatch.setattr(yahoo_news.frontier, 'MongoClient', MockMongoClient)
+        return lambda: MongoFrontierStore('mongodb://localhost:27017', 'portfolio', 'news_topics', 600)
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, 'from_url', classmethod(lambda cls, url: fakeredis.FakeRedis(server=server)))
+    return lambda: RedisFrontierStore('redis://localhost:6379/0', 'news_topics', 600)
+
+
+def test_claim_by_priority_then_order(make_store):
+    store = make_store()
+    store.push(b'a', 0)
+    store.push(b'b', 5)
+    store.push(b'c', 0)
+    store.push(b'd', -1)
+    assert [i_data for _, i_data in store.claim(3, 600)] == [b'b', b'a', b'c']
+    assert [i_data for _, i_data in store.claim(3, 600)] == [b'd']
+    assert store.claim(3, 600) == []
+    # 取得中のリクエストも数える
+    assert len(store) == 4
+
+
+def test_claimed_requests_go_to_one_process(make_store):
+    stores = [make_store(), make_store()]
+    for i in range(10):
+        stores[0].push(str(i).encode(), 0)
+    claimed = []
+    while True:
+        batches = [i_store.claim(3, 600) for i_store in stores]
+        if not any(batches):
+            break
+        claimed += [i_data for i_batch in batches for _, i_data in i_batch]
+    assert sorted(claimed) == sorted(str(i).encode() for i in range(10))
+
+
+def test_ack_and_release(make_store):
+    store = make_store()
+    store.push(b'a', 0)
+    store.push(b'b', 0)
+    (a_id, _), (b_id, _) = store.claim(2, 600)
+    store.ack([a_id])
+    store.release([b_id])
+    assert len(store) == 1
+    assert [i_data for _, i_data in make_store().claim(2, 600)] == [b'b']
+
+
+def test_expired_lease_is_claimed_again(make_store):
+    store = make_store()
+    store.push(b'a', 0)
+    assert [i_data for _, i_data in store.claim(1, -1)] == [b'a']
+    # 取り出したプロセスが止まってackされなかった場合、期限が過ぎると他のプロセスが取り出す
+    assert [i_data for _, i_data in make_store().claim(1, 600)] == [b'a']
+    assert make_store().claim(1, 600) == []
+
+
+def test_add_fingerprint_once(make_store):
+    assert make_store().add_fingerprint('abc')
+    assert not make_store().add_fingerprint('abc')
+
+
+def test_reserve_spaces_out_all_processes(make_store):
+    stores = [make_store(), make_store()]
+    waits = [stores[i % 2].reserve('example.com', 2) for i in range(3)]
+    assert waits[0] == 0
+    assert waits[1] == pytest.approx(2, abs=0.1)
+    assert waits[2] == pytest.approx(4, abs=0.1)
+    # ホストごとに別の間隔
+    assert stores[0].reserve('example.org', 2) == 0
+
+
+def make_scheduler(make_store, crawler, max_active_requests=2):
+    store = make_store()
+    dupefilter = FrontierDupeFilter(store, RequestFingerprinter())
+    scheduler = FrontierScheduler(store, dupefilter, max_active_requests=max_active_requests, poll_interval=0,
+                                  crawler=crawler)
+    scheduler.spider = Spider()
+    return scheduler
+
+
+def test_scheduler_acks_requests_that_left_the_downloader(make_store):
+    crawler = Crawler()
+    scheduler = make_scheduler(make_store, crawler)
+    for i in range(3):
+        assert scheduler.enqueue_request(Request(f'https://example.com/{i}'))
+    # 同じリクエストは他のプロセスで登録済みでも入れない
+    assert not make_scheduler(make_store, Crawler()).enqueue_request(Request('https://example.com/0'))
+
+    first = scheduler.next_request()
+    second = scheduler.next_request()
+    crawler.engine.downloader.active.update([first, second])
+    # 取得中のリクエストがmax_active_requests件あるので、取り出さない
+    assert scheduler.next_request() is None
+    crawler.engine.downloader.active.remove(first)
+    third = scheduler.next_request()
+    assert [first.url, second.url, third.url] == [f'https://example.com/{i}' for i in range(3)]
+    assert len(scheduler.store) == 2
+
+    # 取得し終えなかったリクエストは、閉じるときに他のプロセスが取り出せるようにする
+    crawler.engine.downloader.active.add(third)
+    scheduler.close('finished')
+    other = make_scheduler(make_store, Crawler())
+    assert sorted(other.next_request().url for _ in range(2)) == [second.url, third.url]
+
+
+def test_shared_delay_middleware(make_store):
+    crawler = Crawler()
+    middleware = SharedDelayMiddleware(0.2)
+    middleware.crawler = crawler
+    middleware.store = make_store()
+    middleware.spider_opened(Spider())
+    # 間隔はストアの予約で守るので、ダウンローダーでは待たない
+    assert crawler.engine.downloader._delay == 0
+
+    threads = []
+    reserve = middleware.store.reserve
+
+    def record_thread(slot, delay):
+        threads.append(threading.current_thread())
+        return reserve(slot, delay)
+
+    middleware.store.reserve = record_thread
+
+    async def download_twice():
+        start = time.monotonic()
+        for _ in range(2):
+            assert await middleware.process_request(Request('https://example.com/'), Spider()) is None
+        return time.monotonic() - start
+
+    assert asyncio.run(download_twice()) == pytest.approx(0.2, abs=0.1)
+    assert all(i_thread is not threading.main_thread() for i_thread in threads)
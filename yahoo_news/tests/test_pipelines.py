@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+import mongomock
+import mongomock_motor
+import pytest
+from pymongo.errors import BulkWriteError
+
+import yahoo_news.utils
+from yahoo_news.items import NewsTopicsItem
+from yahoo_news.pipelines import AsyncMongoPipeline, MongoPipeline, items_stored
+
+
+class MockMongoClient(mongomock.MongoClient):
+    @property
+    def admin(self):
+        class Admin:
+            def command(self, *args, **kwargs):
+                return {'ok': 1}
+        return Admin()
+
+
+class MockMotorClient(mongomock_motor.AsyncMongoMockClient):
+    @property
+    def admin(self):
+        class Admin:
+            async def command(self, *args, **kwargs):
+                return {'ok': 1}
+        return Admin()
+
+
+class Spider:
+    name = 'news_topics'
+    logger = logging.getLogger('news_topics')
+
+
+class Stats:
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, count=1):
+        self.values[key] = self.values.get(key, 0) + count
+
+
+class Signals:
+    def __init__(self):
+        self.sent = []
+
+    async def send_catch_log_async(self, signal, **kwargs):
+        self.sent.append((signal, kwargs))
+        return []
+
+
+@pytest.fixture(autouse=True)
+def mock_mongo(monkeypatch):
+    monkeypatch.setattr(yahoo_news.utils, 'MongoClient', MockMongoClient)
+    monkeypatch.setattr(yahoo_news.utils, 'AsyncIOMotorClient', MockMotorClient)
+
+
+def make_item(key, title='title'):
+    return NewsTopicsItem(key=key, title=title, post_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+                          vender='vender', description='description', article_url=f'https://example.com/{key}')
+
+
+def open_pipeline(buffer_size=100, flush_interval=0):
+    pipeline = MongoPipeline('mongodb://localhost:27017', 'portfolio', buffer_size=buffer_size,
+                             flush_interval=flush_interval, stats=Stats())
+    # flush_intervalが正だと定期的に書き込むループを開始するので、開いてから設定する
+    pipeline.flush_interval = 0
+    pipeline.open_spider(Spider())
+    pipeline.flush_interval = flush_interval
+    return pipeline
+
+
+def test_flush_when_buffer_is_full():
+    pipeline = open_pipeline(buffer_size=2)
+    pipeline.process_item(make_item('a'), Spider())
+    assert pipeline.collection.count_documents({}) == 0
+    pipeline.process_item(make_item('b'), Spider())
+    assert pipeline.collection.count_documents({}) == 2
+    assert pipeline.buffer == []
+    assert pipeline.stats.values['mongodb/upserted'] == 2
+
+
+def test_flush_when_interval_expired():
+    pipeline = open_pipeline(flush_interval=5)
+    pipeline.process_item(make_item('a'), Spider())
+    pipeline.flush_if_expired(Spider())
+    assert pipeline.collection.count_documents({}) == 0
+
+    pipeline.flushed_at -= 5
+    pipeline.flush_if_expired(Spider())
+    assert pipeline.collection.count_documents({}) == 1
+
+
+def test_flush_on_close_spider():
+    pipeline = open_pipeline()
+    pipeline.process_item(make_item('a'), Spider())
+    collection = pipeline.collection
+    pipeline.close_spider(Spider())
+    assert collection.count_documents({}) == 1
+    assert pipeline.stats.values['mongodb/flushes'] == 1
+
+
+def test_duplicate_key_errors_are_counted(monkeypatch):
+    pipeline = open_pipeline()
+    details = {'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'E11000 duplicate key error'}],
+               'nUpserted': 1, 'nModified': 0}
+
+    def bulk_write(requests, ordered=True):
+        raise BulkWriteError(details)
+
+    monkeypatch.setattr(pipeline.collection, 'bulk_write', bulk_write)
+    pipeline.process_item(make_item('a'), Spider())
+    pipeline.process_item(make_item('b'), Spider())
+    pipeline.flush(Spider())
+    assert pipeline.stats.values['mongodb/duplicate_key_errors'] == 1
+    assert pipeline.stats.values['mongodb/upserted'] == 1
+
+
+def test_other_bulk_write_errors_are_raised(monkeypatch):
+    pipeline = open_pipeline()
+    details = {'writeErrors': [{'index': 0, 'code': 2, 'errmsg': 'BadValue'}], 'nUpserted': 0, 'nModified': 0}
+
+    def bulk_write(requests, ordered=True):
+        raise BulkWriteError(details)
+
+    monkeypatch.setattr(pipeline.collection, 'bulk_write', bulk_write)
+    pipeline.process_item(make_item('a'), Spider())
+    with pytest.raises(BulkWriteError):
+        pipeline.flush(Spider())
+
+
+def test_last_item_wins_for_same_key():
+    pipeline = open_pipeline()
+    pipeline.process_item(make_item('a', title='old'), Spider())
+    pipeline.process_item(make_item('b'), Spider())
+    pipeline.process_item(make_item('a', title='new'), Spider())
+    keys, requests = pipeline.take_requests()
+    assert sorted(keys) == ['a', 'b']
+    assert len(requests) == 2
+
+    pipeline.process_item(make_item('a', title='old'), Spider())
+    pipeline.process_item(make_item('a', title='new'), Spider())
+    pipeline.flush(Spider())
+    assert pipeline.collection.find_one({'key': 'a'})['title'] == 'new'
+
+
+def test_async_pipeline_flushes_and_notifies():
+    async def run():
+        signals = Signals()
+        pipeline = AsyncMongoPipeline('mongodb://localhost:27017', 'portfolio', buffer_size=2,
+                                      flush_interval=0, stats=Stats(), signals=signals)
+        await pipeline.open_spider(Spider())
+        await pipeline.process_item(make_item('a'), Spider())
+        await pipeline.process_item(make_item('b'), Spider())
+        await pipeline.process_item(make_item('c'), Spider())
+        collection = pipeline.collection
+        assert await collection.count_documents({}) == 2
+        await pipeline.close_spider(Spider())
+        assert await collection.count_documents({}) == 3
+        return signals.sent
+
+    sent = asyncio.run(run())
+    assert [(i_signal, i_kwargs['keys']) for i_signal, i_kwargs in sent] == [(items_stored, ['a', 'b']),
+                                                                             (items_stored, ['c'])]
@@ -0,0 +1,579 @@
+"""
+複数のプロセスでクロールを分担するための、共有のリクエストキューと重複除去。
+
+Schedulerのリクエストキュー、DupeFilterの取得済みリクエストの指紋、ホストごとの次に取得してよい時刻を
+MongoDBかRedisに置く。どのプロセスも同じキューからリクエストを取り出すので、プロセスを増やすと
+クロールを分担でき、同じリクエストは先に指紋を登録したプロセスだけがキューに入れる。
+DOWNLOAD_DELAYはプロセスごとではなく、すべてのプロセスを合わせたホストごとの間隔になる。
+
+FRONTIER_BACKENDに'mongodb'か'redis'を指定すると有効になる。指定しなければScrapy標準のSchedulerと
+DupeFilterを使う。
+
+    scrapy crawl news_topics -s FRONTIER_BACKEND=mongodb
+
+各プロセスはstart_urlsを取得するので、トピックス一覧は各プロセスが1回ずつ取得し、
+そこから辿るピックアップ記事はどれか1つのプロセスだけが取得する。
+"""
+import sys
+import time
+import pickle
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, OperationFailure
+from scrapy import signals
+from scrapy.core.scheduler import BaseScheduler, Scheduler
+from scrapy.dupefilters import BaseDupeFilter, RFPDupeFilter
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.misc import build_from_crawler, load_object
+from scrapy.utils.request import request_from_dict
+
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ['mongodb', 'redis']
+
+
+def import_redis():
+    try:
+        import redis
+    except ImportError:
+        raise ImportError('FRONTIER_BACKEND="redis" requires redis. Install it with "pip install redis".')
+    return redis
+
+
+class MongoFrontierStore:
+    """
+    リクエストキュー、指紋、ホストごとの時刻をMongoDBのコレクションに置くストア。
+
+    Args:
+        mongodb_uri (str): _description_
+        mongodb_database (str): _description_
+        prefix (str): コレクション名の接頭辞。スパイダー名を使う
+        fingerprint_ttl (Optional[int], optional): 指紋を保持する秒数。Noneなら削除しない. Defaults to None.
+    """
+    def __init__(self, mongodb_uri: str, mongodb_database: str, prefix: str,
+                 fingerprint_ttl: Optional[int]=None):
+        self.client = MongoClient(mongodb_uri)
+        try:
+            self.client.admin.command('ismaster')
+        except ConnectionFailure:
+            logger.error('Could not connect to MongoDB server. Please make sure mongod process is running.')
+            sys.exit(1)
+
+        db = self.client[mongodb_database]
+        self.requests = db[f'{prefix}_frontier_requests']
+        self.requests.create_index([('priority', DESCENDING), ('_id', ASCENDING)])
+        # _idを指紋にするので、同じ指紋の登録は1つのプロセスだけが成功する
+        self.fingerprints = db[f'{prefix}_frontier_fingerprints']
+        if fingerprint_ttl:
+            self.create_ttl_index(db, fingerprint_ttl)
+        # ホストごとの間隔はスパイダーによらず守る
+        self.slots = db['frontier_slots']
+
+
+    def create_ttl_index(self, db, fingerprint_ttl: int):
+        try:
+            self.fingerprints.create_index('created_at', expireAfterSeconds=fingerprint_ttl)
+        except OperationFailure:
+            # 以前の実行と秒数が違う場合は、既存のインデックスの秒数を変更する
+            db.command('collMod', self.fingerprints.name,
+                       index={'keyPattern': {'created_at': 1}, 'expireAfterSeconds': fingerprint_ttl})
+
+
+    def push(self, data: bytes, priority: int):
+        self.requests.insert_one({'priority': priority, 'data': data, 'lease_until': 0})
+
+
+    def claim(self, count: int, lease: float) -> list[tuple]:
+        """
+        優先度が最も高く、最も古いリクエストから最大count件を、lease秒の期限付きで取り出す。
+        取り出しと期限の設定は不可分なので、同じリクエストを複数のプロセスが取り出すことはない。
+        期限までにackされなかったリクエスト(取り出したプロセスが止まった場合など)は、また取り出せるようになる。
+
+        Returns:
+            list[tuple]: (id, data)のリスト
+        """
+        claimed = []
+        for _ in range(count):
+            now = time.time()
+            document = self.requests.find_one_and_update(
+                {'lease_until': {'$lte': now}}, {'$set': {'lease_until': now + lease}},
+                sort=[('priority', DESCENDING), ('_id', ASCENDING)], projection={'data': True})
+            if document is None:
+                break
+            claimed.append((document['_id'], document['data']))
+        return claimed
+
+
+    def ack(self, ids: list):
+        """
+        取得し終えたリクエストを削除する。
+        """
+        self.requests.delete_many({'_id': {'$in': ids}})
+
+
+    def release(self, ids: list):
+        """
+        取得しなかったリクエストを、すぐに他のプロセスが取り出せるようにする。
+        """
+        self.requests.update_many({'_id': {'$in': ids}}, {'$set': {'lease_until': 0}})
+
+
+    def __len__(self) -> int:
+        # 他のプロセスが取得中のリクエストも含む
+        return self.requests.estimated_document_count()
+
+
+    def add_fingerprint(self, fingerprint: str) -> bool:
+        """
+        指紋を登録する。既に登録されていればFalseを返す。
+        """
+        try:
+            # TTLインデックスは日付型のフィールドにしか効かない
+            self.fingerprints.insert_one({'_id': fingerprint, 'created_at': datetime.now(timezone.utc)})
+        except DuplicateKeyError:
+            return False
+        return True
+
+
+    def reserve(self, slot: str, delay: float) -> float:
+        """
+        ホストslotへの次の取得時刻を予約し、その時刻までの待ち時間(秒)を返す。
+        予約した時刻からdelay秒後を次の予約の時刻にする。
+
+        他のプロセスと同時に更新しないよう、読み込んだ時刻が変わっていない場合だけ更新する。
+        """
+        while True:
+            now = time.time()
+            document = self.slots.find_one({'_id': slot})
+            if document is None:
+                try:
+                    self.slots.insert_one({'_id': slot, 'next_time': now + delay})
+                except DuplicateKeyError:
+                    continue
+                return 0
+
+            start = max(document['next_time'], now)
+            result = self.slots.update_one({'_id': slot, 'next_time': document['next_time']},
+                                           {'$set': {'next_time': start + delay}})
+            if result.modified_count:
+                return start - now
+
+
+    def close(self):
+        self.client.close()
+
+
+class RedisFrontierStore:
+    """
+    MongoFrontierStoreのRedis版。
+
+    リクエストキューはスコアを優先度の符号を反転したものにしたソート済みセットで、
+    同じスコアの中では先に入れたものから取り出す。取り出したリクエストは、スコアを期限にした
+    取得中のソート済みセットに移す。指紋は1つずつ期限付きのキーにする。
+
+    Args:
+        redis_url (str): _description_
+        prefix (str): キーの接頭辞。スパイダー名を使う
+        fingerprint_ttl (Optional[int], optional): 指紋を保持する秒数。Noneなら削除しない. Defaults to None.
+    """
+    def __init__(self, redis_url: str, prefix: str, fingerprint_ttl: Optional[int]=None):
+        redis = import_redis()
+        self.watch_error = redis.WatchError
+        self.client = redis.Redis.from_url(redis_url)
+        try:
+            self.client.ping()
+        except redis.ConnectionError:
+            logger.error('Could not connect to Redis server. Please make sure redis-server process is running.')
+            sys.exit(1)
+
+        self.requests_key = f'{prefix}:frontier:requests'
+        self.claimed_key = f'{prefix}:frontier:claimed'
+        self.sequence_key = f'{prefix}:frontier:sequence'
+        self.fingerprint_prefix = f'{prefix}:frontier:fingerprints:'
+        self.slot_prefix = 'frontier:slots:'
+        self.fingerprint_ttl = fingerprint_ttl or None
+
+
+    def push(self, data: bytes, priority: int):
+        # 同じ内容のリクエストも別の要素にし、同じ優先度の中で入れた順に並ぶよう、通し番号を付ける。
+        # 取得中から戻すときのために優先度も付けておく
+        sequence = self.client.incr(self.sequence_key)
+        member = priority.to_bytes(4, 'big', signed=True) + sequence.to_bytes(8, 'big') + data
+        self.client.zadd(self.requests_key, {member: -priority})
+
+
+    def claim(self, count: int, lease: float) -> list[tuple]:
+        self.requeue_expired()
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.requests_key)
+                    members = pipe.zrange(self.requests_key, 0, count - 1)
+                    if not members:
+                        return []
+                    lease_until = time.time() + lease
+                    pipe.multi()
+                    pipe.zrem(self.requests_key, *members)
+                    pipe.zadd(self.claimed_key, {i_member: lease_until for i_member in members})
+                    pipe.execute()
+                    return [(i_member, i_member[12:]) for i_member in members]
+                except self.watch_error:
+                    continue
+
+
+    def requeue_expired(self):
+        """
+        期限までにackされなかったリクエストをキューに戻す。
+        """
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.claimed_key)
+                    members = pipe.zrangebyscore(self.claimed_key, '-inf', time.time())
+                    if not members:
+                        return
+                    pipe.multi()
+                    self.move_to_requests(pipe, members)
+                    pipe.execute()
+                    return
+                except self.watch_error:
+                    continue
+
+
+    def move_to_requests(self, pipe, members: list):
+        pipe.zrem(self.claimed_key, *members)
+        pipe.zadd(self.requests_key, {i_member: -int.from_bytes(i_member[:4], 'big', signed=True)
+                                      for i_member in members})
+
+
+    def ack(self, ids: list):
+        self.client.zrem(self.claimed_key, *ids)
+
+
+    def release(self, ids: list):
+        with self.client.pipeline() as pipe:
+            self.move_to_requests(pipe, ids)
+            pipe.execute()
+
+
+    def __len__(self) -> int:
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.zcard(self.requests_key)
+            pipe.zcard(self.claimed_key)
+            return sum(pipe.execute())
+
+
+    def add_fingerprint(self, fingerprint: str) -> bool:
+        return bool(self.client.set(self.fingerprint_prefix + fingerprint, 1,
+                                    nx=True, ex=self.fingerprint_ttl))
+
+
+    def reserve(self, slot: str, delay: float) -> float:
+        key = self.slot_prefix + slot
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    now = time.time()
+                    next_time = pipe.get(key)
+                    start = max(float(next_time), now) if next_time is not None else now
+                    pipe.multi()
+                    pipe.set(key, start + delay)
+                    pipe.execute()
+                    return start - now
+                except self.watch_error:
+                    continue
+
+
+    def close(self):
+        self.client.close()
+
+
+def create_store(settings, prefix: str):
+    """
+    FRONTIER_BACKENDに応じたストアを作る。
+
+    Args:
+        settings (Settings): _description_
+        prefix (str): コレクション名やキーの接頭辞
+
+    Returns:
+        Union[MongoFrontierStore, RedisFrontierStore]: _description_
+    """
+    backend = settings.get('FRONTIER_BACKEND')
+    fingerprint_ttl = settings.getint('FRONTIER_FINGERPRINT_TTL') or None
+    if backend == 'mongodb':
+        return MongoFrontierStore(settings.get('MONGODB_URI'), settings.get('MONGODB_DATABASE'),
+                                  prefix, fingerprint_ttl)
+    if backend == 'redis':
+        return RedisFrontierStore(settings.get('FRONTIER_REDIS_URL'), prefix, fingerprint_ttl)
+    raise ValueError(f'Unknown FRONTIER_BACKEND "{backend}". Choose from {BACKENDS}.')
+
+
+class FrontierDupeFilter(BaseDupeFilter):
+    """
+    取得済みリクエストの指紋をストアに登録するDupeFilter。すべてのプロセスで共有する。
+    FRONTIER_BACKENDを指定しなければ、Scrapy標準のRFPDupeFilterを返す。
+    """
+    def __init__(self, store, fingerprinter, stats=None, debug=False):
+        self.store = store
+        self.fingerprinter = fingerprinter
+        self.stats = stats
+        self.debug = debug
+        self.log_duplicates = True
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.get('FRONTIER_BACKEND'):
+            return build_from_crawler(RFPDupeFilter, crawler)
+        return cls(
+            store=create_store(crawler.settings, crawler.spidercls.name),
+            fingerprinter=crawler.request_fingerprinter,
+            stats=crawler.stats,
+            debug=crawler.settings.getbool('DUPEFILTER_DEBUG'),
+        )
+
+
+    def request_seen(self, request) -> bool:
+        return not self.store.add_fingerprint(self.fingerprinter.fingerprint(request).hex())
+
+
+    def close(self, reason):
+        self.store.close()
+
+
+    def log(self, request, spider):
+        if self.debug:
+            logger.debug('Filtered duplicate request: %(request)s', {'request': request},
+                         extra={'spider': spider})
+        elif self.log_duplicates:
+            logger.debug('Filtered duplicate request: %(request)s - no more duplicates will be shown '
+                         '(see DUPEFILTER_DEBUG to show all duplicates)', {'request': request},
+                         extra={'spider': spider})
+            self.log_duplicates = False
+        if self.stats is not None:
+            self.stats.inc_value('dupefilter/filtered')
+
+
+class FrontierScheduler(BaseScheduler):
+    """
+    リクエストをストアのキューに入れ、ストアのキューから取り出すScheduler。
+    FRONTIER_BACKENDを指定しなければ、Scrapy標準のSchedulerを返す。
+
+    キューのリクエストはFRONTIER_LEASE秒の期限付きで取り出し、ダウンローダーから出たら(取得し終えるか
+    取得せずに捨てられたら)キューから削除する。プロセスが止まって削除されなかったリクエストは、
+    期限が過ぎると他のプロセスが取り出す。
+
+    エンジンは繰り返しhas_pending_requestsとnext_requestを呼ぶので、ストアへの問い合わせは
+    取り出したリクエストを使い切ったときと、FRONTIER_POLL_INTERVAL秒に1回までにする。
+    キューが空でも、他のプロセスがリクエストを入れるかもしれないので、最後にキューが空でなかったときから
+    FRONTIER_IDLE_TIMEOUT秒はスパイダーを閉じずに待つ。
+    SharedDelayMiddlewareで待っている間もリクエストは取得中になるので、1つのプロセスがキューのリクエストを
+    抱え込まないよう、取得中のリクエストがFRONTIER_MAX_ACTIVE_REQUESTS件以上あれば取り出さない。
+    pickleできないリクエストは、Scrapy標準のSchedulerと同じくこのプロセスのメモリのキューに入れる。
+    """
+    def __init__(self, store, dupefilter, stats=None, idle_timeout=30, max_active_requests=2, lease=600,
+                 poll_interval=1, crawler=None):
+        self.store = store
+        self.df = dupefilter
+        self.stats = stats
+        self.idle_timeout = idle_timeout
+        self.max_active_requests = max_active_requests
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.crawler = crawler
+        self.local_requests = deque()
+        # ストアから取り出して、まだエンジンに渡していないリクエストの(id, data)
+        self.prefetched = deque()
+        # エンジンに渡して、まだackしていないリクエスト。id -> Request
+        self.claimed = {}
+        self.spider = None
+        self.last_active = time.monotonic()
+        self.polled_at = None
+        self.store_has_requests = True
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.get('FRONTIER_BACKEND'):
+            return Scheduler.from_crawler(crawler)
+        dupefilter_class = settings.get('DUPEFILTER_CLASS')
+        s = cls(
+            store=create_store(settings, crawler.spidercls.name),
+            dupefilter=build_from_crawler(load_object(dupefilter_class), crawler),
+            stats=crawler.stats,
+            idle_timeout=settings.getfloat('FRONTIER_IDLE_TIMEOUT', 30),
+            max_active_requests=settings.getint('FRONTIER_MAX_ACTIVE_REQUESTS', 2),
+            lease=settings.getfloat('FRONTIER_LEASE', 600),
+            poll_interval=settings.getfloat('FRONTIER_POLL_INTERVAL', 1),
+            crawler=crawler,
+        )
+        crawler.signals.connect(s.spider_idle, signal=signals.spider_idle)
+        return s
+
+
+    def open(self, spider):
+        self.spider = spider
+        self.last_active = time.monotonic()
+        spider.logger.info(f'Frontier has {len(self.store)} pending requests.')
+        return self.df.open()
+
+
+    def close(self, reason):
+        self.ack_finished()
+        # 取得しなかったリクエストは、期限を待たずに他のプロセスが取り出せるようにする
+        unfinished = [i_id for i_id, _ in self.prefetched] + list(self.claimed)
+        if unfinished:
+            self.store.release(unfinished)
+        self.store.close()
+        return self.df.close(reason)
+
+
+    def has_pending_requests(self) -> bool:
+        if self.local_requests or self.prefetched:
+            return True
+        if self.should_poll():
+            self.store_has_requests = len(self.store) > 0
+        return self.store_has_requests
+
+
+    def __len__(self) -> int:
+        return len(self.local_requests) + len(self.prefetched) + len(self.store)
+
+
+    def enqueue_request(self, request) -> bool:
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+
+        try:
+            data = pickle.dumps(request.to_dict(spider=self.spider), protocol=pickle.HIGHEST_PROTOCOL)
+        except (ValueError, TypeError, AttributeError, pickle.PicklingError) as e:
+            self.spider.logger.warning(f'Unable to serialize request {request}: {e!r} - keeping it in memory')
+            self.local_requests.append(request)
+            self.inc_stats('scheduler/enqueued/memory')
+        else:
+            self.store.push(data, request.priority)
+            self.store_has_requests = True
+            self.inc_stats('scheduler/enqueued/frontier')
+        self.inc_stats('scheduler/enqueued')
+        self.last_active = time.monotonic()
+        return True
+
+
+    def next_request(self):
+        if self.local_requests:
+            request = self.local_requests.popleft()
+            self.inc_stats('scheduler/dequeued/memory')
+        else:
+            self.ack_finished()
+            if self.is_busy():
+                return None
+            if not self.prefetched:
+                if not self.store_has_requests and not self.should_poll():
+                    return None
+                self.prefetched.extend(self.store.claim(self.max_active_requests, self.lease))
+                self.store_has_requests = bool(self.prefetched)
+                if not self.prefetched:
+                    return None
+            request_id, data = self.prefetched.popleft()
+            request = request_from_dict(pickle.loads(data), spider=self.spider)
+            self.claimed[request_id] = request
+            self.inc_stats('scheduler/dequeued/frontier')
+        self.inc_stats('scheduler/dequeued')
+        self.last_active = time.monotonic()
+        return request
+
+
+    def ack_finished(self):
+        """
+        ダウンローダーから出たリクエストをまとめてackする。
+        ダウンローダーは取得し終えたときも、ミドルウェアで捨てたときも、リクエストをactiveから外す。
+        """
+        if not self.claimed or self.crawler is None or self.crawler.engine is None:
+            return
+        active = self.crawler.engine.downloader.active
+        finished = [i_id for i_id, i_request in self.claimed.items() if i_request not in active]
+        if not finished:
+            return
+        for i_id in finished:
+            del self.claimed[i_id]
+        self.store.ack(finished)
+
+
+    def should_poll(self) -> bool:
+        now = time.monotonic()
+        if self.polled_at is not None and now - self.polled_at < self.poll_interval:
+            return False
+        self.polled_at = now
+        return True
+
+
+    def is_busy(self) -> bool:
+        if self.crawler is None or self.crawler.engine is None:
+            return False
+        return len(self.crawler.engine.downloader.active) >= self.max_active_requests
+
+
+    def spider_idle(self, spider):
+        if time.monotonic() - self.last_active < self.idle_timeout:
+            raise DontCloseSpider
+
+
+    def inc_stats(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
+
+
+class SharedDelayMiddleware:
+    """
+    ホストごとのDOWNLOAD_DELAYを、すべてのプロセスを合わせた取得の間隔として守るダウンローダーミドルウェア。
+    ストアで次の取得時刻を予約し、その時刻までリクエストを送らずに待つ。
+    間隔はこのミドルウェアで守るので、Scrapyのダウンローダーのホストごとの待ち時間は0にする。
+    """
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.store = None
+        self.crawler = None
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        delay = crawler.settings.getfloat('DOWNLOAD_DELAY')
+        if not crawler.settings.get('FRONTIER_BACKEND') or delay <= 0:
+            raise NotConfigured
+        s = cls(delay)
+        s.crawler = crawler
+        s.store = create_store(crawler.settings, crawler.spidercls.name)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+
+    def spider_opened(self, spider):
+        # ダウンローダーの待ち時間に予約の待ち時間が重なって、間隔が2倍にならないようにする。
+        # ScrapyのAutoThrottleと同じく、これから作られるスロットの待ち時間を変える
+        self.crawler.engine.downloader._delay = 0
+
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+
+    async def process_request(self, request, spider):
+        slot = request.meta.get('download_slot') or urlparse_cached(request).hostname or ''
+        # ストアへの問い合わせでreactorを止めないよう、別のスレッドで予約する
+        wait = await asyncio.to_thread(self.store.reserve, slot, self.delay)
+        if wait > 0:
+            # TWISTED_REACTORがasyncioのreactorなので、asyncioで待てる
+            await asyncio.sleep(wait)
+        return None
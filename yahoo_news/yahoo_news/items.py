@@ -3,15 +3,38 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
-import scrapy
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
 
 
-class NewsTopicsItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    key = scrapy.Field()
-    title = scrapy.Field()
-    post_time = scrapy.Field()
-    vender = scrapy.Field()
-    description = scrapy.Field()
-    article_url = scrapy.Field()
+@dataclass(slots=True)
+class NewsTopicsItem:
+    """
+    トピックスの記事1件。
+
+    scrapy.Itemはフィールドをdictに持つので、__slots__のdataclassにして1件あたりのメモリを減らす。
+    ScrapyはItemAdapterでdataclassもItemとして扱うので、フィードエクスポートなどはそのまま使える。
+    """
+    key: str
+    title: str
+    post_time: datetime
+    vender: Optional[str]
+    description: Optional[str]
+    article_url: Optional[str]
+
+
+    def to_bson(self) -> dict:
+        """
+        MongoDBに保存するドキュメントを返す。
+        ItemAdapter.asdictは値を再帰的にコピーするので、フィールドをそのまま詰める。
+        post_timeはBSONの日付型になる。
+        """
+        return {
+            'key': self.key,
+            'title': self.title,
+            'post_time': self.post_time,
+            'vender': self.vender,
+            'description': self.description,
+            'article_url': self.article_url,
+        }
@@ -0,0 +1,58 @@
+"""
+処理段階ごとの集計値と、それを書き出す拡張機能。
+集計値の実装はebayと共通の、リポジトリ直下のcommon/metrics.pyにある。
+"""
+import os
+import sys
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from common.metrics import TIME_BUCKETS, SIZE_BUCKETS, Histogram, Metrics, METRICS
+
+
+class MetricsExporter:
+    """
+    METRICS_INTERVAL秒ごとと、Spiderの終了時に集計値を書き出す拡張機能。
+
+    - METRICS_JSON_PATH: 指定した場合、集計値をjsonlineファイルに1行ずつ追記する
+    - METRICS_PROMETHEUS_PATH: 指定した場合、Prometheusのテキスト形式でファイルを置き換える
+    """
+    def __init__(self, json_path, prometheus_path, interval=60, metrics=METRICS):
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.metrics = metrics
+        self.dump_loop = None
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        json_path = crawler.settings.get('METRICS_JSON_PATH')
+        prometheus_path = crawler.settings.get('METRICS_PROMETHEUS_PATH')
+        if not json_path and not prometheus_path:
+            raise NotConfigured
+        s = cls(json_path, prometheus_path, interval=crawler.settings.getfloat('METRICS_INTERVAL', 60))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+
+    def spider_opened(self, spider):
+        self.dump_loop = task.LoopingCall(self.dump)
+        self.dump_loop.start(self.interval, now=False)
+
+
+    def spider_closed(self, spider):
+        if self.dump_loop is not None and self.dump_loop.running:
+            self.dump_loop.stop()
+        self.dump()
+
+
+    def dump(self):
+        if self.json_path:
+            self.metrics.dump_json(self.json_path)
+        if self.prometheus_path:
+            self.metrics.write_prometheus(self.prometheus_path)
@@ -3,11 +3,22 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
+import hashlib
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.utils.python import to_unicode
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from pymongo import UpdateOne
+
+from yahoo_news.utils import AsyncMongoMixin
+from yahoo_news.pipelines import items_stored
+from yahoo_news.metrics import METRICS, SIZE_BUCKETS
+
 
 class YahooNewsSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -26,6 +37,11 @@ class YahooNewsSpiderMiddleware:
         # middleware and into the spider.
 
         # Should return None or raise an exception.
+
+        # HTMLのパースは最初にcss等を呼んだときに行われるので、ここで先に行って時間を測る
+        if hasattr(response, 'selector'):
+            with METRICS.time('yahoo_news_parse_seconds'):
+                response.selector
         return None
 
     def process_spider_output(self, response, result, spider):
@@ -33,8 +49,31 @@ class YahooNewsSpiderMiddleware:
         # it has processed the response.
 
         # Must return an iterable of Request, or item objects.
+
+        # コールバックはジェネレータなので、次の要素を取り出すのにかかった時間を抽出の時間として合計する
+        elapsed = 0
+        start = time.perf_counter()
         for i in result:
+            elapsed += time.perf_counter() - start
+            if is_item(i):
+                METRICS.inc('yahoo_news_items_total')
             yield i
+            start = time.perf_counter()
+        elapsed += time.perf_counter() - start
+        METRICS.observe('yahoo_news_extract_seconds', elapsed)
+
+    async def process_spider_output_async(self, response, result, spider):
+        # process_spider_outputの非同期版。前段のミドルウェアが非同期の出力を返す場合に使われる
+        elapsed = 0
+        start = time.perf_counter()
+        async for i in result:
+            elapsed += time.perf_counter() - start
+            if is_item(i):
+                METRICS.inc('yahoo_news_items_total')
+            yield i
+            start = time.perf_counter()
+        elapsed += time.perf_counter() - start
+        METRICS.observe('yahoo_news_extract_seconds', elapsed)
 
     def process_spider_exception(self, response, exception, spider):
         # Called when a spider or process_spider_input() method
@@ -78,6 +117,9 @@ class YahooNewsDownloaderMiddleware:
         # - or return a Request object
         # - or raise IgnoreRequest: process_exception() methods of
         #   installed downloader middleware will be called
+        request.meta['metrics_started_at'] = time.perf_counter()
+        if request.meta.get('retry_times'):
+            METRICS.inc('yahoo_news_retries_total')
         return None
 
     def process_response(self, request, response, spider):
@@ -87,6 +129,18 @@ class YahooNewsDownloaderMiddleware:
         # - return a Response object
         # - return a Request object
         # - or raise IgnoreRequest
+
+        # download_latencyはリクエストを送ってからレスポンスヘッダーを受け取るまでの時間。
+        # Scrapyは名前解決と接続の時間を区別しないので、それらもここに含まれる。
+        # downloaderの時間はDOWNLOAD_DELAYによる待ち時間とbodyの受信時間を含む。
+        if 'download_latency' in request.meta:
+            METRICS.observe('yahoo_news_ttfb_seconds', request.meta['download_latency'])
+        if 'metrics_started_at' in request.meta:
+            METRICS.observe('yahoo_news_downloader_seconds',
+                            time.perf_counter() - request.meta['metrics_started_at'])
+        METRICS.observe('yahoo_news_response_bytes', len(response.body), buckets=SIZE_BUCKETS)
+        METRICS.inc('yahoo_news_response_bytes_total', len(response.body))
+        METRICS.inc(f'yahoo_news_responses_status_{response.status}_total')
         return response
 
     def process_exception(self, request, exception, spider):
@@ -101,3 +155,135 @@ class YahooNewsDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class ConditionalRequestMiddleware(AsyncMongoMixin):
+    """
+    取得したURLごとにETag/Last-Modifiedと内容のハッシュをMongoDBに保存し、
+    次回以降は条件付きリクエストを送る。304が返ってきた場合や、内容のハッシュが前回と同じ場合は
+    レスポンスを破棄してパースしない。
+
+    ハッシュを取る内容はSpiderのchange_detection_text(response)で指定できる。
+    定義されていなければbody全体のハッシュを取る。
+
+    変更のあったページの取得状態は、そのページのItemをMongoPipelineが書き込んだ(items_stored)ときに保存する。
+    パースに失敗したり、書き込む前にプロセスが止まったりしても、次回は変更ありとしてパースし直す。
+    URLとItemのkeyはSpiderのextract_key(url)で対応させる。取得状態の書き込みはItemの書き込みごとに
+    まとめてMotorで行うので、reactorを止めない。
+    """
+    def __init__(self, mongodb_uri, mongodb_database, stats=None):
+        self.mongo_uri = mongodb_uri
+        self.mongo_db = mongodb_database
+        self.stats = stats
+        self.states = {}
+        # Itemの書き込みを待っている取得状態。Itemのkey -> (URL, 取得状態)
+        self.pending = {}
+        # 次にまとめて書き込む取得状態。URL -> 取得状態
+        self.unsaved = {}
+
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('INCREMENTAL_CRAWL'):
+            raise NotConfigured
+        s = cls(
+            mongodb_uri=crawler.settings.get('MONGODB_URI'),
+            mongodb_database=crawler.settings.get('MONGODB_DATABASE'),
+            stats=crawler.stats,
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.items_stored, signal=items_stored)
+        return s
+
+
+    async def spider_opened(self, spider):
+        await self.setup_mongo_async(self.mongo_uri, self.mongo_db, f'{spider.name}_fetch_states')
+        self.states = {i['key']: i async for i in self.collection.find({}, projection={'_id': False})}
+        spider.logger.info(f'Loaded {len(self.states)} fetch states.')
+
+
+    async def spider_closed(self, spider):
+        # MongoPipelineはspider_closedより前に残りのItemを書き込むので、ここで残っているものは保存しない
+        if self.pending:
+            spider.logger.info(f'{len(self.pending)} fetch states were not saved because their items were not stored.')
+        await self.save_states()
+        self.close_mongo()
+
+
+    def process_request(self, request, spider):
+        state = self.states.get(request.url)
+        if state is None or request.meta.get('dont_check_changes'):
+            return None
+        if state.get('etag'):
+            request.headers.setdefault('If-None-Match', state['etag'])
+        if state.get('last_modified'):
+            request.headers.setdefault('If-Modified-Since', state['last_modified'])
+        return None
+
+
+    def process_response(self, request, response, spider):
+        if request.meta.get('dont_check_changes') or request.url.endswith('/robots.txt'):
+            return response
+        if response.status == 304:
+            self.inc_stats('incremental/not_modified')
+            raise IgnoreRequest(f'Not modified: {request.url}')
+        if response.status != 200:
+            return response
+
+        get_text = getattr(spider, 'change_detection_text', None)
+        content = get_text(response) if get_text is not None else response.body
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        state = self.make_state(request.url, response, content_hash)
+        previous = self.states.get(request.url)
+        if previous is not None and previous.get('hash') == content_hash:
+            # 内容が同じならItemは書き込まれないので、ETagなどが変わっていれば次にまとめて保存する
+            if previous != state:
+                self.states[request.url] = state
+                self.unsaved[request.url] = state
+            self.inc_stats('incremental/unchanged')
+            raise IgnoreRequest(f'Unchanged: {request.url}')
+
+        extract_key = getattr(spider, 'extract_key', None)
+        key = extract_key(request.url) if extract_key is not None else request.url
+        self.pending[key] = (request.url, state)
+        self.inc_stats('incremental/changed')
+        return response
+
+
+    def make_state(self, url, response, content_hash):
+        return {
+            'key': url,
+            'etag': to_unicode(response.headers.get('ETag')) if response.headers.get('ETag') else None,
+            'last_modified': to_unicode(response.headers.get('Last-Modified')) if response.headers.get('Last-Modified') else None,
+            'hash': content_hash,
+        }
+
+
+    async def items_stored(self, keys, spider):
+        """
+        書き込まれたItemのページの取得状態を保存する。
+        """
+        for i_key in keys:
+            if i_key in self.pending:
+                url, state = self.pending.pop(i_key)
+                self.states[url] = state
+                self.unsaved[url] = state
+        await self.save_states()
+
+
+    async def save_states(self):
+        if not self.unsaved:
+            return
+        requests = [UpdateOne({'key': i_url}, {'$set': i_state}, upsert=True)
+                    for i_url, i_state in self.unsaved.items()]
+        self.unsaved = {}
+        await self.collection.bulk_write(requests, ordered=False)
+
+
+    def inc_stats(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(key)
@@ -4,62 +4,247 @@
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
 
+import time
+
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from twisted.internet import task
+from scrapy.utils.defer import deferred_from_coro
+
+from yahoo_news.utils import MongoMixin, AsyncMongoMixin
+from yahoo_news.metrics import METRICS
+
+DUPLICATE_KEY_ERROR_CODE = 11000
+# bulk_writeで書き込んだItemのkeyを通知するシグナル。ConditionalRequestMiddlewareが取得状態の保存に使う
+items_stored = object()
+
 
-from yahoo_news.utils import MongoMixin
+def to_document(item):
+    """
+    ItemをMongoDBに保存するドキュメントにする。to_bsonを持つItemは、ItemAdapterでコピーせずにそのまま変換する。
+    """
+    if hasattr(item, 'to_bson'):
+        return item.to_bson()
+    return ItemAdapter(item).asdict()
 
 
 class MongoPipeline(MongoMixin):
     """
     ItemをMongoDBに保存するPipeline。
+
+    Itemはバッファに溜めておき、MONGODB_BUFFER_SIZE件溜まるか、前回の書き込みから
+    MONGODB_FLUSH_INTERVAL秒経ったときに、keyでupsertするbulk_writeでまとめて書き込む。
     """
     @classmethod
     def from_crawler(cls, crawler):
         return cls(
             mongodb_uri=crawler.settings.get('MONGODB_URI'),
             mongodb_database=crawler.settings.get('MONGODB_DATABASE'),
+            buffer_size=crawler.settings.getint('MONGODB_BUFFER_SIZE', 100),
+            flush_interval=crawler.settings.getfloat('MONGODB_FLUSH_INTERVAL', 5),
+            stats=crawler.stats,
+            signals=crawler.signals,
         )
 
 
-    def __init__(self, mongodb_uri, mongodb_database):
+    def __init__(self, mongodb_uri, mongodb_database, buffer_size=100, flush_interval=5, stats=None,
+                 signals=None):
         self.mongo_uri = mongodb_uri
         self.mongo_db = mongodb_database
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.signals = signals
+        self.buffer = []
+        self.flushed_at = time.monotonic()
+        self.flush_loop = None
 
 
     def open_spider(self, spider):
         """
-        Spiderの開始時にMongoDBに接続する。
+        Spiderの開始時にMongoDBに接続し、定期的にバッファを書き込むループを開始する。
 
         Args:
             spider (_type_): _description_
         """
         mongodb_collection = spider.name
         self.setup_mongo(self.mongo_uri, self.mongo_db, mongodb_collection)
+        if self.flush_interval > 0:
+            self.flush_loop = task.LoopingCall(self.flush_if_expired, spider)
+            self.flush_loop.start(self.flush_interval, now=False)
 
 
     def close_spider(self, spider):
         """
-        Spiderの終了時にMongoDBへの接続を切断する。
+        Spiderの終了時にバッファを書き込み、MongoDBへの接続を切断する。
 
         Args:
             spider (_type_): _description_
         """
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        d = self.flush(spider)
         self.close_mongo()
+        return d
 
 
     def process_item(self, item, spider):
         """
-        Itemをコレクションに追加する。
+        Itemをバッファに追加し、バッファが一杯になったらコレクションに書き込む。
+
+        Args:
+            item (_type_): _description_
+            spider (_type_): _description_
+        """
+        self.buffer.append(item)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush(spider)
+        return item
+
+
+    def flush_if_expired(self, spider):
+        if time.monotonic() - self.flushed_at >= self.flush_interval:
+            return self.flush(spider)
+
+
+    def flush(self, spider):
+        """
+        バッファのItemをkeyでupsertする。重複キーのエラーは数えるだけで例外にはしない。
+        書き込んだらitems_storedを送り、ハンドラーが終わると発火するDeferredを返す。
+
+        Args:
+            spider (_type_): _description_
+        """
+        keys, requests = self.take_requests()
+        if not requests:
+            return None
+
+        try:
+            with METRICS.time('yahoo_news_storage_seconds'):
+                details = self.collection.bulk_write(requests, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            details = self.handle_bulk_write_error(e, spider)
+        self.record_result(details)
+        if self.signals is None:
+            return None
+        return deferred_from_coro(self.signals.send_catch_log_async(items_stored, keys=keys, spider=spider))
+
+
+    def take_requests(self):
+        """
+        バッファのItemをupsertのリクエストに変換し、バッファを空にする。ItemのkeyのリストとリクエストのリストをTupleで返す。
+        順序なしのbulk_writeでは同じkeyのリクエストのどれが最後に書き込まれるか決まらないので、
+        同じkeyのItemはバッファの後のものだけを書き込む。
+        """
+        self.flushed_at = time.monotonic()
+        documents = {}
+        for i_item in self.buffer:
+            document = to_document(i_item)
+            documents[document['key']] = document
+        keys = list(documents)
+        requests = [UpdateOne({'key': i_key}, {'$set': i_document}, upsert=True)
+                    for i_key, i_document in documents.items()]
+        self.buffer = []
+        return keys, requests
+
+
+    def handle_bulk_write_error(self, e, spider):
+        details = e.details
+        other_errors = [i for i in details['writeErrors'] if i['code'] != DUPLICATE_KEY_ERROR_CODE]
+        if other_errors:
+            raise e
+        self.inc_stats('mongodb/duplicate_key_errors', len(details['writeErrors']))
+        spider.logger.info(f'{len(details["writeErrors"])} duplicate keys were skipped')
+        return details
+
+
+    def record_result(self, details):
+        self.inc_stats('mongodb/flushes')
+        self.inc_stats('mongodb/upserted', details.get('nUpserted', 0))
+        self.inc_stats('mongodb/modified', details.get('nModified', 0))
+
+
+    def inc_stats(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+
+class AsyncMongoPipeline(AsyncMongoMixin, MongoPipeline):
+    """
+    MongoPipelineのasyncio版。
+    bulk_writeをMotorで行い、process_itemはawaitableを返すので、書き込みの待ち時間がダウンロードと重なる。
+    """
+    async def open_spider(self, spider):
+        """
+        Spiderの開始時にMongoDBに接続し、定期的にバッファを書き込むループを開始する。
+
+        Args:
+            spider (_type_): _description_
+        """
+        mongodb_collection = spider.name
+        await self.setup_mongo_async(self.mongo_uri, self.mongo_db, mongodb_collection)
+        if self.flush_interval > 0:
+            self.flush_loop = task.LoopingCall(self.flush_if_expired, spider)
+            self.flush_loop.start(self.flush_interval, now=False)
+
+
+    async def close_spider(self, spider):
+        """
+        Spiderの終了時にバッファを書き込み、MongoDBへの接続を切断する。
+
+        Args:
+            spider (_type_): _description_
+        """
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        await self.flush_async(spider)
+        self.close_mongo()
+
+
+    async def process_item(self, item, spider):
+        """
+        Itemをバッファに追加し、バッファが一杯になったらコレクションに書き込む。
 
         Args:
             item (_type_): _description_
             spider (_type_): _description_
         """
-        self.collection.insert_one(dict(item))
+        self.buffer.append(item)
+        if len(self.buffer) >= self.buffer_size:
+            await self.flush_async(spider)
         return item
 
 
+    def flush_if_expired(self, spider):
+        if time.monotonic() - self.flushed_at >= self.flush_interval:
+            return deferred_from_coro(self.flush_async(spider))
+
+
+    async def flush_async(self, spider):
+        """
+        バッファのItemをkeyでupsertする。重複キーのエラーは数えるだけで例外にはしない。
+        awaitしている間に追加されたItemは次の書き込みに回る。
+
+        Args:
+            spider (_type_): _description_
+        """
+        keys, requests = self.take_requests()
+        if not requests:
+            return
+
+        try:
+            with METRICS.time('yahoo_news_storage_seconds'):
+                result = await self.collection.bulk_write(requests, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = self.handle_bulk_write_error(e, spider)
+        self.record_result(details)
+        if self.signals is not None:
+            await self.signals.send_catch_log_async(items_stored, keys=keys, spider=spider)
+
+
 class YahooNewsPipeline:
     def process_item(self, item, spider):
         return item
@@ -44,30 +44,66 @@ DOWNLOAD_DELAY = 3
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "yahoo_news.middlewares.YahooNewsSpiderMiddleware": 543,
-#}
+SPIDER_MIDDLEWARES = {
+    "yahoo_news.middlewares.YahooNewsSpiderMiddleware": 543,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "yahoo_news.middlewares.YahooNewsDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    "yahoo_news.middlewares.YahooNewsDownloaderMiddleware": 543,
+    "yahoo_news.middlewares.ConditionalRequestMiddleware": 580,
+    # HttpCacheMiddleware(900)より後にして、キャッシュから返すリクエストでは待たない
+    "yahoo_news.frontier.SharedDelayMiddleware": 950,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
+EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+    "yahoo_news.metrics.MetricsExporter": 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
-    "yahoo_news.pipelines.MongoPipeline": 800,
+    "yahoo_news.pipelines.AsyncMongoPipeline": 800,
 }
 
 MONGODB_URI = 'mongodb://localhost:27017'
 MONGODB_DATABASE = 'portfolio'
+# MongoPipelineが1回のbulk_writeで書き込む最大件数と、バッファを書き込む間隔(秒)
+MONGODB_BUFFER_SIZE = 100
+MONGODB_FLUSH_INTERVAL = 5
+# 処理済みのkeyがこの件数を超えたら、setの代わりにBloomFilterで保持する
+SEEN_KEYS_BLOOM_THRESHOLD = 1_000_000
+SEEN_KEYS_BLOOM_ERROR_RATE = 0.001
+# Trueにすると、条件付きリクエストと内容のハッシュで変更を検出し、変更のあったページだけパースする
+# cronで数分おきに実行する場合は scrapy crawl news_topics -s INCREMENTAL_CRAWL=True
+INCREMENTAL_CRAWL = False
+
+# 'mongodb'か'redis'にすると、リクエストキューと重複除去をプロセス間で共有し、複数のプロセスでクロールを分担する。
+# DOWNLOAD_DELAYもすべてのプロセスを合わせた間隔になり、プロセスごとの間隔は0になる。Noneならプロセスごとにクロールする
+# scrapy crawl news_topics -s FRONTIER_BACKEND=mongodb を必要な数だけ実行する
+FRONTIER_BACKEND = None
+FRONTIER_REDIS_URL = 'redis://localhost:6379/0'
+SCHEDULER = "yahoo_news.frontier.FrontierScheduler"
+DUPEFILTER_CLASS = "yahoo_news.frontier.FrontierDupeFilter"
+# 取得済みリクエストの指紋を保持する秒数。1回のクロールより長く、cronで実行する間隔より短くする
+FRONTIER_FINGERPRINT_TTL = 10 * 60
+# キューが空になってから、他のプロセスがリクエストを入れるのを待つ秒数
+FRONTIER_IDLE_TIMEOUT = 30
+# 1つのプロセスが同時に取得中にするリクエストの上限。DOWNLOAD_DELAYを守るための待ちも含む
+FRONTIER_MAX_ACTIVE_REQUESTS = 2
+# キューから取り出したリクエストの期限(秒)。取得し終えずにプロセスが止まった場合、期限が過ぎると他のプロセスが取り出す
+FRONTIER_LEASE = 600
+# キューが空のときに、ストアに問い合わせ直す間隔(秒)
+FRONTIER_POLL_INTERVAL = 1
+
+# 処理段階ごとの処理時間などの集計値の書き出し先。どちらも指定しなければ書き出さない
+METRICS_JSON_PATH = None
+METRICS_PROMETHEUS_PATH = None
+METRICS_INTERVAL = 60
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
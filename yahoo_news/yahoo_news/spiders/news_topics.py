@@ -1,6 +1,7 @@
 import re
 from datetime import datetime
 
+from scrapy import Request, signals
 from scrapy.spiders import CrawlSpider, Rule
 from scrapy.linkextractors import LinkExtractor
 
@@ -28,39 +29,73 @@ class NewsTopicsSpider(CrawlSpider, MongoMixin):
             mongodb_database=crawler.settings.get('MONGODB_DATABASE'),
             mongodb_collection=cls.name
         )
+        # 処理済みかどうかをリンクごとにMongoDBへ問い合わせないよう、既存のkeyを先に読み込んでおく
+        spider.seen_keys = spider.load_keys(
+            bloom_threshold=crawler.settings.getint('SEEN_KEYS_BLOOM_THRESHOLD', 1_000_000),
+            error_rate=crawler.settings.getfloat('SEEN_KEYS_BLOOM_ERROR_RATE', 0.001),
+        )
+        crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+        # 差分クロールでは処理済みの記事も取得し、内容が変わっていれば上書きする
+        spider.incremental = crawler.settings.getbool('INCREMENTAL_CRAWL')
         return spider
 
 
+    async def start(self):
+        # トピックス一覧は変わっていなくても、ピックアップ記事の変更を確かめるためにリンクを辿る
+        for i_url in self.start_urls:
+            yield Request(i_url, dont_filter=True, meta={'dont_check_changes': True})
+
+
     def close_mongo(self, spider):
         self.close_mongo()
 
 
     def process_request_before_parse_pickup_article(self, request, response):
         key = self.extract_key(request.url)
-        if not self.collection.find_one({'key': key}):
+        if self.incremental or key not in self.seen_keys:
             return request
         else:
             self.logger.info(f'URL {request.url} already processed, skipping')
 
 
+    def item_scraped(self, item, response, spider):
+        """
+        保存されたItemのkeyを処理済みとして記録する。
+        """
+        self.seen_keys.add(item.key)
+
+
+    def change_detection_text(self, response) -> str:
+        """
+        差分クロールで変更を検出するための内容を返す。
+        広告などページの他の部分が変わっても再パースしないよう、抽出に使う部分だけを対象にする。
+        """
+        return '\n'.join([
+            ''.join(response.css('head title::text').getall()),
+            ''.join(response.css('head meta[name="pubdate"]::attr("content")').getall()),
+            ''.join(response.css('.highLightSearchTarget::text').getall()),
+            ''.join(response.css('article > div > span > a::attr("href")').getall()),
+        ])
+
+
     def parse_pickup_article(self, response):
-        item = NewsTopicsItem()
-        item['key'] = self.extract_key(response.url)
-        item['title'] = response.css('head title::text').get().replace(' - Yahoo!ニュース', '')
         pubdate = response.css('head meta[name="pubdate"]::attr("content")').get()
-        item['post_time'] = self.pubdate2datetime(pubdate)
         vender = response.css('article > div > span > a > span > span::text').get()
         if vender is None:
             vender = response.css('article > div:first-of-type > div > p > a::text').get()
-        item['vender'] = vender
-        item['description'] = self.normalize_spaces(response.css('.highLightSearchTarget::text').get())
-        item['article_url'] = response.css('article > div > span > a::attr("href")').get()
-        yield item
+        yield NewsTopicsItem(
+            key=self.extract_key(response.url),
+            title=response.css('head title::text').get().replace(' - Yahoo!ニュース', ''),
+            post_time=self.pubdate2datetime(pubdate),
+            vender=vender,
+            description=self.normalize_spaces(response.css('.highLightSearchTarget::text').get()),
+            article_url=response.css('article > div > span > a::attr("href")').get(),
+        )
 
 
-    def pubdate2datetime(self, pubdate: str) -> str:
-        dt = datetime.strptime(pubdate, "%Y-%m-%dT%H:%M:%S%z")
-        return dt.strftime("%Y-%m-%d %H:%M:%S")
+    def pubdate2datetime(self, pubdate: str) -> datetime:
+        # タイムゾーン付きのまま返す。MongoDBにはUTCの日付型として保存される
+        return datetime.strptime(pubdate, "%Y-%m-%dT%H:%M:%S%z")
 
 
     def extract_key(self, url: str) -> str:
@@ -1,7 +1,10 @@
 import sys
+import math
+import hashlib
 import logging
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
+from motor.motor_asyncio import AsyncIOMotorClient
 
 
 class MongoMixin:
@@ -21,3 +24,74 @@ class MongoMixin:
 
     def close_mongo(self):
         self.client.close()
+
+
+    def load_keys(self, bloom_threshold=1_000_000, error_rate=0.001):
+        """
+        コレクションのkeyをすべて読み込む。
+        件数がbloom_threshold以下ならset、それより多ければBloomFilterに入れて返す。
+
+        Args:
+            bloom_threshold (int, optional): _description_. Defaults to 1_000_000.
+            error_rate (float, optional): BloomFilterの偽陽性率. Defaults to 0.001.
+        """
+        key_num = self.collection.estimated_document_count()
+        if key_num <= bloom_threshold:
+            keys = set()
+        else:
+            # 実行中に追加されるkeyの分も見込んでおく
+            keys = BloomFilter(capacity=key_num * 2, error_rate=error_rate)
+
+        for i_document in self.collection.find({}, projection={'key': True, '_id': False}):
+            keys.add(i_document['key'])
+        self.mongo_logger.info(f'Loaded {key_num} keys into {type(keys).__name__}.')
+        return keys
+
+
+class AsyncMongoMixin:
+    """
+    MongoMixinのasyncio版。Motorを使うので、MongoDBへの問い合わせ中もreactorを止めない。
+    """
+    async def setup_mongo_async(self, mongodb_uri, mongodb_database, mongodb_collection):
+        self.mongo_logger = logging.getLogger(__name__)
+        self.client = AsyncIOMotorClient(mongodb_uri)
+        try:
+            await self.client.admin.command('ismaster')
+        except ConnectionFailure:
+            self.mongo_logger.error('Could not connect to MongoDB server. Please make sure mongod process is running.')
+            sys.exit(1)
+
+        self.db = self.client[mongodb_database]
+        self.collection = self.db[mongodb_collection]
+        await self.collection.create_index('key', unique=True)
+
+
+    def close_mongo(self):
+        self.client.close()
+
+
+class BloomFilter:
+    """
+    偽陽性率error_rateでcapacity個の要素を保持できるBloomFilter。
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        self.bit_num = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_num = max(1, round(self.bit_num / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.bit_num / 8))
+
+
+    def positions(self, value):
+        # 128bitのハッシュを2つに分けて、ダブルハッシュでhash_num個の位置を作る
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bit_num for i in range(self.hash_num)]
+
+
+    def add(self, value):
+        for i in self.positions(value):
+            self.bits[i >> 3] |= 1 << (i & 7)
+
+
+    def __contains__(self, value):
+        return all(self.bits[i >> 3] & (1 << (i & 7)) for i in self.positions(value))